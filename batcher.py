@@ -0,0 +1,132 @@
+'''
+micro-batching embedding engine
+
+- callers submit lists of sentences (usually one post's worth) and get a Future back
+- one background thread collects submissions from every caller (many posts, many concurrent
+  ingests) into batches bounded by size (EMBEDDING_BATCH_SIZE sentences) and time
+  (EMBEDDING_BATCH_MAX_WAIT_MS after the first sentence arrives)
+- each batch is one encode() call; the rows are then scattered back to the matching futures
+- the transformer is much faster per sentence on big batches, especially on cpu-only hosts
+- with an embedding process pool (EMBEDDING_PROCESSES > 1) a batch holds EMBEDDING_BATCH_SIZE
+  sentences per process, so one batch keeps every worker busy
+- each batch's encode() time goes to metrics.STAGE_SECONDS as the "embed" stage
+
+'''
+
+from concurrent.futures import Future
+from encoder import encode
+import numpy as np
+import config
+import metrics
+import queue
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+class EmbeddingBatcher:
+    def __init__(self, encode_fn=encode, batch_size: int = 64, max_wait_ms: float = 10):
+        self.encode_fn = encode_fn
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._requests = queue.Queue()
+        self._carry = None  # request that did not fit in the previous batch
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: list[str]) -> Future:
+        '''
+        queue texts for embedding. the future resolves to an array with one row per text.
+        '''
+        future = Future()
+        if not texts:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+        else:
+            self._requests.put((list(texts), future))
+        return future
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        '''
+        blocking helper: submit and wait.
+        '''
+        return self.submit(texts).result()
+
+    def close(self):
+        '''
+        finish whatever is queued, then stop the background thread.
+        '''
+        self._requests.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self):
+        '''
+        block for the first request, then keep collecting until the batch is full or the deadline passes.
+        returns None once close() was called and nothing is left.
+        '''
+        first = self._carry if self._carry is not None else self._requests.get()
+        self._carry = None
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is _STOP or size + len(request[0]) > self.batch_size:
+                # does not fit (or is the stop signal): it starts the next batch
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                with metrics.STAGE_SECONDS.time(stage="embed"):
+                    embeddings = self.encode_fn(texts, batch_size=self.batch_size)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} sentences failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+def get_batcher() -> EmbeddingBatcher:
+    '''
+    return the process-wide batcher, starting it on first use.
+    '''
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EmbeddingBatcher(
+                batch_size=config.EMBEDDING_BATCH_SIZE * max(config.EMBEDDING_PROCESSES, 1),
+                max_wait_ms=config.EMBEDDING_BATCH_MAX_WAIT_MS,
+            )
+        return _batcher
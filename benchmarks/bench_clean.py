@@ -0,0 +1,86 @@
+'''
+micro-benchmark: cleaner.clean_html vs the old regex cleaner
+
+usage:
+    python benchmarks/bench_clean.py FEED [FEED ...]   (feed urls or files; their post bodies are used)
+    python benchmarks/bench_clean.py                   (synthetic blog-style bodies)
+
+reports time per body, output size and a rough sentence count (fewer sentences = fewer embeddings).
+'''
+import os
+import re
+import sys
+import time
+from html import unescape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser
+import config
+from cleaner import clean_html
+
+SENTENCE_END = re.compile(r"[.!?](?:\s|$)")
+
+def regex_clean(raw_html: str) -> str:
+    # the cleaner used before cleaner.py
+    clean_text = re.sub(r'<.*?>', '', raw_html)
+    return unescape(clean_text.strip())
+
+def feed_bodies(sources: list[str]) -> list[str]:
+    bodies = []
+    for source in sources:
+        for entry in feedparser.parse(source).entries:
+            content = entry.get("content", [{}])[0].get("value", "") or entry.get("summary", "")
+            if content:
+                bodies.append(content)
+    return bodies
+
+def synthetic_bodies(count: int = 200) -> list[str]:
+    paragraph = ("<p>Teams that ship <a href='https://example.com/x?utm_source=rss'>smaller changes</a> "
+                 "recover from incidents faster&nbsp;&mdash; and their <em>reviewers</em> catch more.</p>\n")
+    chrome = ("<nav><ul>" + "<li><a href='/'>Section</a></li>" * 12 + "</ul></nav>"
+              "<script>window.dataLayer=window.dataLayer||[];function gtag(){dataLayer.push(arguments)}"
+              " if (a < b && c > d) { track('view'); }</script>"
+              "<style>.post p{margin:0 0 1em} .share a{color:#333}</style>")
+    footer = "<footer><p>The post appeared first on Example Blog.</p><p>Share this: Twitter. Facebook.</p></footer>"
+    # mostly normal posts, plus a few full-text archive pages
+    return [chrome + paragraph * (2000 if i % 50 == 0 else 5 + i % 40) + footer for i in range(count)]
+
+def bench(fn, bodies: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            fn(body)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(label: str, bodies: list[str]):
+    size = sum(map(len, bodies))
+    print(f"\n{label}: {len(bodies)} bodies, {size / 1024:.0f} KB of html")
+    print(f"{'cleaner':<14}{'ms/body':>10}{'MB/s':>8}{'chars out':>12}{'sentences':>11}")
+
+    results = {}
+    for name, fn in (("regex (old)", regex_clean), ("cleaner.py", clean_html)):
+        seconds = bench(fn, bodies, repeat=5)
+        outputs = [fn(body) for body in bodies]
+        chars = sum(map(len, outputs))
+        sentences = sum(len(SENTENCE_END.findall(text)) for text in outputs)
+        results[name] = seconds
+        print(f"{name:<14}{seconds / len(bodies) * 1000:>10.3f}{size / seconds / 1e6:>8.1f}{chars:>12}{sentences:>11}")
+
+    print(f"speedup: {results['regex (old)'] / results['cleaner.py']:.2f}x")
+
+def main():
+    bodies = feed_bodies(sys.argv[1:]) if len(sys.argv) > 1 else synthetic_bodies()
+    if not bodies:
+        sys.exit("No post bodies found.")
+
+    # bodies that produce more text than CLEAN_MAX_CHARS are where the early stop pays off
+    large = [body for body in bodies if len(body) > 4 * config.CLEAN_MAX_CHARS] if config.CLEAN_MAX_CHARS else []
+    report("all posts", bodies)
+    if large and len(large) < len(bodies):
+        report(f"bodies over {4 * config.CLEAN_MAX_CHARS // 1024} KB", large)
+
+if __name__ == "__main__":
+    main()
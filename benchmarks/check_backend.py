@@ -0,0 +1,119 @@
+'''
+accuracy + speed check: the configured embedding backend vs the plain torch model
+
+usage:
+    EMBEDDING_BACKEND=onnx EMBEDDING_QUANTIZE=avx2 python benchmarks/check_backend.py [FEED ...]
+
+sentences come from the given feeds (urls or files), or a built-in set of paraphrases.
+reports how close each vector is to its torch counterpart, how much the pairwise cosine scores
+move, how many sentence pairs change side of the theme threshold (0.8, see cluster.py), whether
+nearest neighbours stay the same, and sentences per second for both.
+exits with 1 if a vector drifts below MIN_SELF_COSINE or more than MAX_FLIPPED of the pairs flip.
+'''
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser
+import config
+import encoder
+import sentences as sentence_splitter
+from cleaner import clean_html
+
+THRESHOLD = 0.8
+MIN_SELF_COSINE = 0.98
+MAX_FLIPPED = 0.01
+
+SAMPLE = [
+    "Small, frequent releases make it easier to find the change that broke production.",
+    "Shipping small changes often helps teams locate the commit behind an outage.",
+    "Teams that deploy little and often recover from incidents faster.",
+    "Large batch releases hide the cause of failures.",
+    "Remote work lets companies hire from a much larger talent pool.",
+    "Hiring remotely widens the pool of candidates a company can reach.",
+    "Distributed teams need written communication to stay aligned.",
+    "Offices still matter for onboarding junior engineers.",
+    "Battery prices have fallen sharply over the past decade.",
+    "The cost of lithium-ion batteries dropped dramatically in ten years.",
+    "Cheaper batteries are making grid storage projects viable.",
+    "Solar and storage now undercut new gas plants in many markets.",
+    "Code review catches design problems earlier than testing does.",
+    "Reviewing code finds architectural issues before QA gets involved.",
+    "Pair programming can replace some asynchronous review.",
+    "Automated tests should run on every pull request.",
+    "Interest rates shape how startups raise money.",
+    "Higher rates made venture funding harder to get.",
+    "Founders are prioritizing profitability over growth.",
+    "Cheap capital fueled a decade of unprofitable expansion.",
+]
+
+def feed_sentences(sources: list[str]) -> list[str]:
+    found = []
+    for source in sources:
+        for entry in feedparser.parse(source).entries:
+            content = entry.get("content", [{}])[0].get("value", "") or entry.get("summary", "")
+            found.extend(sentence_splitter.split(clean_html(content)))
+    return list(dict.fromkeys(found))
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def timed_encode(model, texts: list[str], repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = model.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE)
+        best = min(best, time.perf_counter() - start)
+    return normalize(np.asarray(vectors, dtype=np.float32)), best
+
+def main():
+    texts = feed_sentences(sys.argv[1:]) if len(sys.argv) > 1 else SAMPLE
+    if len(texts) < 2:
+        sys.exit("Need at least two sentences.")
+    if config.EMBEDDING_BACKEND == "torch":
+        print("note: EMBEDDING_BACKEND is torch, this compares torch with itself")
+
+    from sentence_transformers import SentenceTransformer
+    baseline_model = SentenceTransformer(config.MODEL_NAME, device="cpu")
+    if config.EMBEDDING_MAX_SEQ_LENGTH:
+        baseline_model.max_seq_length = config.EMBEDDING_MAX_SEQ_LENGTH
+    # the model itself, not encoder.encode(): the cache would hand back torch vectors
+    candidate_model = encoder.get_model()
+
+    baseline, baseline_seconds = timed_encode(baseline_model, texts)
+    candidate, candidate_seconds = timed_encode(candidate_model, texts)
+
+    self_cosine = np.sum(baseline * candidate, axis=1)
+    upper = np.triu_indices(len(texts), k=1)
+    baseline_scores = (baseline @ baseline.T)[upper]
+    candidate_scores = (candidate @ candidate.T)[upper]
+    drift = np.abs(baseline_scores - candidate_scores)
+    flipped = int(np.sum((baseline_scores >= THRESHOLD) != (candidate_scores >= THRESHOLD)))
+
+    def neighbours(vectors):
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return scores.argmax(axis=1)
+    same_neighbour = float(np.mean(neighbours(baseline) == neighbours(candidate)))
+
+    print(f"{len(texts)} sentences, {len(baseline_scores)} pairs, backend {config.EMBEDDING_BACKEND}"
+          f"{' int8 ' + config.EMBEDDING_QUANTIZE if config.EMBEDDING_BACKEND == 'onnx' and config.EMBEDDING_QUANTIZE else ''}")
+    print(f"vector cosine vs torch:    mean {self_cosine.mean():.5f}  min {self_cosine.min():.5f}")
+    print(f"pairwise score drift:      mean {drift.mean():.5f}  max {drift.max():.5f}")
+    print(f"pairs over {THRESHOLD} (torch):    {int(np.sum(baseline_scores >= THRESHOLD))}, changed side: {flipped}")
+    print(f"same nearest neighbour:    {same_neighbour:.1%}")
+    print(f"sentences/s:               torch {len(texts) / baseline_seconds:.0f}, "
+          f"{config.EMBEDDING_BACKEND} {len(texts) / candidate_seconds:.0f} "
+          f"({baseline_seconds / candidate_seconds:.2f}x)")
+
+    if self_cosine.min() < MIN_SELF_COSINE or flipped > MAX_FLIPPED * len(baseline_scores):
+        print("FAIL: scores moved too far from torch for the theme threshold to mean the same")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
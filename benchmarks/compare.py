@@ -0,0 +1,77 @@
+'''
+compare two run_benchmarks.py results, e.g. the main branch against a change
+
+usage:
+    python benchmarks/compare.py BASE.json NEW.json [--tolerance 0.1]
+
+prints every timing and throughput found in both files with the relative change, and marks it as
+a regression when it got worse by more than --tolerance (10% by default): throughputs (*_per_second)
+should go up, times (*_ms, *_seconds) down. exits with 1 if anything regressed.
+numbers from different hosts or settings don't compare; both are printed first.
+'''
+import argparse
+import json
+import sys
+
+def flatten(value, prefix: str = "") -> dict:
+    if isinstance(value, dict):
+        found = {}
+        for key, item in value.items():
+            found.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return found
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+def direction(metric: str) -> int:
+    '''
+    1 if higher is better, -1 if lower is better, 0 if it's not a performance number.
+    '''
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith("_per_second"):
+        return 1
+    if name.endswith("_ms") or name.endswith("seconds"):
+        return -1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    for label, report in (("base", base), ("new", new)):
+        print(f"{label}: {report.get('commit')} on {report.get('host', {}).get('platform')}, {report.get('started_at')}")
+    changed = {key for key in set(base.get("settings", {})) | set(new.get("settings", {}))
+               if base.get("settings", {}).get(key) != new.get("settings", {}).get(key)}
+    for key in sorted(changed):
+        print(f"  setting {key}: {base['settings'].get(key)!r} -> {new['settings'].get(key)!r}")
+    print()
+
+    old_values = flatten(base.get("scales", {}))
+    new_values = flatten(new.get("scales", {}))
+    regressions = 0
+    width = max((len(metric) for metric in old_values), default=0)
+    for metric in sorted(set(old_values) & set(new_values)):
+        better = direction(metric)
+        if not better:
+            continue
+        old, current = old_values[metric], new_values[metric]
+        change = (current - old) / old if old else 0.0
+        regressed = change * better < -args.tolerance
+        regressions += regressed
+        print(f"{metric:<{width}}  {old:>12.3f} -> {current:>12.3f}  {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+    print("\nno regressions")
+
+if __name__ == "__main__":
+    main()
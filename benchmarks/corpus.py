@@ -0,0 +1,243 @@
+'''
+synthetic, reproducible corpus for the benchmarks (see run_benchmarks.py)
+
+usage:
+    python benchmarks/corpus.py feeds DIR [--feeds 10] [--posts 50] [--seed 0]
+        write rss files DIR/feed-000.xml ... (serve them with feed_server.py, or ingest the paths)
+    DATABASE_URL=sqlite:///bench.db python benchmarks/corpus.py seed --theses 100000 [--dim 0] [--seed 0]
+        fill an empty database with theses and themes, without running the model
+
+- post bodies are sentences built from per-topic word lists (plus a little shared filler), so the
+  real model groups posts of a topic together while no two bodies are near-duplicates
+- seeded theses get synthetic unit vectors: one random direction per theme plus noise (cosine
+  ~0.9 to their theme), THESES_PER_THEME theses per theme, written with bulk inserts in chunks so
+  1M rows take minutes and flat memory. --dim 0 asks the configured model for its dimension, so
+  new posts can be matched against the seeded themes
+- everything comes from --seed: the same arguments give the same corpus on every machine
+
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+THESES_PER_THEME = 20
+CHUNK_ROWS = 10000
+START = datetime(2024, 1, 1)
+
+TOPICS = {
+    "deployment": (
+        ["Small releases", "Continuous delivery", "Feature flags", "Canary deploys", "Trunk-based development", "Rollback tooling"],
+        ["shorten", "expose", "simplify", "reduce", "speed up", "de-risk"],
+        ["incident recovery", "the search for a bad commit", "production outages", "release planning", "on-call load", "code review queues"],
+    ),
+    "remote work": (
+        ["Remote hiring", "Distributed teams", "Written decision logs", "Async standups", "Home offices", "Flexible hours"],
+        ["widen", "slow down", "change", "improve", "complicate", "reshape"],
+        ["the candidate pool", "onboarding of junior engineers", "team alignment", "office leases", "meeting culture", "employee retention"],
+    ),
+    "batteries": (
+        ["Lithium-ion cells", "Grid storage projects", "Sodium batteries", "Battery recycling", "Solid-state designs", "Cheaper cathodes"],
+        ["undercut", "stabilize", "accelerate", "transform", "lower the cost of", "extend"],
+        ["new gas plants", "the power grid", "electric vehicle range", "solar adoption", "peak electricity prices", "mining demand"],
+    ),
+    "venture funding": (
+        ["Higher interest rates", "Seed investors", "Down rounds", "Revenue-based financing", "Late-stage funds", "Bootstrapped founders"],
+        ["squeeze", "reward", "delay", "reprice", "discipline", "redirect"],
+        ["startup valuations", "growth at all costs", "profitability targets", "hiring plans", "exit timelines", "founder equity"],
+    ),
+    "language models": (
+        ["Large language models", "Retrieval pipelines", "Fine-tuned assistants", "Open weights", "Inference costs", "Evaluation suites"],
+        ["automate", "distort", "commoditize", "accelerate", "undermine", "reshape"],
+        ["customer support", "search engines", "software documentation", "junior programming work", "content moderation", "translation services"],
+    ),
+    "urban transit": (
+        ["Protected bike lanes", "Congestion pricing", "Bus rapid transit", "Zoning reform", "Light rail extensions", "Car-free streets"],
+        ["revive", "cut", "reorganize", "fund", "calm", "densify"],
+        ["downtown retail", "commute times", "housing supply", "traffic deaths", "city budgets", "air quality"],
+    ),
+    "databases": (
+        ["Write-ahead logging", "Columnar storage", "Embedded databases", "Connection pooling", "Query planners", "Vector indexes"],
+        ["speed up", "complicate", "replace", "bottleneck", "simplify", "reshape"],
+        ["analytics workloads", "mobile apps", "read-heavy services", "schema migrations", "similarity search", "backup strategies"],
+    ),
+    "nutrition": (
+        ["Ultra-processed foods", "Intermittent fasting", "Protein intake", "Seed oils", "Fiber-rich diets", "Added sugar"],
+        ["raise", "lower", "influence", "disrupt", "support", "mask"],
+        ["metabolic health", "appetite signals", "muscle retention", "gut bacteria", "heart disease risk", "sleep quality"],
+    ),
+}
+QUALIFIERS = [
+    "according to a {n}-company survey", "in {year}", "by roughly {n} percent", "for most teams we studied",
+    "in the long run", "more than critics expected", "within {n} months", "across {n} countries",
+    "despite the hype", "in every case we examined",
+]
+
+def sentence(rng: random.Random, topic: str) -> str:
+    subjects, verbs, objects = TOPICS[topic]
+    qualifier = rng.choice(QUALIFIERS).format(n=rng.randint(2, 90), year=rng.randint(2015, 2025))
+    return f"{rng.choice(subjects)} {rng.choice(verbs)} {rng.choice(objects)} {qualifier}."
+
+def post(rng: random.Random, topic: str = None, sentences: tuple = (6, 14)) -> tuple:
+    '''
+    (topic, title, html body) of one synthetic blog post.
+    '''
+    topic = topic or rng.choice(sorted(TOPICS))
+    lines = [sentence(rng, topic) for _ in range(rng.randint(*sentences))]
+    paragraphs = ["<p>" + " ".join(lines[i:i + 3]) + "</p>" for i in range(0, len(lines), 3)]
+    title = lines[0].rstrip(".").split(" ", 4)
+    return topic, " ".join(title[:4]).title(), "\n".join(paragraphs)
+
+def bodies(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [post(rng)[2] for _ in range(count)]
+
+def feed_xml(name: str, posts: list[tuple]) -> str:
+    '''
+    an rss 2.0 document; posts are (title, link, html body, published datetime).
+    '''
+    items = "".join(
+        f"<item><title>{escape(title)}</title><link>{escape(link)}</link>"
+        f"<guid>{escape(link)}</guid><pubDate>{format_datetime(published)}</pubDate>"
+        f"<description>{escape(body)}</description></item>\n"
+        for title, link, body, published in posts
+    )
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+            f"<title>{escape(name)}</title><link>https://bench.example/{escape(name)}</link>"
+            f"<description>synthetic benchmark feed</description>\n{items}</channel></rss>\n")
+
+def write_feeds(directory: str, feeds: int = 10, posts: int = 50, seed: int = 0) -> list[str]:
+    '''
+    write feeds rss files of posts entries each; returns their paths.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for number in range(feeds):
+        name = f"feed-{number:03d}"
+        entries = []
+        for index in range(posts):
+            _, title, body = post(rng)
+            published = START + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            entries.append((title, f"https://bench.example/{seed}/{name}/{index}", body, published))
+        path = os.path.join(directory, f"{name}.xml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(feed_xml(name, entries))
+        paths.append(path)
+    return paths
+
+def model_dimension() -> int:
+    import encoder
+    model = encoder.get_model()
+    return model.get_sentence_embedding_dimension() or len(model.encode("dimension probe"))
+
+def seed_database(theses: int, dim: int, seed: int = 0, theses_per_theme: int = THESES_PER_THEME) -> dict:
+    '''
+    bulk-insert theses with synthetic embeddings plus their themes into the configured (empty) database.
+    '''
+    from sqlalchemy import insert, text
+    from db import engine, get_session, init_db
+    from models import Thesis, Theme
+    from urls import url_hash
+
+    init_db()
+    with get_session() as session:
+        if session.execute(text("SELECT 1 FROM thesis LIMIT 1")).first():
+            raise SystemExit("The database already has theses; seed an empty one.")
+
+    rng = np.random.default_rng(seed)
+    text_rng = random.Random(seed)
+    themes = max(1, theses // theses_per_theme)
+    theme_ids = [str(uuid.UUID(int=text_rng.getrandbits(128), version=4)) for _ in range(themes)]
+    topics = [text_rng.choice(sorted(TOPICS)) for _ in range(themes)]
+
+    centers = rng.standard_normal((themes, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = np.sqrt(0.23 / dim)  # |noise|^2 ~ 0.23, so cosine to the center ~0.9
+    sums = np.zeros((themes, dim), dtype=np.float64)
+    counts = np.zeros(themes, dtype=np.int64)
+    first_seen = np.full(themes, np.iinfo(np.int64).max)
+    last_seen = np.zeros(themes, dtype=np.int64)
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    with get_session() as session:
+        for start in range(0, theses, CHUNK_ROWS):
+            rows = min(CHUNK_ROWS, theses - start)
+            members = rng.integers(0, themes, rows)
+            vectors = centers[members] + rng.normal(0, noise, (rows, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            minutes = rng.integers(0, 365 * 24 * 60, rows)
+
+            values = []
+            for i in range(rows):
+                link = f"https://bench.example/seed-{seed}/{start + i}"
+                values.append({
+                    "thesis_text": sentence(text_rng, topics[members[i]]),
+                    "post_title": f"Seeded post {start + i}",
+                    "post_url": link,
+                    "url_hash": url_hash(link),
+                    "published_at": START + timedelta(minutes=int(minutes[i])),
+                    "ingested_at": now,
+                    "embedding": vectors[i],
+                    "theme_id": theme_ids[members[i]],
+                })
+            session.execute(insert(Thesis), values)
+            session.commit()
+
+            np.add.at(sums, members, vectors)
+            np.add.at(counts, members, 1)
+            np.minimum.at(first_seen, members, minutes)
+            np.maximum.at(last_seen, members, minutes)
+            print(f"seeded {start + rows}/{theses} theses", file=sys.stderr)
+
+        session.execute(insert(Theme), [{
+            "id": theme_ids[t],
+            "centroid_sum": sums[t],
+            "member_count": int(counts[t]),
+            "first_seen_at": START + timedelta(minutes=int(first_seen[t])),
+            "last_seen_at": START + timedelta(minutes=int(last_seen[t])),
+        } for t in range(themes) if counts[t]])
+        session.commit()
+
+    if engine.dialect.name == "sqlite":
+        # fold the wal into the main file, so the database can be copied as one file
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {"theses": theses, "themes": int(np.count_nonzero(counts)), "dim": dim,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark corpus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    feeds = commands.add_parser("feeds", help="write rss feed files")
+    feeds.add_argument("directory")
+    feeds.add_argument("--feeds", type=int, default=10)
+    feeds.add_argument("--posts", type=int, default=50, help="entries per feed")
+    feeds.add_argument("--seed", type=int, default=0)
+    seed = commands.add_parser("seed", help="fill the DATABASE_URL database with theses and themes")
+    seed.add_argument("--theses", type=int, required=True)
+    seed.add_argument("--dim", type=int, default=0, help="embedding size, 0 = the configured model's")
+    seed.add_argument("--seed", type=int, default=0)
+    seed.add_argument("--theses-per-theme", type=int, default=THESES_PER_THEME)
+    args = parser.parse_args()
+
+    if args.command == "feeds":
+        for path in write_feeds(args.directory, args.feeds, args.posts, args.seed):
+            print(path)
+    else:
+        stats = seed_database(args.theses, args.dim or model_dimension(), args.seed, args.theses_per_theme)
+        print(json.dumps(stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+'''
+local http stub that serves a directory of feed files, so fetch benchmarks never touch the network
+
+usage:
+    python benchmarks/feed_server.py DIR [PORT]     (serves DIR on 127.0.0.1, PORT 0 = any free port)
+
+run_benchmarks.py starts it in a background thread with serve(). it answers conditional GETs
+(If-Modified-Since) like a real feed host, keeps connections alive and logs nothing.
+'''
+import functools
+import os
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the feed hosts httpx talks to
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory: str, port: int = 0) -> tuple:
+    '''
+    start serving directory in a daemon thread; returns (server, base url). stop with server.shutdown().
+    '''
+    handler = functools.partial(_QuietHandler, directory=os.path.abspath(directory))
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="feed-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python benchmarks/feed_server.py DIR [PORT]")
+    server, base_url = serve(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    print(f"Serving {sys.argv[1]} at {base_url}/, Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
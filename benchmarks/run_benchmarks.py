@@ -0,0 +1,455 @@
+'''
+benchmark suite: thesis extraction, theme matching, end-to-end ingest and /themes reads at several
+corpus sizes, written out as json so runs can be compared across commits (compare.py)
+
+usage:
+    python benchmarks/run_benchmarks.py [--scales 1k,100k,1m] [--only extract,match,search,ingest,themes]
+                                        [--workdir bench_data] [--output results.json]
+    python benchmarks/compare.py base.json new.json
+
+- for each scale a database with that many theses is seeded once (corpus.py, synthetic vectors,
+  no model) and kept in --workdir; every run works on a fresh copy of it, so numbers don't drift
+  from run to run and the 1M corpus is only built once
+- each scale runs in its own process (config.py reads DATABASE_URL at import time) with the
+  embedding cache off, so the model really runs. every other setting (EMBEDDING_*, SENTENCE_SPLITTER,
+  THEME_INDEX_MODE, ...) comes from the environment as usual and is recorded in the output
+- extract: extract_thesis() one post at a time and extract_theses() on all of them, posts/s
+- match: find_matching_theme() latency percentiles against every theme of the corpus, half the
+  queries close to an existing theme and half new, plus the time to load the index
+- search: time to load the thesis search index, then index latency percentiles for top-10 queries
+  without a filter and within a one-month date range (the query embedding is not included)
+- ingest: parse_feed() feed by feed and parse_feeds() on the rest, posts/s, over synthetic feeds
+  served by a local http stub (feed_server.py), or read as files with --feed-source file
+- themes: /themes and /themes/{id} latency percentiles and requests/s from --concurrency clients,
+  against uvicorn running the app in its own process
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import corpus
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+BENCHMARKS = ("extract", "match", "search", "ingest", "themes")
+RECORDED_SETTINGS = (
+    "MODEL_NAME", "EMBEDDING_BACKEND", "EMBEDDING_QUANTIZE", "EMBEDDING_DEVICE", "EMBEDDING_THREADS",
+    "EMBEDDING_PROCESSES", "EMBEDDING_BATCH_SIZE", "EMBEDDING_MAX_SEQ_LENGTH", "EMBEDDING_STORAGE",
+    "SENTENCE_SPLITTER", "EXTRACT_MAX_SENTENCES", "THEME_INDEX_MODE", "SEARCH_INDEX_MODE", "NEAR_DUPLICATE_SIMILARITY",
+    "PIPELINE_COMMIT_SIZE", "DB_JOURNAL_MODE", "DB_SYNCHRONOUS",
+)
+
+def parse_scale(name: str) -> int:
+    return SCALES[name.lower()] if name.lower() in SCALES else int(name)
+
+def latency(seconds: list) -> dict:
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if not ms.size:
+        return {"count": 0}
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p90_ms": round(float(np.percentile(ms, 90)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+def throughput(posts: int, seconds: float, **extra) -> dict:
+    result = {"posts": posts, "seconds": round(seconds, 4), "posts_per_second": round(posts / seconds, 2) if seconds else None}
+    result.update(extra)
+    return result
+
+def git_commit():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return sha + ("-dirty" if dirty else "")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# --- the benchmarks, run in the per-scale process ---
+
+def bench_extract(args) -> dict:
+    from cleaner import clean_html
+    from extractor import extract_thesis, extract_theses, split_sentences
+
+    contents = [clean_html(body) for body in corpus.bodies(args.extract_posts, args.seed + 1)]
+    extract_thesis(contents[0])  # model + sentence splitter load, not timed
+    sentences = sum(len(split_sentences(content)) for content in contents)
+
+    started = time.perf_counter()
+    for content in contents:
+        extract_thesis(content)
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    extract_theses(contents)
+    batched = time.perf_counter() - started
+
+    return {
+        "sentences": sentences,
+        "extract_thesis": throughput(len(contents), single, sentences_per_second=round(sentences / single, 1)),
+        "extract_theses": throughput(len(contents), batched, sentences_per_second=round(sentences / batched, 1)),
+    }
+
+def bench_match(args) -> dict:
+    import cluster
+    import config
+    from sqlmodel import select
+    from sqlalchemy import func
+    from db import get_session
+    from models import Theme
+
+    started = time.perf_counter()
+    index = cluster.get_theme_index()
+    index.wait_for_training()  # ivf trains in the background; time it as part of the load
+    load_seconds = time.perf_counter() - started
+
+    with get_session() as session:
+        theme_ids = set(session.exec(select(Theme.id)).all())
+        stored = session.exec(
+            select(Theme.centroid_sum).where(Theme.member_count > 0).order_by(func.random()).limit(args.match_queries // 2)
+        ).all()
+
+    rng = np.random.default_rng(args.seed + 3)
+    dim = len(stored[0]) if stored else corpus.model_dimension()
+    queries = []
+    for position in (rng.integers(len(stored), size=args.match_queries // 2) if stored else []):
+        vector = np.asarray(stored[position], dtype=np.float32)
+        vector = vector / np.linalg.norm(vector) + rng.normal(0, np.sqrt(0.1 / dim), dim).astype(np.float32)
+        queries.append(vector / np.linalg.norm(vector))
+    while len(queries) < args.match_queries:
+        vector = rng.standard_normal(dim).astype(np.float32)
+        queries.append(vector / np.linalg.norm(vector))
+    rng.shuffle(queries)
+
+    cluster.find_matching_theme(queries[0])  # warm-up
+    seconds, matched = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        theme_id = cluster.find_matching_theme(query)
+        seconds.append(time.perf_counter() - started)
+        matched += theme_id in theme_ids
+
+    return {
+        "themes": len(index),
+        "index_mode": config.THEME_INDEX_MODE,
+        "index_load_seconds": round(load_seconds, 4),
+        "matched": round(matched / len(queries), 4),
+        "latency": latency(seconds),
+    }
+
+def bench_search(args) -> dict:
+    import config
+    import search
+
+    started = time.perf_counter()
+    index = search.get_thesis_index()
+    index.vectors.wait_for_training()
+    load_seconds = time.perf_counter() - started
+    if not len(index):
+        return {"skipped": "no theses"}
+
+    rng = np.random.default_rng(args.seed + 5)
+    stored = index.vectors._matrix[rng.integers(len(index), size=args.search_queries)]
+    queries = stored + rng.normal(0, np.sqrt(0.1 / stored.shape[1]), stored.shape).astype(np.float32)
+    month = (datetime(2024, 6, 1), datetime(2024, 6, 30))  # the corpus spans 2024
+
+    result = {"theses": len(index), "index_mode": config.SEARCH_INDEX_MODE, "index_load_seconds": round(load_seconds, 3)}
+    for name, since, until in (("latency", None, None), ("date_filtered_latency", *month)):
+        index.search(queries[0], 10, since=since, until=until)  # warm-up
+        seconds = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, 10, since=since, until=until)
+            seconds.append(time.perf_counter() - started)
+        result[name] = latency(seconds)
+    return result
+
+def bench_ingest(args) -> dict:
+    import cluster
+    import encoder
+    import feed_server
+    from rss import parse_feed, parse_feeds
+    from extractor import split_sentences
+
+    feeds_dir = os.path.join(args.scale_workdir, "feeds")
+    shutil.rmtree(feeds_dir, ignore_errors=True)
+    paths = corpus.write_feeds(feeds_dir, args.ingest_feeds, args.ingest_posts, args.seed + 2)
+    server = None
+    if args.feed_source == "http":
+        server, base_url = feed_server.serve(feeds_dir)
+        urls = [f"{base_url}/{os.path.basename(path)}" for path in paths]
+    else:
+        urls = paths
+
+    # loading the model, the sentence splitter and the theme index is not part of the throughput
+    encoder.get_model()
+    split_sentences("Warm up. The splitter.")
+    cluster.get_theme_index()
+
+    result = {"feed_source": args.feed_source}
+    try:
+        one_by_one, bulk = urls[:max(len(urls) // 2, 1)], urls[max(len(urls) // 2, 1):]
+        started = time.perf_counter()
+        counts = [parse_feed(url) for url in one_by_one]
+        result["parse_feed"] = throughput(
+            sum(c["ingested"] for c in counts), time.perf_counter() - started,
+            feeds=len(one_by_one), entries=sum(c["total"] for c in counts),
+        )
+
+        if bulk:
+            started = time.perf_counter()
+            totals = parse_feeds(bulk)
+            result["parse_feeds"] = throughput(
+                totals["ingested"], time.perf_counter() - started, feeds=len(bulk), entries=totals["total"],
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+    return result
+
+def bench_themes(args) -> dict:
+    import httpx
+    from sqlmodel import select
+    from sqlalchemy import func
+    from db import get_session
+    from main import encode_cursor
+    from models import Theme
+
+    with get_session() as session:
+        theme_ids = session.exec(
+            select(Theme.id).where(Theme.member_count > 0).order_by(func.random()).limit(1000)
+        ).all()
+    if not theme_ids:
+        return {"skipped": "no themes"}
+
+    rng = np.random.default_rng(args.seed + 4)
+    plan = []
+    for number in range(args.themes_requests):
+        theme_id = theme_ids[int(rng.integers(len(theme_ids)))]
+        if number % 2:
+            plan.append(("timeline", f"/themes/{theme_id}?limit=50"))
+        else:
+            plan.append(("list", f"/themes?limit=100&cursor={encode_cursor(theme_id)}"))
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO, env=dict(os.environ, INGEST_WORKERS="0"),
+    )
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+            try:
+                if httpx.get(f"{base_url}/themes?limit=1", timeout=5).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("uvicorn did not come up within 120s")
+            time.sleep(0.2)
+
+        seconds = {"list": [], "timeline": []}
+        errors = []
+        lock = threading.Lock()
+
+        def client(requests: list):
+            with httpx.Client(base_url=base_url, timeout=60) as http:
+                for kind, path in requests:
+                    started = time.perf_counter()
+                    try:
+                        ok = http.get(path).status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        seconds[kind].append(elapsed)
+                        if not ok:
+                            errors.append(path)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(client, [plan[i::args.concurrency] for i in range(args.concurrency)]))
+        wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    return {
+        "concurrency": args.concurrency,
+        "requests": len(plan),
+        "errors": len(errors),
+        "requests_per_second": round(len(plan) / wall, 1),
+        "list": latency(seconds["list"]),
+        "timeline": latency(seconds["timeline"]),
+    }
+
+def run_scale(args) -> dict:
+    '''
+    the per-scale process: run the selected benchmarks on the DATABASE_URL database.
+    '''
+    import logging
+
+    # before the app modules are imported: their basicConfig(level=INFO) is then a no-op, so the
+    # per-feed and per-request info logs stay out of the way
+    logging.basicConfig(level=logging.WARNING, force=True)
+    from sqlmodel import select
+    from sqlalchemy import func
+    from db import get_session, init_db
+    from models import Thesis, Theme
+
+    init_db()
+    with get_session() as session:
+        result = {
+            "stored_theses": session.exec(select(func.count()).select_from(Thesis)).one(),
+            "stored_themes": session.exec(select(func.count()).select_from(Theme)).one(),
+        }
+
+    benchmarks = {"extract": bench_extract, "match": bench_match, "search": bench_search,
+                  "ingest": bench_ingest, "themes": bench_themes}
+    for name in args.only:
+        print(f"  {name}...", file=sys.stderr)
+        result[name] = benchmarks[name](args)
+    return result
+
+# --- the driver ---
+
+def sqlite_url(path: str) -> str:
+    return "sqlite:///" + os.path.abspath(path)
+
+def remove_database(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def seeded_database(args, theses: int):
+    '''
+    path of the seeded corpus for this scale (built if missing) and the seeding stats if it was built now.
+    '''
+    import config
+
+    model = config.MODEL_NAME.replace("/", "_")
+    path = os.path.join(args.workdir, f"corpus-{theses}-{model}-seed{args.seed}.db")
+    if os.path.exists(path) and not args.reseed:
+        return path, None
+
+    building = path + ".building"
+    remove_database(building)
+    print(f"Seeding {theses} theses into {path} (once per scale)...", file=sys.stderr)
+    output = subprocess.run(
+        [sys.executable, os.path.join(REPO, "benchmarks", "corpus.py"), "seed", "--theses", str(theses), "--seed", str(args.seed)],
+        env=dict(os.environ, DATABASE_URL=sqlite_url(building)), stdout=subprocess.PIPE, text=True, check=True,
+    ).stdout
+    remove_database(path)
+    os.replace(building, path)
+    return path, json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the culldron benchmark suite.")
+    parser.add_argument("--scales", default="1k", help="comma-separated thesis counts: 1k, 10k, 100k, 1m or a number")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--workdir", default=os.path.join(REPO, "bench_data"), help="seeded corpora and scratch files")
+    parser.add_argument("--output", help="write the json results here instead of stdout")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed; the same seed gives the same corpus")
+    parser.add_argument("--reseed", action="store_true", help="rebuild the seeded corpora")
+    parser.add_argument("--extract-posts", type=int, default=200)
+    parser.add_argument("--match-queries", type=int, default=2000)
+    parser.add_argument("--search-queries", type=int, default=1000)
+    parser.add_argument("--ingest-feeds", type=int, default=10)
+    parser.add_argument("--ingest-posts", type=int, default=50, help="entries per feed")
+    parser.add_argument("--feed-source", choices=("http", "file"), default="http")
+    parser.add_argument("--themes-requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)  # result file of a per-scale process
+    parser.add_argument("--scale-workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks {sorted(unknown)}, expected some of {BENCHMARKS}")
+
+    if args.worker:
+        result = run_scale(args)
+        with open(args.worker, "w") as f:
+            json.dump(result, f)
+        return
+
+    import config
+
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {
+        "suite": "culldron-benchmarks",
+        "format": 1,
+        "commit": git_commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {name: getattr(config, name) for name in RECORDED_SETTINGS},
+        "options": {key: value for key, value in vars(args).items() if key not in ("worker", "scale_workdir", "output", "workdir")},
+        "scales": {},
+    }
+
+    for name in [name.strip() for name in args.scales.split(",") if name.strip()]:
+        theses = parse_scale(name)
+        scale_result = {"theses": theses}
+        scale_workdir = os.path.join(args.workdir, f"run-{theses}")
+        os.makedirs(scale_workdir, exist_ok=True)
+
+        database = os.path.join(scale_workdir, "bench.db")
+        remove_database(database)
+        if theses:
+            pristine, seeded = seeded_database(args, theses)
+            if seeded:
+                scale_result["seed"] = seeded
+            shutil.copyfile(pristine, database)
+
+        print(f"Scale {name} ({theses} theses):", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json", dir=scale_workdir, delete=False) as result_file:
+            result_path = result_file.name
+        try:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--worker", result_path, "--scale-workdir", scale_workdir],
+                env=dict(os.environ, DATABASE_URL=sqlite_url(database), EMBEDDING_CACHE_SIZE="0", EMBEDDING_CACHE_PATH=""),
+                check=True,
+            )
+            with open(result_path) as f:
+                scale_result.update(json.load(f))
+        finally:
+            os.remove(result_path)
+        report["scales"][name] = scale_result
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+'''
+html -> plain text for post bodies
+
+- the html is read front to back in windows (twice CLEAN_MAX_CHARS, always ending right after
+  a tag), and reading stops as soon as CLEAN_MAX_CHARS of text has been produced, so a huge
+  content:encoded body costs no more than a normal one
+- script, style, nav (and similar non-content blocks) are jumped over whole, contents included,
+  even when they run past the end of a window; a window that ends inside a comment is stretched
+  to the comment's end
+- inside a window the per-tag work is done by compiled regexes: inline tags (a, b, em, span, ...)
+  and comments join the text around them, every other tag (p, div, br, li, ...) becomes a space so
+  sentences don't run together
+- entities are decoded, invisible characters dropped and whitespace collapsed to single spaces
+- the output is cut at a sentence end when possible
+- benchmarks/bench_clean.py compares it with the old regex
+
+'''
+
+from html import unescape
+import re
+import config
+
+SKIP_TAGS = ("script", "style", "noscript", "template", "nav", "iframe", "svg", "form", "footer", "head")
+INLINE_TAGS = ("a", "abbr", "b", "bdi", "bdo", "cite", "code", "del", "dfn", "em", "font", "i", "ins",
+               "kbd", "mark", "q", "s", "samp", "small", "span", "strong", "sub", "sup", "time", "u", "var")
+MIN_WINDOW = 4096
+
+def _any_case(tag: str) -> str:
+    # "nav" -> "[nN][aA][vV]": much cheaper than re.I, which slows down the whole scan
+    return "".join(f"[{char.lower()}{char.upper()}]" if char.isalpha() else char for char in tag)
+
+# skip tags match in any case, so <Script> is dropped too. inline tags are lowercase only (a
+# mixed-case one just becomes a space instead of joining the text around it)
+_SKIP_OPEN = re.compile(rf"<({'|'.join(map(_any_case, SKIP_TAGS))})\b[^>]*>")
+_SKIP_END = {tag: re.compile(rf"</{_any_case(tag)}\s*>|$") for tag in SKIP_TAGS}
+_INLINE = re.compile(rf"<!--.*?(?:-->|$)|</?(?:{'|'.join(INLINE_TAGS)})(?=[\s/>])[^>]*>", re.S)
+# a tag needs its closing ">": a bare "<" in text ("if a<b then") stays text
+_TAG = re.compile(r"<[a-zA-Z/!?][^>]*>")
+_INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")  # zero-width chars, soft hyphen
+
+def _text(fragment: str) -> str:
+    fragment = unescape(_TAG.sub(" ", _INLINE.sub("", fragment)))
+    if not fragment.isascii():
+        fragment = _INVISIBLE.sub("", fragment)
+    return " ".join(fragment.split())
+
+def clean_html(raw_html: str, max_chars: int = None) -> str:
+    '''
+    visible text of an html fragment, whitespace-normalized and at most max_chars long
+    (default CLEAN_MAX_CHARS, 0 = no limit).
+    '''
+    max_chars = config.CLEAN_MAX_CHARS if max_chars is None else max_chars
+    window = max(max_chars * 2, MIN_WINDOW) if max_chars else len(raw_html)
+    parts = []
+    length = 0
+    pos = 0
+    end = len(raw_html)
+
+    while pos < end and not (max_chars and length >= max_chars):
+        stop = min(pos + window, end)
+        if stop < end:
+            # end the window after a tag, not inside one
+            close = raw_html.find(">", stop)
+            stop = end if close < 0 else close + 1
+            # a comment still open at the window end would leave its tail as text in the next window
+            opened = raw_html.rfind("<!--", pos, stop)
+            if opened >= 0 and raw_html.find("-->", opened + 4, stop) < 0:
+                close = raw_html.find("-->", opened + 4)
+                stop = end if close < 0 else close + 3
+
+        skip = _SKIP_OPEN.search(raw_html, pos, stop)
+        text = _text(raw_html[pos:skip.start() if skip else stop])
+        if text:
+            parts.append(text)
+            length += len(text) + 1
+
+        if not skip:
+            pos = stop
+        elif skip.group(0).endswith("/>"):
+            pos = skip.end()
+        else:
+            pos = _SKIP_END[skip.group(1).lower()].search(raw_html, skip.end()).end()
+
+    text = " ".join(parts)
+    if max_chars and len(text) > max_chars:
+        # prefer ending on a full sentence, otherwise on a full word
+        cut = max(text.rfind(mark, 0, max_chars) for mark in (". ", "! ", "? "))
+        if cut > max_chars // 2:
+            text = text[:cut + 1]
+        else:
+            cut = text.rfind(" ", 0, max_chars)
+            text = text[:cut if cut > 0 else max_chars]
+    return text
@@ -1,57 +1,180 @@
 '''
 thinking logic
-- embed takes in text and turns it into an embedding vector using a transformer model
+- embed takes in text and turns it into an embedding vector using the shared transformer model (see encoder.py)
 - find matching theme  takes in new embeddings and compares a new sentence's vector to the existing one and decides:
     - if similar enough based on cosine similarity, group it with the existing theme
     - if not, create a new unique theme id  (uuid)
-    
+- each theme keeps a running centroid (sum of member embeddings + count, see models.Theme), and
+  new sentences are only compared against those centroids, so matching cost grows with the number
+  of themes rather than the number of posts
+- the centroids live in an in-memory vector index (see index.py) that is loaded from the db once
+  per process and updated in place whenever a theme gains a member
+- several processes can ingest at once (web app job workers, run_worker.py, run_poller.py), so every
+  THEME_INDEX_REFRESH seconds matching also reads the themes written since the last read
+  (Theme.updated_at); otherwise each process would create its own theme for the same topic.
+  if the table was rebuilt since the load (a new db.theme_generation, see recluster.py), the
+  index is dropped and loaded again instead
+
 '''
 
-from sentence_transformers import SentenceTransformer, util
-from models import Thesis
-from db import get_session
+from sqlmodel import select
+from models import Theme
+from db import get_session, theme_generation
+from index import VectorIndex
+from encoder import encode
+from datetime import datetime, timedelta
+import numpy as np
+import config
+import threading
+import time
 import uuid
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# load embedding model once
-model = SentenceTransformer('all-MiniLM-L6-v2')
+_theme_index = None
+_theme_rows = {}  # theme_id -> row of its centroid in _theme_index
+_theme_index_lock = threading.Lock()
+_refreshed_at = None  # utc time the themes in _theme_index were last read from the db
+_generation = 0  # theme_generation() when _theme_index was loaded
+_next_refresh = 0.0  # time.monotonic() of the next refresh_theme_index()
+
+# themes written up to this long before a refresh are read again by the next one, so a chunk that
+# was still being committed during a refresh isn't missed
+REFRESH_OVERLAP = timedelta(seconds=30)
 
 def embed(text: str):
-    embedding = model.encode(text)
+    embedding = encode(text)
     if embedding is None:
         logger.error(f"Embedding returned None for text: {text}")
         return None
     return embedding.tolist()
 
-def find_matching_theme(new_embedding: list[float], threshold: float = 0.8) -> str:
+def get_theme_index() -> VectorIndex:
+    '''
+    return the shared centroid index, loading every theme centroid from the db on first use.
+    '''
+    global _theme_index, _refreshed_at, _next_refresh, _generation
+    with _theme_index_lock:
+        if _theme_index is None:
+            index = VectorIndex(config.THEME_INDEX_MODE, config.THEME_INDEX_NLIST, config.THEME_INDEX_NPROBE)
+            loaded_at = datetime.utcnow()
+            with get_session() as session:
+                generation = theme_generation(session)
+                rows = session.exec(
+                    select(Theme.id, Theme.centroid_sum).where(Theme.member_count > 0)
+                ).all()
+
+            if rows:
+                theme_ids, centroid_sums = zip(*rows)
+                # the index normalizes rows, so the sum points the same way as the mean centroid
+                start = index.add(centroid_sums, theme_ids)
+                _theme_rows.update({theme_id: start + i for i, theme_id in enumerate(theme_ids)})
+            logger.info(f"Loaded theme index with {len(index)} centroids ({index.mode} mode)")
+            _theme_index = index
+            _refreshed_at = loaded_at
+            _generation = generation
+            _next_refresh = time.monotonic() + config.THEME_INDEX_REFRESH
+        return _theme_index
+
+def refresh_theme_index():
+    '''
+    read the themes other processes created or grew since the last read into the index, or drop
+    the index if the theme table was rebuilt since it was loaded. does nothing until
+    THEME_INDEX_REFRESH seconds have passed (or if it is 0).
+    '''
+    global _refreshed_at, _next_refresh
+    if not config.THEME_INDEX_REFRESH:
+        return
+    index = get_theme_index()
+    with _theme_index_lock:
+        if index is not _theme_index or time.monotonic() < _next_refresh:
+            return
+        _next_refresh = time.monotonic() + config.THEME_INDEX_REFRESH
+        since = _refreshed_at - REFRESH_OVERLAP
+        loaded_generation = _generation
+
+    started = datetime.utcnow()
     with get_session() as session:
-        existing = session.query(Thesis).filter(Thesis.embedding != None).all()
+        if theme_generation(session) != loaded_generation:
+            logger.info("Theme table was rebuilt (re-clustering), reloading the theme index")
+            reset_theme_index()
+            return
+        rows = session.exec(
+            select(Theme.id, Theme.centroid_sum).where(Theme.updated_at > since, Theme.member_count > 0)
+        ).all()
 
-            # filter out any None or invalid embeddings
-        filtered = [(t.embedding, t.theme_id) for t in existing if t.embedding and isinstance(t.embedding, list)]
+    with _theme_index_lock:
+        if index is not _theme_index:
+            return  # reset meanwhile
+        _refreshed_at = max(_refreshed_at, started)
+        for theme_id, centroid_sum in rows:
+            _set_centroid(index, theme_id, centroid_sum)
 
-        if not filtered:
-            new_id = str(uuid.uuid4())
-            logger.info(f"No existing valid theme embeddings found in the database. Creating new theme_id: {new_id}")
-            return new_id
+def reset_theme_index():
+    '''
+    drop the loaded centroid index (after the theme table was rebuilt, see recluster.py); the next
+    match loads it again.
+    '''
+    global _theme_index
+    with _theme_index_lock:
+        _theme_index = None
+        _theme_rows.clear()
 
-        embeddings, theme_ids = zip(*filtered)
+def add_theme_member(session, theme_id: str, embedding: list[float], seen_at: datetime = None) -> Theme:
+    '''
+    add one thesis embedding to its theme's running centroid, creating the theme if it is new.
+    the caller commits, then hands the new centroid_sum values to update_theme_index().
+    '''
+    seen_at = seen_at or datetime.utcnow()
+    theme = session.get(Theme, theme_id)
+    if theme is None:
+        theme = Theme(id=theme_id, centroid_sum=np.zeros(len(embedding), dtype=np.float32), member_count=0,
+                      first_seen_at=seen_at, last_seen_at=seen_at)
+        session.add(theme)
+
+    # a new array (not an in-place add) so the change is picked up, and stored blobs stay read-only
+    theme.centroid_sum = np.asarray(theme.centroid_sum, dtype=np.float32) + np.asarray(embedding, dtype=np.float32)
+    theme.member_count += 1
+    theme.first_seen_at = min(theme.first_seen_at, seen_at)
+    theme.last_seen_at = max(theme.last_seen_at, seen_at)
+    theme.updated_at = datetime.utcnow()
+    return theme
+
+def update_theme_index(centroids: dict[str, np.ndarray]):
+    '''
+    push committed theme centroids (theme_id -> centroid_sum) into the in-memory index.
+    '''
+    index = get_theme_index()
+    with _theme_index_lock:
+        for theme_id, centroid_sum in centroids.items():
+            _set_centroid(index, theme_id, centroid_sum)
+
+def _set_centroid(index: VectorIndex, theme_id: str, centroid_sum):
+    # callers hold _theme_index_lock
+    row = _theme_rows.get(theme_id)
+    if row is None:
+        _theme_rows[theme_id] = index.add([centroid_sum], [theme_id])
+    else:
+        index.update(row, centroid_sum)
+
+def find_matching_theme(new_embedding: list[float], threshold: float = 0.8) -> str:
+    refresh_theme_index()
+    matches = get_theme_index().search(new_embedding, k=1)
 
-        # compute cosine similarity
-        scores = util.cos_sim([new_embedding], embeddings)[0]
+    if not matches:
+        new_id = str(uuid.uuid4())
+        logger.debug(f"No existing themes found in the database. Creating new theme_id: {new_id}")
+        return new_id
 
-        # find best match
-        best_score = float(scores.max())
-        best_idx = int(scores.argmax())
-        best_theme_id = theme_ids[best_idx]
+    # find best matching centroid
+    best_theme_id, best_score = matches[0]
 
-        if best_score >= threshold:
-            logger.info(f"Found a matching theme_id={best_theme_id} with similarity={best_score:.4f}")
-            return best_theme_id
-        else:
-            new_id = str(uuid.uuid4())
-            logger.info(f"No sufficiently similar theme found (highest similarity={best_score:.4f}). Creating new theme_id: {new_id}")
-            return new_id
\ No newline at end of file
+    if best_score >= threshold:
+        logger.debug(f"Found a matching theme_id={best_theme_id} with similarity={best_score:.4f}")
+        return best_theme_id
+    else:
+        new_id = str(uuid.uuid4())
+        logger.debug(f"No sufficiently similar theme found (highest similarity={best_score:.4f}). Creating new theme_id: {new_id}")
+        return new_id
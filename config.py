@@ -0,0 +1,126 @@
+"""
+This file holds the runtime settings for the project.
+
+every value is read from an environment variable (see .env.example) and falls back
+to a sensible default, so nothing has to be configured to run locally.
+"""
+
+import os
+
+
+def _get_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# database (db.py). the sqlite settings are applied to every new connection:
+# - journal mode: "wal" lets readers and one writer work at the same time ("" = sqlite default)
+# - synchronous: "normal" is safe with wal and skips an fsync per commit
+# - busy timeout (ms): how long a writer waits for the lock before "database is locked"
+# - page cache (KiB, per connection) and memory-mapped i/o (bytes, 0 = off)
+# - pool: connections kept open, plus extra ones allowed under load
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///culldron.db")
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "wal").strip().lower()
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "normal").strip().lower()
+DB_BUSY_TIMEOUT = _get_int("DB_BUSY_TIMEOUT", 10000)
+DB_CACHE_SIZE_KB = _get_int("DB_CACHE_SIZE_KB", 65536)
+DB_MMAP_SIZE = _get_int("DB_MMAP_SIZE", 268435456)
+DB_POOL_SIZE = _get_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _get_int("DB_MAX_OVERFLOW", 20)
+
+# theme matching index
+# - "exact" scans every theme centroid with one matrix-vector product
+# - "ivf" buckets centroids under coarse k-means centroids and only scans the closest buckets
+THEME_INDEX_MODE = os.getenv("THEME_INDEX_MODE", "exact").lower()
+THEME_INDEX_NLIST = _get_int("THEME_INDEX_NLIST", 0)  # 0 = pick from corpus size
+THEME_INDEX_NPROBE = _get_int("THEME_INDEX_NPROBE", 8)
+# how often (s) matching reads themes that other processes (job workers, run_worker.py, run_poller.py)
+# created or grew since the last read, so they aren't created twice. 0 = never (one ingesting process)
+THEME_INDEX_REFRESH = float(os.getenv("THEME_INDEX_REFRESH") or 2.0)
+
+# semantic search (search.py, GET /search): the thesis index, "ivf" (approximate, keeps queries in
+# milliseconds at ~1M theses) or "exact", its ivf lists (0 = pick from corpus size) and lists scanned
+# per query, and whether the web app loads it at startup (in the background) instead of on the first search
+SEARCH_INDEX_MODE = os.getenv("SEARCH_INDEX_MODE", "ivf").lower()
+SEARCH_INDEX_NLIST = _get_int("SEARCH_INDEX_NLIST", 0)
+SEARCH_INDEX_NPROBE = _get_int("SEARCH_INDEX_NPROBE", 16)
+SEARCH_PRELOAD = _get_int("SEARCH_PRELOAD", 0)
+
+# offline re-clustering (recluster.py): cosine threshold (the same as online matching), merge /
+# assign passes, and theses read and scored per block (bounds memory)
+RECLUSTER_THRESHOLD = float(os.getenv("RECLUSTER_THRESHOLD") or 0.8)
+RECLUSTER_ITERATIONS = _get_int("RECLUSTER_ITERATIONS", 2)
+RECLUSTER_BLOCK_ROWS = _get_int("RECLUSTER_BLOCK_ROWS", 4096)
+
+# embedding model (loaded lazily by encoder.py, shared by the extractor and clustering)
+MODEL_NAME = os.getenv("MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or None  # e.g. "cpu", "cuda"; None = auto
+EMBEDDING_THREADS = _get_int("EMBEDDING_THREADS", 0)  # intra-op threads (torch or onnxruntime), 0 = default
+EMBEDDING_INTEROP_THREADS = _get_int("EMBEDDING_INTEROP_THREADS", 0)  # inter-op threads, 0 = default
+EMBEDDING_MAX_SEQ_LENGTH = _get_int("EMBEDDING_MAX_SEQ_LENGTH", 0)  # 0 = model default
+
+# inference backend: "torch", or "onnx" (onnxruntime on cpu, needs `pip install sentence-transformers[onnx]`)
+# with optional dynamic int8 quantization for the given cpu ("avx2", "avx512", "avx512_vnni", "arm64");
+# exported / quantized models are kept under EMBEDDING_ONNX_DIR. check accuracy with
+# benchmarks/check_backend.py before switching
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "").strip().lower()
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_models")
+
+# embedding cache (embedding_cache.py): vectors kept in memory (0 = no cache), and an optional
+# sqlite file that keeps them across restarts and processes
+EMBEDDING_CACHE_SIZE = _get_int("EMBEDDING_CACHE_SIZE", 20000)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+
+# embedding worker processes (embed_pool.py), each with its own model; 0 or 1 = embed in-process
+EMBEDDING_PROCESSES = _get_int("EMBEDDING_PROCESSES", 0)
+
+# micro-batching (batcher.py): sentences from many posts are embedded together
+EMBEDDING_BATCH_SIZE = _get_int("EMBEDDING_BATCH_SIZE", 64)  # max sentences per encode call
+EMBEDDING_BATCH_MAX_WAIT_MS = _get_int("EMBEDDING_BATCH_MAX_WAIT_MS", 10)  # how long a batch waits to fill up
+
+# feed fetching (fetcher.py, used by the ingest pipeline)
+USER_AGENT = os.getenv("USER_AGENT", "CulldronBot/1.0")
+FEED_FETCH_CONCURRENCY = _get_int("FEED_FETCH_CONCURRENCY", 50)  # feeds downloaded at once, overall
+FEED_FETCH_PER_HOST = _get_int("FEED_FETCH_PER_HOST", 4)  # feeds downloaded at once from one host
+FEED_FETCH_TIMEOUT = _get_int("FEED_FETCH_TIMEOUT", 20)  # seconds
+FEED_PARSE_WORKERS = _get_int("FEED_PARSE_WORKERS", 4)  # feedparser processes, 0 = parse in a thread
+
+# streaming ingest pipeline (pipeline.py)
+PIPELINE_BUFFER = _get_int("PIPELINE_BUFFER", 256)  # items queued between two stages
+PIPELINE_COMMIT_SIZE = _get_int("PIPELINE_COMMIT_SIZE", 100)  # new posts per commit (feeds also commit when done)
+
+# how Thesis.embedding is stored (vectors.py): "float32", "float16" (half size) or "int8" (quarter size)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32").lower()
+
+# background ingest jobs (jobs.py): worker threads started by the web app (0 = only run_worker.py
+# processes jobs), how often idle workers check for new jobs (s), and after how long (s) without a
+# heartbeat a "running" job whose worker died is handed out again
+INGEST_WORKERS = _get_int("INGEST_WORKERS", 1)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL") or 1.0)
+JOB_STALE_AFTER = _get_int("JOB_STALE_AFTER", 3600)
+
+# feed poller (poller.py / run_poller.py): feeds ingested at once, and the bounds (s) of the
+# adaptive per-feed poll interval; each poll time is randomized by +-POLL_JITTER
+POLL_CONCURRENCY = _get_int("POLL_CONCURRENCY", 8)
+POLL_MIN_INTERVAL = _get_int("POLL_MIN_INTERVAL", 300)
+POLL_DEFAULT_INTERVAL = _get_int("POLL_DEFAULT_INTERVAL", 3600)
+POLL_MAX_INTERVAL = _get_int("POLL_MAX_INTERVAL", 86400)
+POLL_JITTER = float(os.getenv("POLL_JITTER") or 0.1)
+
+# html cleaning (cleaner.py): longest post text passed on to sentence splitting, 0 = no limit
+CLEAN_MAX_CHARS = _get_int("CLEAN_MAX_CHARS", 20000)
+
+# sentence splitting (sentences.py): "punkt" (nltk) or "regex" (rule-based, no data files); where the
+# punkt data lives (besides nltk's default directories) and whether it may be downloaded on first use
+SENTENCE_SPLITTER = os.getenv("SENTENCE_SPLITTER", "punkt").strip().lower()
+NLTK_DATA = os.getenv("NLTK_DATA", "")
+NLTK_AUTO_DOWNLOAD = _get_int("NLTK_AUTO_DOWNLOAD", 0)
+
+# thesis extraction (extractor.py): most sentences of one post that get embedded and ranked, 0 = no cap
+EXTRACT_MAX_SENTENCES = _get_int("EXTRACT_MAX_SENTENCES", 1000)
+
+# near-duplicate detection (neardup.py): estimated jaccard similarity of two post bodies above which
+# the later one is a copy (0 = off), and how many recent, not yet committed posts are matched in memory
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY") or 0.8)
+NEAR_DUPLICATE_RECENT = _get_int("NEAR_DUPLICATE_RECENT", 10000)
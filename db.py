@@ -1,8 +1,20 @@
 """
 This file sets up the database connection using SQLModel and SQLite.
 
-- defines the engine, which connects to the database file (culldron.db).
+- defines the engine, which connects to DATABASE_URL (the culldron.db file by default).
+- sqlite connections are tuned as they are opened (see _tune_sqlite): WAL journaling so readers
+  (/themes, /search) never wait for an ingest that is writing and vice versa, a busy timeout so
+  concurrent writers queue up instead of failing with "database is locked", a bigger page cache,
+  memory-mapped reads and synchronous=NORMAL (durable with WAL, without an fsync per commit).
+  every value comes from config.py
+- connections are pooled (DB_POOL_SIZE + DB_MAX_OVERFLOW) and shared across threads, for the
+  api's threadpool, the ingest workers and the pipeline stages
 - provides the get_session() function to safely interact with the database.
+- init_db() creates any missing tables, migrates older databases (see migrate()) and backfills
+  the theme table from existing theses, so it is safe to run again after upgrading.
+- every statement's latency goes to metrics.DB_QUERY_SECONDS (engine events, see _query_finished).
+- insert_ignore() builds INSERT ... ON CONFLICT DO NOTHING statements, used so concurrent ingests
+  of overlapping feeds can't store the same post twice.
 
 other files can use get_session() to:
     - add new records
@@ -10,14 +22,230 @@ other files can use get_session() to:
     - save updates
 """
 
-from sqlmodel import create_engine, SQLModel, Session
-from models import Thesis
+from sqlmodel import create_engine, SQLModel, Session, select, func
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects.sqlite import insert
+from models import Thesis, Theme, ThemeAlias, PostAlias
+from urls import url_hash
+from vectors import pack
+from datetime import datetime
+import numpy as np
+import config
+import json
+import metrics
+import time
 
-sqlite_file = "culldron.db"
-engine = create_engine(f"sqlite:///{sqlite_file}", echo=False)
+def _create_engine():
+    if not config.DATABASE_URL.startswith("sqlite"):
+        return create_engine(config.DATABASE_URL, echo=False, pool_size=config.DB_POOL_SIZE,
+                             max_overflow=config.DB_MAX_OVERFLOW, pool_pre_ping=True)
+
+    if config.DATABASE_URL in ("sqlite://", "sqlite:///:memory:"):
+        # one in-memory database per connection, so every session has to share a single connection
+        from sqlalchemy.pool import StaticPool
+        return create_engine(config.DATABASE_URL, echo=False, poolclass=StaticPool,
+                             connect_args={"check_same_thread": False})
+
+    return create_engine(
+        config.DATABASE_URL,
+        echo=False,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        # connections move between threads (fastapi threadpool, workers, pipeline stages);
+        # the pool makes sure only one thread uses a connection at a time
+        connect_args={"check_same_thread": False, "timeout": config.DB_BUSY_TIMEOUT / 1000},
+    )
+
+engine = _create_engine()
+
+@event.listens_for(engine, "connect")
+def _tune_sqlite(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT}")
+    if config.DB_JOURNAL_MODE:
+        cursor.execute(f"PRAGMA journal_mode = {config.DB_JOURNAL_MODE}")
+    if config.DB_SYNCHRONOUS:
+        cursor.execute(f"PRAGMA synchronous = {config.DB_SYNCHRONOUS}")
+    if config.DB_CACHE_SIZE_KB:
+        cursor.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}")  # negative = KiB, not pages
+    if config.DB_MMAP_SIZE:
+        cursor.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+
+@event.listens_for(engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is not None:
+        operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+        metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, operation=operation)
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    migrate()
+    backfill_themes()
 
 def get_session():
     return Session(engine)
+
+def insert_ignore(model, conflict_columns: list[str]):
+    """
+    INSERT ... ON CONFLICT (conflict_columns) DO NOTHING. a skipped row shows up as rowcount == 0.
+    """
+    return insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+
+def existing_url_hashes(session, hashes: list[str]) -> set[str]:
+    """
+    which of the given post url hashes are already stored (as a thesis or as an alias of one),
+    in one IN (...) query per 500 hashes.
+    """
+    found = set()
+    for start in range(0, len(hashes), 500):  # stay under sqlite's bound-parameter limit
+        chunk = hashes[start:start + 500]
+        found.update(session.exec(select(Thesis.url_hash).where(Thesis.url_hash.in_(chunk))))
+        # near-duplicate copies linked to a stored post (see neardup.py)
+        found.update(session.exec(select(PostAlias.url_hash).where(PostAlias.url_hash.in_(chunk))))
+    return found
+
+def theme_generation(session) -> int:
+    """
+    how many times the theme table was rebuilt (recluster.py). processes that loaded themes from an
+    older generation hold ids that may no longer exist, and reload them.
+    """
+    return session.exec(select(func.max(Theme.generation))).one() or 0
+
+def resolve_theme_aliases(session, theme_ids) -> dict:
+    """
+    old theme id -> the theme that took it over, for the given ids that a rebuild turned into aliases.
+    """
+    theme_ids = [theme_id for theme_id in set(theme_ids) if theme_id is not None]
+    found = {}
+    for start in range(0, len(theme_ids), 500):
+        chunk = theme_ids[start:start + 500]
+        found.update(session.exec(
+            select(ThemeAlias.old_theme_id, ThemeAlias.theme_id).where(ThemeAlias.old_theme_id.in_(chunk))
+        ).all())
+    return found
+
+def migrate():
+    """
+    bring a database created by an older version up to date. every step is idempotent.
+    """
+    with engine.begin() as conn:
+        # unique, indexed hash of the normalized post url
+        if "url_hash" not in {column["name"] for column in inspect(conn).get_columns("thesis")}:
+            conn.execute(text("ALTER TABLE thesis ADD COLUMN url_hash VARCHAR"))
+
+        missing = conn.execute(text("SELECT id, post_url FROM thesis WHERE url_hash IS NULL ORDER BY id")).all()
+        if missing:
+            taken = set(conn.execute(text("SELECT url_hash FROM thesis WHERE url_hash IS NOT NULL")).scalars())
+            updates = []
+            for thesis_id, post_url in missing:
+                # older copies of the same post keep a NULL hash instead of breaking the unique index
+                hashed = url_hash(post_url)
+                if hashed not in taken:
+                    taken.add(hashed)
+                    updates.append({"url_hash": hashed, "id": thesis_id})
+            if updates:
+                conn.execute(text("UPDATE thesis SET url_hash = :url_hash WHERE id = :id"), updates)
+
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_thesis_url_hash ON thesis (url_hash)"))
+
+        # minhash of the post body (near-duplicate detection); older posts have none and are never matched
+        if "minhash" not in {column["name"] for column in inspect(conn).get_columns("thesis")}:
+            conn.execute(text("ALTER TABLE thesis ADD COLUMN minhash BLOB"))
+
+        # feed polling schedule (poller.py)
+        feed_columns = {column["name"] for column in inspect(conn).get_columns("feed")}
+        for column, ddl in (("poll_interval", "INTEGER"),
+                            ("next_poll_at", "DATETIME"),
+                            ("error_count", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in feed_columns:
+                conn.execute(text(f"ALTER TABLE feed ADD COLUMN {column} {ddl}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_feed_next_poll_at ON feed (next_poll_at)"))
+
+        # last write of a theme, so other processes pick up its centroid (cluster.refresh_theme_index)
+        if "updated_at" not in {column["name"] for column in inspect(conn).get_columns("theme")}:
+            conn.execute(text("ALTER TABLE theme ADD COLUMN updated_at DATETIME"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_theme_updated_at ON theme (updated_at)"))
+        # rebuilds of the theme table (db.theme_generation)
+        if "generation" not in {column["name"] for column in inspect(conn).get_columns("theme")}:
+            conn.execute(text("ALTER TABLE theme ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_theme_generation ON theme (generation)"))
+
+        # heartbeat of running ingest jobs (jobs.requeue_stale)
+        if "updated_at" not in {column["name"] for column in inspect(conn).get_columns("job")}:
+            conn.execute(text("ALTER TABLE job ADD COLUMN updated_at DATETIME"))
+
+        # theme timeline (main.theme_timeline) and date filters
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_thesis_theme_id ON thesis (theme_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_thesis_published_at ON thesis (published_at)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_thesis_theme_timeline "
+            "ON thesis (theme_id, coalesce(published_at, ingested_at), id)"
+        ))
+
+        # embeddings written as json text by older versions -> packed binary blobs (vectors.py)
+        converted = 0
+        for table, column, dtype in (("thesis", "embedding", config.EMBEDDING_STORAGE),
+                                     ("theme", "centroid_sum", "float32")):
+            while True:
+                rows = conn.execute(text(
+                    f"SELECT rowid, {column} FROM {table} WHERE typeof({column}) = 'text' LIMIT 1000"
+                )).all()
+                if not rows:
+                    break
+                updates = []
+                for rowid, value in rows:
+                    decoded = json.loads(value)
+                    updates.append({"value": None if decoded is None else pack(decoded, dtype), "rowid": rowid})
+                conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE rowid = :rowid"), updates)
+                converted += len(rows)
+
+    if converted:
+        # give the space taken by the json text back to the filesystem
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+
+def backfill_themes():
+    """
+    build the theme table (running centroids) from theses saved before it existed.
+    does nothing once any theme row exists.
+    """
+    with get_session() as session:
+        if session.exec(select(func.count()).select_from(Theme)).one():
+            return
+
+        sums, counts, first_seen, last_seen = {}, {}, {}, {}
+        rows = session.exec(
+            select(Thesis.theme_id, Thesis.embedding, Thesis.published_at, Thesis.ingested_at)
+            .where(Thesis.theme_id != None, Thesis.embedding != None)
+        )
+        for theme_id, embedding, published_at, ingested_at in rows:
+            seen_at = published_at or ingested_at
+            if theme_id not in sums:
+                sums[theme_id] = np.zeros(len(embedding), dtype=np.float64)
+                counts[theme_id] = 0
+                first_seen[theme_id] = last_seen[theme_id] = seen_at
+            sums[theme_id] += embedding
+            counts[theme_id] += 1
+            first_seen[theme_id] = min(first_seen[theme_id], seen_at)
+            last_seen[theme_id] = max(last_seen[theme_id], seen_at)
+
+        now = datetime.utcnow()
+        for theme_id, centroid_sum in sums.items():
+            session.add(Theme(
+                id=theme_id,
+                centroid_sum=centroid_sum.tolist(),
+                member_count=counts[theme_id],
+                first_seen_at=first_seen[theme_id],
+                last_seen_at=last_seen[theme_id],
+                updated_at=now,  # so running processes pick them up (cluster.refresh_theme_index)
+            ))
+        session.commit()
@@ -0,0 +1,267 @@
+'''
+multi-process embedding pool
+
+- EMBEDDING_PROCESSES worker processes, each with its own copy of the model (loaded through
+  encoder.get_model, so backend / thread / sequence settings are the same as in-process)
+- encode() cuts the texts into chunks of EMBEDDING_BATCH_SIZE and hands each chunk to the next idle
+  worker, so a big batch keeps every worker busy
+- texts go to the workers over a queue; vectors come back through one shared memory buffer per
+  worker (owned by this process, grown when a chunk doesn't fit) instead of being pickled, and
+  are copied out once
+- each worker gets EMBEDDING_THREADS intra-op threads, or an even share of the cores, so the
+  processes don't fight over them
+- a worker that dies fails its chunk and is restarted, unless it never got its model loaded (that
+  would only fail again); once no worker is left encode() raises. close() (also run at exit) stops the
+  workers after their current chunk and frees the buffers
+- encoder.encode uses the pool when EMBEDDING_PROCESSES > 1, after the embedding cache, so the
+  batcher, pipeline.py (parse_feed / backfills) and the extractor all go through it
+
+'''
+
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import numpy as np
+import atexit
+import config
+import itertools
+import os
+import queue
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _worker(worker_id: int, tasks, results, threads: int):
+    '''
+    worker process: load the model, then embed chunks into the shared buffer named by each task.
+    '''
+    import encoder
+
+    config.EMBEDDING_THREADS = threads
+    model = encoder.get_model()
+    dim = model.get_sentence_embedding_dimension() or len(model.encode("dimension probe"))
+    results.put(("ready", worker_id, dim))
+
+    slot = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        task_id, texts, slot_name, batch_size = task
+        try:
+            if slot is None or slot.name != slot_name:
+                if slot is not None:
+                    slot.close()
+                slot = shared_memory.SharedMemory(name=slot_name)
+            vectors = model.encode(texts, batch_size=batch_size)
+            np.ndarray((len(texts), dim), dtype=np.float32, buffer=slot.buf)[:] = vectors
+            results.put(("done", worker_id, task_id, None))
+        except Exception as e:
+            results.put(("done", worker_id, task_id, f"{type(e).__name__}: {e}"))
+
+    if slot is not None:
+        slot.close()
+
+class EmbeddingPool:
+    def __init__(self, processes: int, batch_size: int = 64, threads: int = 0):
+        self.processes = processes
+        self.batch_size = batch_size
+        self.threads = threads or max(1, (os.cpu_count() or 1) // processes)
+        self.dim = None
+
+        self._context = mp.get_context("spawn")  # fork is unsafe once torch has started threads
+        self._results = self._context.Queue()
+        self._workers = {}  # worker id -> (process, task queue)
+        self._slots = {}  # worker id -> SharedMemory the worker writes its vectors into
+        self._idle = queue.Queue()  # (worker id, generation) of workers with a loaded model and nothing to do
+        self._generations = {}  # worker id -> how often it was started; idle entries of dead workers are stale
+        self._ready = set()  # ids of workers that loaded their model (in their current generation)
+        self._pending = {}  # task id -> (future, worker id, row count)
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error = None  # set once every worker failed to start
+
+        for worker_id in range(processes):
+            self._start_worker(worker_id)
+        self._collector = threading.Thread(target=self._collect, name="embedding-pool", daemon=True)
+        self._collector.start()
+        logger.info(f"Started {processes} embedding processes with {self.threads} threads each")
+
+    def _start_worker(self, worker_id: int):
+        self._generations[worker_id] = self._generations.get(worker_id, -1) + 1
+        self._ready.discard(worker_id)
+        tasks = self._context.Queue()
+        process = self._context.Process(
+            target=_worker, args=(worker_id, tasks, self._results, self.threads),
+            name=f"embedding-worker-{worker_id}", daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = (process, tasks)
+
+    def _slot(self, worker_id: int, rows: int) -> shared_memory.SharedMemory:
+        '''
+        the worker's result buffer, replaced by a bigger one if rows don't fit.
+        '''
+        size = max(rows, self.batch_size) * self.dim * 4
+        slot = self._slots.get(worker_id)
+        if slot is None or slot.size < size:
+            if slot is not None:
+                slot.close()
+                slot.unlink()
+            slot = shared_memory.SharedMemory(create=True, size=size)
+            self._slots[worker_id] = slot
+        return slot
+
+    def submit(self, texts: list[str], batch_size: int = None) -> Future:
+        '''
+        queue one chunk with the next idle worker (blocks until there is one).
+        '''
+        while True:
+            idle = self._idle.get()
+            if idle is None:
+                self._idle.put(None)  # wake up the other waiters too
+                raise RuntimeError(self._error or "Embedding pool is closed")
+            worker_id, generation = idle
+            if generation == self._generations[worker_id]:
+                break
+
+        future = Future()
+        with self._lock:
+            slot = self._slot(worker_id, len(texts))
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (future, worker_id, len(texts))
+        self._workers[worker_id][1].put((task_id, texts, slot.name, batch_size or self.batch_size))
+        return future
+
+    def encode(self, texts, batch_size: int = None, **kwargs) -> np.ndarray:
+        '''
+        embed a string or a list of strings across the workers (same output as model.encode).
+        '''
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+
+        futures = [self.submit(texts[start:start + self.batch_size], batch_size)
+                   for start in range(0, len(texts), self.batch_size)]
+        embeddings = np.concatenate([future.result() for future in futures])
+        return embeddings[0] if single else embeddings
+
+    def _collect(self):
+        '''
+        background thread: copy finished chunks out of the shared buffers and restart dead workers.
+        '''
+        last_check = time.monotonic()
+        while True:
+            if time.monotonic() - last_check >= 1:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if message[0] == "stop":
+                return
+            if message[0] == "ready":
+                _, worker_id, dim = message
+                self.dim = dim
+                self._ready.add(worker_id)
+                self._idle.put((worker_id, self._generations[worker_id]))
+                continue
+
+            _, worker_id, task_id, error = message
+            with self._lock:
+                pending = self._pending.pop(task_id, None)
+                if pending is None:
+                    continue  # already failed by _check_workers
+                future, _, rows = pending
+                if error is None:
+                    slot = self._slots[worker_id]
+                    vectors = np.frombuffer(slot.buf, dtype=np.float32, count=rows * self.dim)
+                    result = vectors.reshape(rows, self.dim).copy()
+                    del vectors  # the buffer can't be released while a view exists
+            self._idle.put((worker_id, self._generations[worker_id]))
+
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Embedding worker {worker_id} failed: {error}"))
+
+    def _check_workers(self):
+        for worker_id, (process, _) in list(self._workers.items()):
+            if process.is_alive() or self._closed:
+                continue
+
+            with self._lock:
+                lost = [task_id for task_id, (_, owner, _) in self._pending.items() if owner == worker_id]
+                futures = [self._pending.pop(task_id)[0] for task_id in lost]
+            for future in futures:
+                future.set_exception(RuntimeError(f"Embedding worker {worker_id} died"))
+
+            if worker_id in self._ready:
+                logger.error(f"Embedding worker {worker_id} exited with code {process.exitcode}, restarting it")
+                self._start_worker(worker_id)
+                continue
+
+            logger.error(f"Embedding worker {worker_id} failed to load the model (exit code {process.exitcode})")
+            del self._workers[worker_id]
+            if not self._workers:
+                self._error = "No embedding worker could load the model, see the worker logs"
+                self._idle.put(None)
+
+    def close(self, timeout: float = 30):
+        '''
+        let every worker finish its current chunk, stop them and free the shared buffers.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._idle.put(None)
+
+        for process, tasks in self._workers.values():
+            tasks.put(None)
+        for process, _ in self._workers.values():
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Embedding worker {process.name} did not stop, terminating it")
+                process.terminate()
+        # everything the workers sent before exiting is ahead of this in the queue
+        self._results.put(("stop",))
+        self._collector.join()
+
+        with self._lock:
+            for future, _, _ in self._pending.values():
+                future.set_exception(RuntimeError("Embedding pool is closed"))
+            self._pending.clear()
+            for slot in self._slots.values():
+                slot.close()
+                slot.unlink()
+            self._slots.clear()
+        logger.info("Stopped embedding processes")
+
+def get_pool() -> EmbeddingPool:
+    '''
+    return the process-wide pool, starting EMBEDDING_PROCESSES workers on first use.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EmbeddingPool(config.EMBEDDING_PROCESSES, config.EMBEDDING_BATCH_SIZE, config.EMBEDDING_THREADS)
+            atexit.register(close_pool)
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,143 @@
+'''
+content-hash cache for sentence embeddings
+
+- the key is a sha1 of the whitespace-normalized text plus everything that changes the vector
+  (model name, max sequence length, inference backend and quantization), so the same sentence is only embedded once: syndicated copies
+  of a post, sentences repeated across a feed, re-ingests and backfills all hit the cache
+- first tier: an in-memory LRU of EMBEDDING_CACHE_SIZE vectors (0 turns the cache off)
+- optional second tier: a sqlite file (EMBEDDING_CACHE_PATH) holding packed float32 vectors (see
+  vectors.py), looked up in bulk and shared by every process and restart
+- hits (memory / disk) and misses are counted, see stats() and GET /stats
+- encoder.encode() goes through it, so the batcher, the extractor and cluster.embed all benefit
+
+'''
+
+from collections import OrderedDict
+from typing import Optional
+from vectors import pack, unpack
+import numpy as np
+import config
+import hashlib
+import sqlite3
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int, path: Optional[str] = None, namespace: str = ""):
+        self.max_entries = max_entries
+        self.path = path
+        self.namespace = namespace
+        self._memory = OrderedDict()  # key -> read-only float32 vector, least recently used first
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embedding_cache (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    def key(self, text: str) -> bytes:
+        normalized = " ".join(text.split())
+        return hashlib.sha1(f"{self.namespace}\0{normalized}".encode("utf-8")).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict:
+        '''
+        cached vectors for the given keys (missing keys are left out).
+        '''
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):  # stay under sqlite's bound-parameter limit
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = unpack(blob)
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self.disk_hits += 1
+
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, items: dict):
+        '''
+        store key -> vector pairs in both tiers.
+        '''
+        with self._lock:
+            for key, vector in items.items():
+                vector = np.array(vector, dtype=np.float32)
+                vector.flags.writeable = False
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO embedding_cache (key, vector) VALUES (?, ?)",
+                    [(key, pack(vector)) for key, vector in items.items()],
+                )
+                self._db.commit()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "persistent": self.path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+def encoder_variant() -> str:
+    '''
+    the backend part of the cache namespace (quantized vectors differ from the torch ones); empty
+    for torch, so caches written before there was a choice of backend stay valid.
+    '''
+    if config.EMBEDDING_BACKEND == "torch":
+        return ""
+    if config.EMBEDDING_QUANTIZE:
+        return f"|{config.EMBEDDING_BACKEND}-int8-{config.EMBEDDING_QUANTIZE}"
+    return f"|{config.EMBEDDING_BACKEND}"
+
+def get_cache() -> Optional[EmbeddingCache]:
+    '''
+    return the process-wide cache, or None when EMBEDDING_CACHE_SIZE is 0.
+    '''
+    global _cache
+    if not config.EMBEDDING_CACHE_SIZE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                config.EMBEDDING_CACHE_SIZE,
+                config.EMBEDDING_CACHE_PATH or None,
+                namespace=f"{config.MODEL_NAME}|{config.EMBEDDING_MAX_SEQ_LENGTH}{encoder_variant()}",
+            )
+        return _cache
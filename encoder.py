@@ -0,0 +1,153 @@
+'''
+shared embedding model provider
+
+- the sentence transformer is loaded the first time something needs it, not at import time,
+  so the api and cli tools that only read the db never pay for a model load
+- there is exactly one copy of the model per process, shared by extractor.py and cluster.py
+- device, thread counts and max sequence length come from config.py
+- EMBEDDING_BACKEND picks the inference runtime behind the same SentenceTransformer interface:
+  "torch" (default) or "onnx" (onnxruntime on cpu, optionally with dynamic int8 quantization).
+  the onnx graph is exported / quantized once into EMBEDDING_ONNX_DIR and loaded from there
+  afterwards; benchmarks/check_backend.py compares its scores with torch
+- encode() looks every text up in the embedding cache first (see embedding_cache.py) and only runs
+  the model on the ones it hasn't seen
+- with EMBEDDING_PROCESSES > 1 the model runs in a pool of worker processes (embed_pool.py)
+  instead of this one, and is never loaded here
+- the size of every model call is recorded in metrics.EMBEDDING_BATCH_SIZE
+
+'''
+
+from embedding_cache import get_cache
+import numpy as np
+import threading
+import logging
+import config
+import metrics
+import glob
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_model = None
+_model_lock = threading.Lock()
+
+def _load_torch():
+    from sentence_transformers import SentenceTransformer
+
+    if config.EMBEDDING_THREADS or config.EMBEDDING_INTEROP_THREADS:
+        import torch
+    if config.EMBEDDING_THREADS:
+        torch.set_num_threads(config.EMBEDDING_THREADS)
+    if config.EMBEDDING_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(config.EMBEDDING_INTEROP_THREADS)
+        except RuntimeError:
+            # only allowed before torch has run anything in parallel
+            logger.warning("Could not set torch inter-op threads, torch was already in use")
+
+    return SentenceTransformer(config.MODEL_NAME, device=config.EMBEDDING_DEVICE)
+
+def _find_onnx(model_dir: str, pattern: str):
+    '''
+    path (relative to model_dir) of the first onnx file matching pattern, or None.
+    '''
+    found = sorted(glob.glob(os.path.join(model_dir, "**", pattern), recursive=True))
+    return os.path.relpath(found[0], model_dir) if found else None
+
+def _load_onnx():
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    import onnxruntime as ort
+
+    model_dir = os.path.join(config.EMBEDDING_ONNX_DIR, config.MODEL_NAME.replace("/", "__"))
+    if _find_onnx(model_dir, "model.onnx") is None:
+        # first run: export (or download) the onnx graph once, later processes load it from disk
+        logger.info(f"Exporting {config.MODEL_NAME} to onnx in {model_dir}")
+        SentenceTransformer(config.MODEL_NAME, device="cpu", backend="onnx").save(model_dir)
+
+    file_name = _find_onnx(model_dir, "model.onnx")
+    if config.EMBEDDING_QUANTIZE:
+        pattern = f"model_*int8_{config.EMBEDDING_QUANTIZE}.onnx"
+        if _find_onnx(model_dir, pattern) is None:
+            logger.info(f"Quantizing {config.MODEL_NAME} to int8 for {config.EMBEDDING_QUANTIZE}")
+            export_dynamic_quantized_onnx_model(
+                SentenceTransformer(model_dir, device="cpu", backend="onnx", model_kwargs={"file_name": file_name}),
+                config.EMBEDDING_QUANTIZE,
+                model_dir,
+            )
+        file_name = _find_onnx(model_dir, pattern)
+
+    options = ort.SessionOptions()
+    if config.EMBEDDING_THREADS:
+        options.intra_op_num_threads = config.EMBEDDING_THREADS
+    if config.EMBEDDING_INTEROP_THREADS:
+        # inter-op threads are only used when independent graph nodes may run in parallel
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.inter_op_num_threads = config.EMBEDDING_INTEROP_THREADS
+
+    return SentenceTransformer(
+        model_dir,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider", "session_options": options},
+    )
+
+BACKENDS = {"torch": _load_torch, "onnx": _load_onnx}
+
+def get_model():
+    '''
+    return the shared SentenceTransformer, loading it on first use.
+    '''
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                load = BACKENDS.get(config.EMBEDDING_BACKEND)
+                if load is None:
+                    raise ValueError(f"Unknown EMBEDDING_BACKEND '{config.EMBEDDING_BACKEND}', expected one of {sorted(BACKENDS)}")
+
+                # heavy imports happen in the loaders, so importing this module is free
+                model = load()
+                if config.EMBEDDING_MAX_SEQ_LENGTH:
+                    model.max_seq_length = config.EMBEDDING_MAX_SEQ_LENGTH
+
+                logger.info(f"Loaded embedding model {config.MODEL_NAME} ({config.EMBEDDING_BACKEND}) on {model.device}")
+                _model = model
+    return _model
+
+# encode() options that don't change the vectors, so cached ones can be returned
+CACHE_SAFE_OPTIONS = {"batch_size", "show_progress_bar"}
+
+def _run_model(texts, **kwargs):
+    '''
+    the actual forward pass: in the process pool if there is one, else in this process.
+    '''
+    metrics.EMBEDDING_BATCH_SIZE.observe(1 if isinstance(texts, str) else len(texts))
+    if config.EMBEDDING_PROCESSES > 1 and CACHE_SAFE_OPTIONS.issuperset(kwargs):
+        from embed_pool import get_pool
+        return get_pool().encode(texts, batch_size=kwargs.get("batch_size"))
+    return get_model().encode(texts, **kwargs)
+
+def encode(texts, **kwargs):
+    '''
+    embed a string or a list of strings with the shared model (numpy output).
+    '''
+    cache = get_cache()
+    single = isinstance(texts, str)
+    batch = [texts] if single else list(texts)
+    if cache is None or not batch or not CACHE_SAFE_OPTIONS.issuperset(kwargs):
+        return _run_model(texts, **kwargs)
+
+    keys = [cache.key(text) for text in batch]
+    vectors = cache.get_many(keys)
+
+    # each distinct uncached text goes to the model once
+    missing = {key: text for key, text in zip(keys, batch) if key not in vectors}
+    if missing:
+        computed = _run_model(list(missing.values()), **kwargs)
+        new = dict(zip(missing, computed))
+        cache.put_many(new)
+        vectors.update(new)
+
+    embeddings = np.stack([vectors[key] for key in keys]).astype(np.float32, copy=False)
+    return embeddings[0] if single else embeddings
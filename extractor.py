@@ -2,45 +2,114 @@
 extracts the main idea from a blog post/ article
 mini summarizer that focuses on key insights
 
-- utilizes sentence_transformers  to understand meaning of sentences
-- uses sent_tokenize from nltk to break up article/ blohg into individual sentences
+- utilizes sentence_transformers (shared model from encoder.py) to understand meaning of sentences
+- uses sentences.py (nltk punkt by default) to break up article/ blohg into individual sentences
 - ranks sentences based on how close they are to the average topic
 - return the top 1- 2 most important sentences (thesis)
+- extract_thesis_with_embeddings also hands back the vectors it already computed, so the
+  clustering stage never has to run the model on the same sentences again
+- split_sentences / rank_sentences are the two halves of that, for callers (like pipeline.py)
+  that embed many posts' sentences together through the micro-batcher (batcher.py)
+- centrality is computed in O(n*d) instead of building the n x n similarity matrix: the sum of a
+  sentence's cosine similarities to all sentences is its dot product with the sum of all the
+  normalized vectors
+- very long posts are capped at EXTRACT_MAX_SENTENCES sentences before anything is embedded: the
+  opening sentences are kept, the rest is sampled evenly across the post
+- extract_theses_with_embeddings does many posts at once, with a single model call
 
 '''
 
-from sentence_transformers import SentenceTransformer, util
-import nltk
-from nltk.tokenize import sent_tokenize
+from batcher import get_batcher
+from typing import NamedTuple, Optional
+import numpy as np
+import config
+import sentences as sentence_splitter
 
-# Download the tokenizer (first time only)
-nltk.download('punkt')
+class Extraction(NamedTuple):
+    sentences: list[str]            # thesis sentences, most central first
+    embeddings: np.ndarray          # one row per thesis sentence, same order
+    mean_embedding: Optional[np.ndarray]  # mean over every sentence of the post (None if empty)
 
-# Load the sentence transformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+def sample_sentences(sentences: list[str], max_sentences: int) -> list[str]:
+    '''
+    at most max_sentences of the sentences, in their original order: the first quarter of the budget
+    goes to the opening of the post (where the thesis usually is), the rest is spread evenly.
+    '''
+    if not max_sentences or len(sentences) <= max_sentences:
+        return sentences
 
-def extract_thesis(content: str, top_n: int = 2) -> list[str]:
+    lead = max_sentences // 4
+    rest = np.linspace(lead, len(sentences) - 1, max_sentences - lead).round().astype(int)
+    return sentences[:lead] + [sentences[i] for i in rest]
+
+def split_sentences(content: str, max_sentences: int = None) -> list[str]:
     '''
-    extract the top_n most central sentences from a blog post.
+    break a post up into sentences, capped at max_sentences (default EXTRACT_MAX_SENTENCES, 0 = no cap).
     '''
-    sentences = sent_tokenize(content)
+    max_sentences = config.EXTRACT_MAX_SENTENCES if max_sentences is None else max_sentences
+    return sample_sentences(sentence_splitter.split(content), max_sentences)
 
+def rank_sentences(sentences: list[str], embeddings: np.ndarray, top_n: int = 2) -> Extraction:
+    '''
+    pick the top_n most central sentences, given one embedding row per sentence.
+    '''
     if len(sentences) == 0:
-        return []
+        return Extraction([], np.empty((0, 0), dtype=np.float32), None)
 
-    if len(sentences) <= top_n:
-        return sentences  # return all if fewer than top_n
+    mean_embedding = embeddings.mean(axis=0)
 
-    # convert to embeddings
-    embeddings = model.encode(sentences, convert_to_tensor=True)
+    if len(sentences) <= top_n:
+        # return all if fewer than top_n
+        return Extraction(sentences, embeddings, mean_embedding)
 
-    # compute similarity matrix
-    cosine_scores = util.pytorch_cos_sim(embeddings, embeddings)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.where(norms == 0, 1, norms)
 
-    # centrality = sum of similarities
-    centrality_scores = cosine_scores.sum(axis=1)
+    # centrality = sum of cosine similarities to every sentence = dot with the sum of all vectors
+    centrality_scores = normalized @ normalized.sum(axis=0)
 
     # get indices of top_n most central sentences
-    top_indices = centrality_scores.argsort(descending=True)[:top_n]
+    top_indices = np.argsort(-centrality_scores, kind="stable")[:top_n]
+
+    return Extraction(
+        [sentences[i] for i in top_indices],
+        embeddings[top_indices],
+        mean_embedding,
+    )
+
+def extract_thesis_with_embeddings(content: str, top_n: int = 2) -> Extraction:
+    '''
+    extract the top_n most central sentences from a blog post, together with their embeddings.
+    '''
+    sentences = split_sentences(content)
 
-    return [sentences[i] for i in top_indices]
+    # convert to embeddings (every sentence is encoded exactly once, batched with any concurrent callers)
+    embeddings = get_batcher().encode(sentences)
+
+    return rank_sentences(sentences, embeddings, top_n)
+
+def extract_theses_with_embeddings(contents: list[str], top_n: int = 2) -> list[Extraction]:
+    '''
+    extract_thesis_with_embeddings for many posts, embedding all of their sentences in one call.
+    '''
+    split = [split_sentences(content) for content in contents]
+    embeddings = get_batcher().encode([sentence for sentences in split for sentence in sentences])
+
+    extractions = []
+    start = 0
+    for sentences in split:
+        extractions.append(rank_sentences(sentences, embeddings[start:start + len(sentences)], top_n))
+        start += len(sentences)
+    return extractions
+
+def extract_thesis(content: str, top_n: int = 2) -> list[str]:
+    '''
+    extract the top_n most central sentences from a blog post.
+    '''
+    return extract_thesis_with_embeddings(content, top_n).sentences
+
+def extract_theses(contents: list[str], top_n: int = 2) -> list[list[str]]:
+    '''
+    extract_thesis for many posts at once.
+    '''
+    return [extraction.sentences for extraction in extract_theses_with_embeddings(contents, top_n)]
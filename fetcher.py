@@ -0,0 +1,190 @@
+'''
+concurrent feed fetching for bulk ingestion
+
+- downloads many feeds at once with asyncio + httpx, reusing pooled keep-alive connections
+- concurrency is capped globally (FEED_FETCH_CONCURRENCY) and per host (FEED_FETCH_PER_HOST),
+  and urls are interleaved by host so one big site can't take every slot or get hammered
+- downloaded bodies are parsed with feedparser in a process pool (FEED_PARSE_WORKERS), since
+  parsing is cpu-bound pure python; set it to 0 to parse in a thread instead
+- urls that aren't http(s) (local files) are handed to feedparser as they are
+- stored ETag / Last-Modified validators are sent as If-None-Match / If-Modified-Since, and a
+  304 comes back as not_modified without downloading or parsing anything
+- iter_feeds() hands each parsed feed back to ordinary (sync) code as soon as it is ready, through
+  a bounded queue, so fetching never runs far ahead of ingestion
+- each feed's download + parse time goes to metrics.STAGE_SECONDS as the "fetch" stage
+
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+from collections import defaultdict
+from itertools import zip_longest
+import feedparser
+import httpx
+import asyncio
+import config
+import metrics
+import queue
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+class FetchedFeed(NamedTuple):
+    url: str
+    feed: Optional[feedparser.FeedParserDict]  # None if the fetch failed or the feed is unchanged
+    error: Optional[str] = None
+    status: Optional[int] = None
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+def _parse(content, headers: dict) -> feedparser.FeedParserDict:
+    feed = feedparser.parse(content, response_headers=headers)
+    # parser exceptions don't always pickle, and only the message is useful to callers
+    if "bozo_exception" in feed:
+        feed["bozo_exception"] = str(feed["bozo_exception"])
+    return feed
+
+def _interleave_by_host(urls: list[str]) -> list[str]:
+    '''
+    reorder urls round-robin across hosts, so workers spread out instead of queueing on one host.
+    '''
+    by_host = defaultdict(list)
+    for url in urls:
+        by_host[urlsplit(url).hostname or ""].append(url)
+    return [url for group in zip_longest(*by_host.values()) for url in group if url is not None]
+
+async def _fetch_one(client, url: str, validators: tuple, host_limits: dict, parse_pool) -> FetchedFeed:
+    host = urlsplit(url).hostname or ""
+    if host not in host_limits:
+        host_limits[host] = asyncio.Semaphore(config.FEED_FETCH_PER_HOST)
+
+    etag, modified = validators
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    started = None  # waiting for a host slot is not counted
+    try:
+        if urlsplit(url).scheme not in ("http", "https"):
+            # a local file (or file:// url): feedparser reads it itself
+            started = time.perf_counter()
+            feed = await asyncio.get_running_loop().run_in_executor(parse_pool, _parse, url, {})
+            return FetchedFeed(url, feed, status=feed.get("status"))
+
+        async with host_limits[host]:
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304:
+            return FetchedFeed(url, None, status=304)
+        response.raise_for_status()
+
+        loop = asyncio.get_running_loop()
+        feed = await loop.run_in_executor(parse_pool, _parse, response.content, dict(response.headers))
+        return FetchedFeed(
+            url, feed,
+            status=response.status_code,
+            etag=response.headers.get("etag"),
+            modified=response.headers.get("last-modified"),
+        )
+    except Exception as e:
+        logger.warning(f"Failed to fetch feed {url}: {e}")
+        return FetchedFeed(url, None, str(e))
+    finally:
+        if started is not None:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="fetch")
+
+def _put(results: queue.Queue, item, stop: threading.Event) -> bool:
+    '''
+    queue item for the consumer, waiting while it is behind; False once it stopped listening.
+    '''
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+async def _fetch_all(urls: list[str], validators: dict, results: queue.Queue, stop: threading.Event):
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Queue()
+    for url in _interleave_by_host(urls):
+        pending.put_nowait(url)
+
+    # the worker count is the global concurrency limit
+    workers = min(config.FEED_FETCH_CONCURRENCY, len(urls))
+    host_limits = {}
+    # a single feed (parse_feed) isn't worth starting worker processes for
+    # spawn, not fork: this process already runs batcher, pipeline and torch threads (as in embed_pool.py)
+    parse_pool = (ProcessPoolExecutor(config.FEED_PARSE_WORKERS, mp_context=mp.get_context("spawn"))
+                  if config.FEED_PARSE_WORKERS and len(urls) > 1 else None)
+
+    async def worker(client):
+        while not stop.is_set():
+            try:
+                url = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = await _fetch_one(client, url, validators.get(url, (None, None)), host_limits, parse_pool)
+            # blocks (off the event loop) while the consumer is behind
+            if not await loop.run_in_executor(None, _put, results, result, stop):
+                return
+
+    try:
+        async with httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=workers, max_keepalive_connections=workers),
+            timeout=config.FEED_FETCH_TIMEOUT,
+            headers={"User-Agent": config.USER_AGENT},
+            follow_redirects=True,
+        ) as client:
+            await asyncio.gather(*(worker(client) for _ in range(workers)))
+    finally:
+        if parse_pool:
+            parse_pool.shutdown()
+
+def iter_feeds(urls: list[str], validators: dict = None, buffer: int = 16):
+    '''
+    fetch and parse every url concurrently, yielding a FetchedFeed for each as soon as it is ready
+    (in completion order, not input order). validators maps url -> (etag, last_modified) from the
+    previous fetch. a consumer that stops early (or closes the generator) stops the fetching: feeds
+    already downloading finish, no new ones start.
+    '''
+    if not urls:
+        return
+
+    results = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+
+    def run():
+        try:
+            asyncio.run(_fetch_all(urls, validators or {}, results, stop))
+        except Exception as e:
+            logger.error(f"Bulk fetch stopped early: {e}")
+        finally:
+            _put(results, _DONE, stop)
+
+    thread = threading.Thread(target=run, name="feed-fetcher", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            result = results.get()
+            if result is _DONE:
+                break
+            yield result
+    finally:
+        stop.set()
+        thread.join()
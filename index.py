@@ -0,0 +1,283 @@
+'''
+in-memory vector index used to match a new embedding against the stored ones
+
+- keeps every embedding in one contiguous float32 matrix, L2-normalized on insert,
+  so cosine similarity is a plain dot product
+- keeps a parallel list of labels (e.g. theme ids) so the best row maps straight to its label
+- exact mode answers a query with a single matrix-vector product over the whole matrix
+- rows can be overwritten in place (used for running theme centroids that move as members are added)
+- searches can be limited to a subset of rows (a list of rows, or a boolean mask per row), used
+  for the theme / date filters of semantic search (search.py)
+- ivf mode groups rows under coarse k-means centroids and only scans the nprobe closest groups,
+  so query cost stays sublinear as the corpus grows. the groups are (re)trained automatically
+  once enough rows exist; below that the index just answers exactly.
+- training runs in a background thread on the rows present when it started, without the lock;
+  adds and searches carry on with the old groups (or exactly, before the first training) and the
+  new groups are swapped in when ready
+
+'''
+
+import threading
+import numpy as np
+
+# below this many rows an exact scan is already fast, so ivf does not bother training
+IVF_MIN_ROWS = 10_000
+# rows per centroid used to train the coarse quantizer
+IVF_TRAIN_ROWS_PER_LIST = 64
+IVF_TRAIN_ITERATIONS = 10
+# rows scored per block when assigning rows to centroids (keeps temporary memory bounded)
+ASSIGN_BLOCK_ROWS = 1024
+
+
+def normalize(vectors) -> np.ndarray:
+    '''
+    return a float32 copy of a vector (1-d) or of a batch of vectors (2-d) scaled to unit length.
+    zero vectors are left as zeros.
+    '''
+    arr = np.array(vectors, dtype=np.float32)
+    if arr.ndim == 1:
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm > 0 else arr
+    norms = np.linalg.norm(arr, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def _nearest_centroid(rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    '''
+    index of the most similar centroid for every row, scored block by block.
+    '''
+    assignment = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), ASSIGN_BLOCK_ROWS):
+        block = rows[start:start + ASSIGN_BLOCK_ROWS]
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+class VectorIndex:
+    '''
+    thread-safe cosine similarity index. rows are appended or overwritten in place, never removed.
+    '''
+
+    def __init__(self, mode: str = "exact", nlist: int = 0, nprobe: int = 8):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown vector index mode: {mode}")
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._labels = []
+
+        # ivf state, empty until trained
+        self._centroids = None
+        self._buckets = []
+        self._row_buckets = []
+        self._trained_size = 0
+        self._training = None  # background training thread
+        self._updated_while_training = set()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, rows: int, dim: int):
+        '''
+        make sure the matrix can hold `rows` rows, growing it geometrically so appends stay amortized O(dim).
+        '''
+        if self._size and self._matrix.shape[1] != dim:
+            raise ValueError(f"Expected embeddings of dimension {self._matrix.shape[1]}, got {dim}")
+        capacity = self._matrix.shape[0]
+        if rows <= capacity and self._matrix.shape[1] == dim:
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        grown = np.zeros((new_capacity, dim), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def add(self, vectors, labels) -> int:
+        '''
+        append a batch of vectors with their labels. returns the row number of the first one.
+        '''
+        vectors = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        labels = list(labels)
+        if len(labels) != len(vectors):
+            raise ValueError("Every vector needs exactly one label")
+
+        with self._lock:
+            start = self._size
+            self._reserve(start + len(vectors), vectors.shape[1])
+            self._matrix[start:start + len(vectors)] = vectors
+            self._labels.extend(labels)
+            self._size += len(vectors)
+
+            if self._centroids is not None:
+                for offset, bucket in enumerate(_nearest_centroid(vectors, self._centroids)):
+                    self._buckets[bucket].append(start + offset)
+                    self._row_buckets.append(int(bucket))
+
+            if self._needs_training():
+                self._start_training()
+
+            return start
+
+    def update(self, row: int, vector):
+        '''
+        overwrite the vector stored at `row`, keeping its label.
+        '''
+        vector = normalize(vector)
+
+        with self._lock:
+            if not 0 <= row < self._size:
+                raise IndexError(f"Row {row} is not in the index")
+            self._matrix[row] = vector
+            if self._training is not None:
+                self._updated_while_training.add(row)
+
+            if self._centroids is not None:
+                bucket = int(np.argmax(self._centroids @ vector))
+                old_bucket = self._row_buckets[row]
+                if bucket != old_bucket:
+                    self._buckets[old_bucket].remove(row)
+                    self._buckets[bucket].append(row)
+                    self._row_buckets[row] = bucket
+
+    def search(self, vector, k: int = 1, rows=None, mask=None) -> list[tuple]:
+        '''
+        return up to k (label, cosine similarity) pairs, best first.
+        rows limits the search to those row numbers (scored exactly, meant for small subsets); mask
+        (one bool per row, rows past its end count as False) leaves out the rows where it is False.
+        in ivf mode, a mask that keeps fewer than k of the probed rows is answered exactly instead.
+        '''
+        query = normalize(vector)
+
+        with self._lock:
+            if not self._size:
+                return []
+            if mask is not None:
+                mask = np.asarray(mask, dtype=bool)[:self._size]
+                if len(mask) < self._size:
+                    mask = np.concatenate([mask, np.zeros(self._size - len(mask), dtype=bool)])
+
+            if rows is not None:
+                rows = np.asarray(rows, dtype=np.int64)
+                if mask is not None:
+                    rows = rows[mask[rows]]
+            elif self._centroids is not None:
+                rows = self._candidate_rows(query)
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                    if len(rows) < k:
+                        rows = None
+
+            if rows is not None:
+                if not len(rows):
+                    return []
+                scores = self._matrix[rows] @ query
+            else:
+                scores = self._matrix[:self._size] @ query
+                if mask is not None:
+                    k = min(k, int(np.count_nonzero(mask)))
+                    if not k:
+                        return []
+                    scores = np.where(mask, scores, -np.inf)
+
+            k = min(k, len(scores))
+            if k == 1:
+                top = [int(np.argmax(scores))]
+            else:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+
+            return [
+                (self._labels[int(rows[i]) if rows is not None else int(i)], float(scores[i]))
+                for i in top
+            ]
+
+    def wait_for_training(self):
+        '''
+        block until background training (including any round it chains into) has been swapped in.
+        '''
+        while True:
+            training = self._training
+            if training is None:
+                return
+            training.join()
+
+    # ivf helpers
+
+    def _needs_training(self) -> bool:
+        if self.mode != "ivf" or self._size < IVF_MIN_ROWS or self._training is not None:
+            return False
+        # retrain when the corpus has grown enough that the old buckets are unbalanced
+        return self._centroids is None or self._size >= 4 * self._trained_size
+
+    def _start_training(self):
+        # called with the lock held. the view stays valid when _reserve() swaps in a bigger matrix
+        self._updated_while_training.clear()
+        self._training = threading.Thread(target=self._train, args=(self._matrix[:self._size],),
+                                          name="vector-index-train", daemon=True)
+        self._training.start()
+
+    def _train(self, data: np.ndarray):
+        '''
+        spherical k-means on a sample of data (the first len(data) rows), then bucket every row
+        under its nearest centroid. runs without the lock; only the swap at the end takes it.
+        '''
+        trained = False
+        try:
+            centroids, assignment = self._kmeans(data)
+            with self._lock:
+                # rows appended, or overwritten, since the training started
+                size = len(data)
+                if self._size > size:
+                    assignment = np.concatenate([assignment, _nearest_centroid(self._matrix[size:self._size], centroids)])
+                for row in self._updated_while_training:
+                    if row < size:
+                        assignment[row] = int(np.argmax(centroids @ self._matrix[row]))
+
+                order = np.argsort(assignment, kind="stable")
+                bounds = np.cumsum(np.bincount(assignment, minlength=len(centroids)))[:-1]
+                self._centroids = centroids
+                self._buckets = [bucket.tolist() for bucket in np.split(order, bounds)]
+                self._row_buckets = assignment.tolist()
+                self._trained_size = size
+                trained = True
+        finally:
+            with self._lock:
+                self._training = None
+                self._updated_while_training.clear()
+                # rows kept coming while it trained: they may already call for the next round
+                if trained and self._needs_training():
+                    self._start_training()
+
+    def _kmeans(self, data: np.ndarray) -> tuple:
+        '''
+        (centroids, nearest centroid of every row of data).
+        '''
+        size = len(data)
+        nlist = min(self.nlist or int(4 * np.sqrt(size)), size)
+
+        rng = np.random.default_rng(0)
+        sample_size = min(size, nlist * IVF_TRAIN_ROWS_PER_LIST)
+        sample = data[rng.choice(size, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assignment = _nearest_centroid(sample, centroids)
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = normalize(sums)
+
+        return centroids, _nearest_centroid(data, centroids)
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        nprobe = min(self.nprobe, len(self._centroids))
+        closeness = self._centroids @ query
+        probe = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+        return np.concatenate([np.asarray(self._buckets[c], dtype=np.int64) for c in probe])
@@ -0,0 +1,209 @@
+'''
+background ingest jobs
+
+- /ingest only stores a Job row (status "queued") and returns its id, so the http request never
+  waits for downloading, tokenizing or the model
+- workers (threads in the web app, see INGEST_WORKERS, and/or separate run_worker.py processes)
+  claim queued jobs and run the normal ingest pipeline (rss.parse_feed / rss.parse_feeds)
+- the queue is the job table itself, so queued jobs survive restarts. a job is claimed with a
+  conditional UPDATE ... WHERE status = 'queued', so two workers can never run the same job
+- progress counts are written after every feed, and GET /jobs/{id} reads them back
+- a running job's updated_at is its heartbeat: every progress write refreshes it, and so does a
+  timer every JOB_STALE_AFTER / 4 seconds, so a long feed doesn't look dead. workers look for jobs
+  whose heartbeat is older than JOB_STALE_AFTER (their worker died) every REQUEUE_CHECK_SECONDS
+  and queue them again
+
+'''
+
+from sqlmodel import select
+from sqlalchemy import func, update
+from models import Job
+from db import get_session
+from datetime import datetime, timedelta
+from typing import Optional
+import config
+import os
+import threading
+import time
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()  # set when a job is enqueued in this process
+_stop = threading.Event()
+_workers = []
+
+REQUEUE_CHECK_SECONDS = 60
+_requeue_lock = threading.Lock()
+_last_requeue_check = None  # time.monotonic() of the last requeue_stale() in this process
+
+def enqueue(feed_urls: list[str]) -> Job:
+    '''
+    store a new queued job and wake up the local workers.
+    '''
+    job = Job(id=uuid.uuid4().hex, feed_urls=list(feed_urls))
+    with get_session() as session:
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    _wakeup.set()
+    return job
+
+def get_job(job_id: str) -> Optional[Job]:
+    with get_session() as session:
+        return session.get(Job, job_id)
+
+def claim_next(worker: str) -> Optional[Job]:
+    '''
+    atomically take the oldest queued job. returns None when nothing is queued.
+    '''
+    with get_session() as session:
+        while True:
+            job_id = session.exec(
+                select(Job.id).where(Job.status == "queued").order_by(Job.created_at).limit(1)
+            ).first()
+            if job_id is None:
+                return None
+
+            now = datetime.utcnow()
+            claimed = session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(status="running", worker=worker, started_at=now, updated_at=now)
+            ).rowcount
+            session.commit()
+            if claimed:
+                return session.get(Job, job_id)
+            # another worker got there first, try the next one
+
+def requeue_stale():
+    '''
+    put jobs whose worker stopped mid-run (no heartbeat for JOB_STALE_AFTER seconds) back in the queue.
+    '''
+    cutoff = datetime.utcnow() - timedelta(seconds=config.JOB_STALE_AFTER)
+    with get_session() as session:
+        requeued = session.execute(
+            update(Job)
+            # jobs claimed before the heartbeat column existed only have started_at
+            .where(Job.status == "running", func.coalesce(Job.updated_at, Job.started_at) < cutoff)
+            .values(status="queued", worker=None, started_at=None, updated_at=None)
+        ).rowcount
+        session.commit()
+    if requeued:
+        logger.warning(f"Requeued {requeued} stale ingest jobs")
+
+def _requeue_stale_periodically():
+    '''
+    requeue_stale() at most once every REQUEUE_CHECK_SECONDS per process, from whichever worker gets here first.
+    '''
+    global _last_requeue_check
+    with _requeue_lock:
+        now = time.monotonic()
+        if _last_requeue_check is not None and now - _last_requeue_check < REQUEUE_CHECK_SECONDS:
+            return
+        _last_requeue_check = now
+    try:
+        requeue_stale()
+    except Exception as e:
+        logger.error(f"Requeueing stale ingest jobs failed: {e}")
+
+def _save_progress(job_id: str, **values):
+    '''
+    update the job's row; every write also refreshes its heartbeat.
+    '''
+    with get_session() as session:
+        session.execute(update(Job).where(Job.id == job_id).values(updated_at=datetime.utcnow(), **values))
+        session.commit()
+
+def _heartbeat(job_id: str, finished: threading.Event):
+    # a single big feed can run longer than JOB_STALE_AFTER without writing any progress
+    while not finished.wait(max(config.JOB_STALE_AFTER / 4, 1)):
+        try:
+            _save_progress(job_id)
+        except Exception as e:
+            logger.error(f"Heartbeat of ingest job {job_id} failed: {e}")
+
+def run_job(job: Job):
+    '''
+    ingest the job's feeds, recording progress as each feed finishes and the outcome at the end.
+    '''
+    # imported here so the web app doesn't load the ingest pipeline until a worker needs it
+    from rss import parse_feed, parse_feeds
+
+    logger.info(f"Running ingest job {job.id} ({len(job.feed_urls)} feeds)")
+    finished = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job.id, finished), name=f"job-heartbeat-{job.id[:8]}", daemon=True).start()
+    try:
+        if len(job.feed_urls) == 1:
+            result = parse_feed(job.feed_urls[0])
+            if result.get("error"):
+                raise RuntimeError(result["error"])
+            feeds_done = 1
+        else:
+            done = {"feeds": 0, "total": 0, "skipped": 0, "ingested": 0}
+
+            def on_feed(url: str, counts: dict):
+                done["feeds"] += 1
+                for key in ("total", "skipped", "ingested"):
+                    done[key] += counts[key]
+                _save_progress(job.id, feeds_done=done["feeds"], fetched=done["total"],
+                               skipped=done["skipped"], ingested=done["ingested"])
+
+            result = parse_feeds(job.feed_urls, on_feed=on_feed)
+            feeds_done = len(result["feeds"])
+
+        _save_progress(
+            job.id,
+            status="done",
+            feeds_done=feeds_done,
+            fetched=result["total"],
+            skipped=result["skipped"],
+            ingested=result["ingested"],
+            not_modified=bool(result.get("not_modified")),
+            finished_at=datetime.utcnow(),
+        )
+        logger.info(f"Ingest job {job.id} done: {result['ingested']} new, {result['skipped']} skipped")
+    except Exception as e:
+        logger.error(f"Ingest job {job.id} failed: {e}")
+        _save_progress(job.id, status="failed", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        finished.set()
+
+def work(name: str):
+    '''
+    worker loop: run queued jobs one at a time until stop_workers() is called.
+    '''
+    worker = f"{os.getpid()}-{name}"
+    while not _stop.is_set():
+        _requeue_stale_periodically()
+        job = claim_next(worker)
+        if job is None:
+            # sleep until a local enqueue or the next poll (jobs may come from other processes)
+            _wakeup.wait(config.JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        run_job(job)
+
+def start_workers(count: int):
+    '''
+    start count worker threads in this process.
+    '''
+    if count <= 0:
+        return
+    _stop.clear()
+    for i in range(count):
+        thread = threading.Thread(target=work, args=(f"worker-{i}",), name=f"ingest-worker-{i}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+    logger.info(f"Started {count} ingest workers")
+
+def stop_workers():
+    '''
+    ask the workers to stop and wait for the jobs they are running to finish.
+    '''
+    _stop.set()
+    _wakeup.set()
+    while _workers:
+        _workers.pop().join()
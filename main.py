@@ -3,51 +3,136 @@ This is the FastAPI web server that powers the API.
 turns this project to a usable API
 
 it defines 3 main endpoints:
-- /themes which returns a list of theme_ids and how many theses are in each.
+- /themes which returns a list of theme_ids and how many theses are in each (read straight from the theme table).
 - /themes/{theme_id} which returns all theses grouped under a given theme, sorted by date.
-- /ingest which accepts a JSON body with a feed_url, and calls parse_feed() to ingest new content.
+  both are paginated: a full page sets an X-Next-Cursor header, pass it back as ?cursor= for the next page.
+- /ingest which accepts a JSON body with a feed_url and queues a background job that calls parse_feed()
+  to ingest new content (see jobs.py). it answers right away with a job_id.
+- /jobs/{job_id} which returns a job's status, progress counts and timings.
+- /search?q=...&k=... which returns the k theses closest in meaning to the query, with their cosine
+  scores, optionally within one theme (theme_id=) and/or a date range (since= / until=).
+  served from an in-memory embedding index (see search.py).
+- /stats which returns runtime counters (embedding cache hits / misses).
+- /metrics which exposes ingest stage timings, counters, model batch sizes and db query latencies
+  for prometheus (see metrics.py).
+- /ingest/bulk which accepts a list of feed_urls and queues one job that fetches them concurrently and
+  ingests them together (parse_feeds()). it answers right away with a job_id, like /ingest.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from sqlmodel import select
 # from sqlmodel import select
-from db import get_session
-from models import Thesis
-from typing import List
-from collections import defaultdict
+from sqlalchemy import func, tuple_
+from db import get_session, init_db
+from models import Thesis, Theme, ThemeAlias
+from jobs import enqueue, get_job, start_workers, stop_workers
+from embedding_cache import get_cache
+from embed_pool import close_pool
+from search import find_theses, preload as preload_search
+from typing import List, Optional
+from datetime import datetime
+import base64
+import config
+import metrics
 
 app = FastAPI(title="Culldron Insight Extractor")
 
+MAX_PAGE_SIZE = 5000
+MAX_SEARCH_RESULTS = 100
+
+@app.on_event("startup")
+def on_startup():
+    # creates any missing tables (e.g. the theme table on an older culldron.db)
+    init_db()
+    start_workers(config.INGEST_WORKERS)
+    if config.SEARCH_PRELOAD:
+        preload_search()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_workers()
+    close_pool()
+
+def encode_cursor(*values) -> str:
+    """
+    opaque pagination cursor: the sort key of the last row on the page.
+    """
+    raw = "|".join("" if v is None else (v.isoformat() if isinstance(v, datetime) else str(v)) for v in values)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, parts: int) -> list[str]:
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", parts - 1)
+    except Exception:
+        values = []
+    if len(values) != parts:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
 @app.get("/themes")
-def list_themes():
+def list_themes(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
     """
     list all unique theme IDs with the count of posts in each.
+    the counts are kept in the theme table, so this never scans theses. paginated by theme id:
+    pass the X-Next-Cursor response header back as ?cursor= to get the next page.
     """
+    query = select(Theme.id, Theme.member_count).where(Theme.member_count > 0)
+    if cursor:
+        (after_id,) = decode_cursor(cursor, 1)
+        query = query.where(Theme.id > after_id)
+
     with get_session() as session:
-        results = session.exec(select(Thesis.theme_id)).all()
+        results = session.exec(query.order_by(Theme.id).limit(limit)).all()
 
-    theme_counts = defaultdict(int)
-    for theme_id in results:
-        if theme_id:
-            theme_counts[theme_id] += 1
+    if len(results) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(results[-1][0])
 
-    return [{"theme_id": k, "count": v} for k, v in theme_counts.items()]
+    return [{"theme_id": theme_id, "count": count} for theme_id, count in results]
 
 
 @app.get("/themes/{theme_id}")
-def theme_timeline(theme_id: str):
+def theme_timeline(
+    theme_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
     """
-    return all posts in a given theme, sorted by publish date.
+    return the posts in a given theme, sorted by publish date (ingest date when unknown).
+    keyset-paginated on (date, id) and served from the ix_thesis_theme_timeline index;
+    the embedding column is never read.
     """
-    with get_session() as session:
-        results = session.exec(
-            select(Thesis).where(Thesis.theme_id == theme_id)
-        ).all()
+    sort_at = func.coalesce(Thesis.published_at, Thesis.ingested_at)
+    query = select(
+        Thesis.id, Thesis.thesis_text, Thesis.post_title, Thesis.post_url,
+        Thesis.published_at, Thesis.ingested_at,
+    ).where(Thesis.theme_id == theme_id)
+
+    if cursor:
+        after_at, after_id = decode_cursor(cursor, 2)
+        try:
+            after = (datetime.fromisoformat(after_at), int(after_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(sort_at, Thesis.id) > tuple_(*after))
 
-    if not results:
-        raise HTTPException(status_code=404, detail="Theme not found")
+    with get_session() as session:
+        results = session.exec(query.order_by(sort_at, Thesis.id).limit(limit)).all()
+        if not results and not cursor and session.get(Theme, theme_id) is None:
+            # merged away by re-clustering (recluster.py): send the client to the theme that took over
+            alias = session.get(ThemeAlias, theme_id)
+            if alias is not None:
+                return RedirectResponse(f"/themes/{alias.theme_id}?limit={limit}", status_code=308)
+            raise HTTPException(status_code=404, detail="Theme not found")
 
-    sorted_results = sorted(results, key=lambda x: x.published_at or x.ingested_at)
+    if len(results) == limit:
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.published_at or last.ingested_at, last.id)
 
     return [
         {
@@ -57,60 +142,163 @@ def theme_timeline(theme_id: str):
             "published_at": t.published_at,
             "ingested_at": t.ingested_at
         }
-        for t in sorted_results
+        for t in results
     ]
 
 from fastapi import Request
 from pydantic import BaseModel
-from rss import parse_feed
 
 class IngestRequest(BaseModel):
     feed_url: str
 
+class BulkIngestRequest(BaseModel):
+    feed_urls: List[str]
+
 
 
-from collections import defaultdict
 from db import get_session
 from models import Thesis
 
 def print_theme_ids_with_multiple_posts():
     with get_session() as session:
-        theme_ids = session.query(Thesis.theme_id).all()
-
-    theme_counts = defaultdict(int)
-    for (theme_id,) in theme_ids:
-        if theme_id:
-            theme_counts[theme_id] += 1
-
-    multiple_posts = {tid: count for tid, count in theme_counts.items() if count > 1}
+        multiple_posts = session.exec(
+            select(Thesis.theme_id, func.count(Thesis.id))
+            .where(Thesis.theme_id != None)
+            .group_by(Thesis.theme_id)
+            .having(func.count(Thesis.id) > 1)
+        ).all()
 
     if multiple_posts:
         print("Theme IDs with more than 1 post:")
-        for tid, count in multiple_posts.items():
+        for tid, count in multiple_posts:
             print(f"{tid}: {count} posts")
     else:
         print("No theme IDs with more than 1 post found.")
 
 
 
-@app.post("/ingest")
+def ingest_message(job) -> str:
+    if job.not_modified:
+        return "Feed has not changed since it was last fetched."
+    if job.fetched > 0 and job.fetched == job.skipped:
+        return "This URL has already been parsed."
+    return f"Feed ingested successfully. New posts ingested: {job.ingested}, skipped: {job.skipped}"
+
+def seconds_between(start, end):
+    return round((end - start).total_seconds(), 3) if start and end else None
+
+@app.post("/ingest", status_code=202)
 def ingest_feed(payload: IngestRequest):
     """
-    Ingest a new RSS feed by URL.
+    Queue a new RSS feed for ingestion by URL. Poll /jobs/{job_id} for the outcome.
     """
-    try:
-        result = parse_feed(payload.feed_url)
-        if result["total"] > 0 and result["total"] == result["skipped"]:
-            return {"message": "This URL has already been parsed."}
-        else:
-            return {"message": f"Feed ingested successfully. New posts ingested: {result['ingested']}, skipped: {result['skipped']}"}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    job = enqueue([payload.feed_url])
+    return {"job_id": job.id, "status": job.status}
 
 
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    status, progress counts and timings of an ingest job.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    now = datetime.utcnow()
+    result = {
+        "job_id": job.id,
+        "status": job.status,
+        "feed_urls": job.feed_urls,
+        "feeds_done": job.feeds_done,
+        "fetched": job.fetched,
+        "skipped": job.skipped,
+        "ingested": job.ingested,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "queued_seconds": seconds_between(job.created_at, job.started_at or now),
+        "run_seconds": seconds_between(job.started_at, job.finished_at or now),
+    }
+    if job.status == "done":
+        result["message"] = ingest_message(job)
+    if job.error:
+        result["error"] = job.error
+    return result
+
+
+@app.get("/search")
+def search_theses(
+    q: str = Query(..., min_length=1, max_length=2000),
+    k: int = Query(10, ge=1, le=MAX_SEARCH_RESULTS),
+    theme_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    semantic search: the theses closest in meaning to q, best first, with their cosine score.
+    the query is embedded once and matched against the in-memory thesis index (search.py), so the
+    embedding column is never read. theme_id limits it to one theme (an id merged away by
+    re-clustering means the theme that took it over), since / until to a publish date range.
+    """
+    with get_session() as session:
+        if theme_id and session.get(Theme, theme_id) is None:
+            alias = session.get(ThemeAlias, theme_id)
+            if alias is not None:
+                theme_id = alias.theme_id
+
+    hits = find_theses(q, k, theme_id, since, until)
+    if not hits:
+        return []
+
+    with get_session() as session:
+        rows = session.exec(
+            select(
+                Thesis.id, Thesis.thesis_text, Thesis.post_title, Thesis.post_url,
+                Thesis.published_at, Thesis.theme_id,
+            ).where(Thesis.id.in_([thesis_id for thesis_id, _ in hits]))
+        ).all()
+    found = {t.id: t for t in rows}
 
+    return [
+        {
+            "thesis_id": thesis_id,
+            "score": round(score, 4),
+            "thesis_text": found[thesis_id].thesis_text,
+            "post_title": found[thesis_id].post_title,
+            "post_url": found[thesis_id].post_url,
+            "published_at": found[thesis_id].published_at,
+            "theme_id": found[thesis_id].theme_id,
+        }
+        for thesis_id, score in hits if thesis_id in found
+    ]
 
 
+@app.get("/stats")
+def stats():
+    """
+    runtime counters of this process.
+    """
+    cache = get_cache()
+    return {"embedding_cache": cache.stats() if cache else None}
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    ingest stage timings, counters, model batch sizes and db query latencies of this process,
+    in the prometheus text format (see metrics.py).
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
+@app.post("/ingest/bulk", status_code=202)
+def ingest_feeds(payload: BulkIngestRequest):
+    """
+    Queue many RSS feeds for ingestion at once. Feeds are fetched concurrently and share one
+    embedding pipeline; poll /jobs/{job_id} for progress after each feed and the outcome.
+    """
+    if not payload.feed_urls:
+        raise HTTPException(status_code=400, detail="feed_urls is empty")
+    job = enqueue(payload.feed_urls)
+    return {"job_id": job.id, "status": job.status}
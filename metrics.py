@@ -0,0 +1,145 @@
+'''
+runtime metrics for ingestion, served by GET /metrics in the prometheus text format
+
+- no client library: a handful of counters and histograms kept in this process, each behind its
+  own lock (an increment is a dict update, cheap enough for the per-post hot path)
+- culldron_stage_seconds{stage}: time spent per unit of work in each ingest stage
+  - fetch: download + parse of one feed
+  - clean: html cleaning of one entry
+  - dedupe: minhash + near-duplicate lookup of one post
+  - tokenize: sentence splitting of one post
+  - embed: one embedding batch (cache lookups + model)
+  - extract: thesis ranking of one post
+  - match: theme matching of one post's theses
+  - commit: writing + committing one chunk of posts
+- counters for feeds (by result), feed entries, ingested posts, skipped posts (by reason) and
+  errors (by kind)
+- culldron_embedding_batch_size: sentences per model call (after the embedding cache)
+- culldron_db_query_seconds{operation}: every sql statement, timed by sqlalchemy engine events (see db.py)
+- values are per process: ingest done by run_worker.py processes doesn't show up on the web app's
+  /metrics
+
+'''
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+_metrics = []
+
+# seconds, from a fast in-memory step up to a slow feed download
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+        for key in sorted(values):
+            lines.extend(self._samples(key, values[key]))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)  # first upper bound >= value, len(buckets) = +Inf
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (not cumulative) followed by the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bucket] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        '''
+        observe the seconds spent in the with block (also when it raises).
+        '''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key: tuple, state: list) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(state[-1])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+STAGE_SECONDS = Histogram("culldron_stage_seconds", "Time spent per feed, post, batch or chunk in each ingest stage.", ("stage",))
+FEEDS = Counter("culldron_feeds_total", "Feeds that went through ingestion, by result (ok, not_modified, error).", ("result",))
+ENTRIES = Counter("culldron_feed_entries_total", "Entries listed in fetched feeds.")
+INGESTED = Counter("culldron_posts_ingested_total", "Posts stored as new theses.")
+SKIPPED = Counter("culldron_posts_skipped_total", "Entries that were not stored, by reason.", ("reason",))
+ERRORS = Counter("culldron_errors_total", "Ingest errors, by kind (feed: fetch or parse failed, commit: a chunk was rolled back).", ("kind",))
+EMBEDDING_BATCH_SIZE = Histogram(
+    "culldron_embedding_batch_size", "Sentences per embedding model call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+)
+DB_QUERY_SECONDS = Histogram(
+    "culldron_db_query_seconds", "SQL statement latency, by statement type.", ("operation",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+def render() -> str:
+    '''
+    every metric in the prometheus text exposition format (version 0.0.4).
+    '''
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
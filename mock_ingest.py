@@ -1,9 +1,13 @@
 from datetime import datetime
 import numpy as np
-from cluster import embed, find_matching_theme
-from extractor import extract_thesis
-from db import get_session
-from models import Thesis
+from cluster import embed, find_matching_theme, add_theme_member, update_theme_index
+from extractor import extract_thesis_with_embeddings
+from db import get_session, insert_ignore, existing_url_hashes
+from models import Thesis, MinhashBand
+from neardup import minhash, band_keys, pack_signature
+from search import add_theses
+from sqlalchemy import insert
+from urls import url_hash
 
 # Mock posts simulating related content with similar themes
 mock_posts = [
@@ -30,29 +34,29 @@ mock_posts = [
 def parse_mock_posts(posts=mock_posts):
     ingested_count = 0
     skipped_count = 0
+    touched_themes = {}
+    searchable = []  # same post-commit bookkeeping as pipeline.persist
 
     with get_session() as session:
+        existing = existing_url_hashes(session, [url_hash(entry["post_url"]) for entry in posts])
+
         for entry in posts:
-            exists = session.query(Thesis).filter(Thesis.post_url == entry["post_url"]).first()
-            if exists:
+            entry_hash = url_hash(entry["post_url"])
+            if entry_hash in existing:
                 skipped_count += 1
                 continue
+            existing.add(entry_hash)
 
             content = entry["thesis_text"]
-            thesis_sentences = extract_thesis(content)
+            thesis_sentences, sentence_embeddings, _ = extract_thesis_with_embeddings(content)
 
             theme_id_counts = {}
-            sentence_embeddings = []
 
-            for sentence in thesis_sentences:
-                embedding_vec = embed(sentence)
-                if embedding_vec is None:
-                    continue
-                sentence_embeddings.append(embedding_vec)
+            for embedding_vec in sentence_embeddings:
                 theme_id = find_matching_theme(embedding_vec)
                 theme_id_counts[theme_id] = theme_id_counts.get(theme_id, 0) + 1
 
-            if not sentence_embeddings:
+            if not len(sentence_embeddings):
                 avg_embedding = embed(content)
             else:
                 avg_embedding = np.mean(sentence_embeddings, axis=0).tolist()
@@ -60,18 +64,33 @@ def parse_mock_posts(posts=mock_posts):
             theme_id = max(theme_id_counts.items(), key=lambda x: x[1])[0]
 
             published = datetime(*entry["published_parsed"][:6])
+            signature = minhash(content)
 
-            thesis_record = Thesis(
+            thesis_id = session.execute(insert_ignore(Thesis, ["url_hash"]).values(
                 thesis_text="; ".join(thesis_sentences),
                 post_title=entry["post_title"],
                 post_url=entry["post_url"],
+                url_hash=entry_hash,
                 published_at=published,
+                ingested_at=datetime.utcnow(),
                 embedding=avg_embedding,
                 theme_id=theme_id,
-            )
-            session.add(thesis_record)
+                minhash=pack_signature(signature) if signature is not None else None,
+            ).returning(Thesis.id)).scalar()
+            if thesis_id is None:
+                skipped_count += 1
+                continue
+
+            if signature is not None:
+                session.execute(insert(MinhashBand), [{"key": key, "thesis_id": thesis_id} for key in band_keys(signature)])
+            theme = add_theme_member(session, theme_id, avg_embedding, published)
+            touched_themes[theme.id] = theme.centroid_sum
+            searchable.append((thesis_id, avg_embedding, theme_id, published))
             ingested_count += 1
 
         session.commit()
 
+    update_theme_index(touched_themes)
+    add_theses(searchable)
+
     return {"ingested": ingested_count, "skipped": skipped_count, "total": len(posts)}
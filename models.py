@@ -1,27 +1,117 @@
 """
-This file defines the thesis model, which is the structure of each saved record in the database.
+This file defines the thesis and theme models, which are the structure of the saved records in the database.
 
 each thesis contains:
 - the actual thesis text
-- the title and URL of the post it came from
+- the title and URL of the post it came from (plus a hash of the normalized URL, unique, see urls.py)
 - when it was published and when it was ingested
-- the embedding vector
+- the embedding vector (stored as a packed binary blob, see vectors.py)
 - a theme_id to group similar theses together
+- a minhash signature of the post body, used to spot near-duplicate copies (see neardup.py)
+  (theme_id and published_at are indexed; db.migrate() adds the (theme, date, id) index the
+  paginated theme timeline reads from)
+
+minhash bands index those signatures (one row per band per thesis), and post aliases link the url
+of a near-duplicate copy to the url hash of the thesis it duplicates.
+
+each theme contains:
+- a running centroid, kept as the sum of its members' embeddings plus the member count
+  (the centroid itself is centroid_sum / member_count, so adding a member is O(dim))
+- when its first and last member was seen
+
+theme aliases point the id of a theme that re-clustering (recluster.py) merged away or replaced at
+the theme that took over most of its members, so old theme links keep working.
+
+each feed contains the fetch state used to skip work on the next poll:
+- the ETag / Last-Modified validators sent back as conditional GET headers (a 304 skips everything)
+- when it was last fetched and with what status
+- the entry ids seen in the last fetched copy, so unchanged entries are dropped before any db or model work
+- its polling schedule (see poller.py): the learned poll interval, when it is due next, and how many
+  polls in a row have failed
+
+each job is one queued ingest (see jobs.py):
+- the feed urls to ingest and its status (queued -> running -> done / failed)
+- progress counts, updated as feeds finish (entries fetched, skipped, ingested)
+- when it was created, started and finished, plus the error message if it failed
 
 """
 
 from sqlmodel import SQLModel, Field, Column, JSON
 from datetime import datetime
 from typing import Optional, List
+from vectors import EmbeddingBlob
+import config
 
 class Thesis(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    theme_id: Optional[str] = None
+    theme_id: Optional[str] = Field(default=None, index=True)
     thesis_text: str
     post_title: str
     post_url: str
-    published_at: Optional[datetime] = None
+    url_hash: Optional[str] = Field(default=None, unique=True, index=True)
+    published_at: Optional[datetime] = Field(default=None, index=True)
     ingested_at: datetime = Field(default_factory=datetime.utcnow)
+    minhash: Optional[bytes] = None  # packed uint32 signature
+
+    # add this to store vector embeddings (float32 by default, float16/int8 via EMBEDDING_STORAGE)
+    embedding: Optional[List[float]] = Field(default=None, sa_column=Column(EmbeddingBlob(config.EMBEDDING_STORAGE)))
+
+
+class MinhashBand(SQLModel, table=True):
+    key: int = Field(primary_key=True)  # hash of the band number and its values
+    thesis_id: int = Field(primary_key=True)
+
+
+class PostAlias(SQLModel, table=True):
+    url_hash: str = Field(primary_key=True)
+    canonical_url_hash: str = Field(index=True)
+    post_url: str
+    seen_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Theme(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    # always float32: the sum keeps growing, so quantizing it would drift
+    centroid_sum: Optional[List[float]] = Field(default=None, sa_column=Column(EmbeddingBlob("float32")))
+    member_count: int = 0
+    first_seen_at: Optional[datetime] = None
+    last_seen_at: Optional[datetime] = None
+    # when the row was last written (last_seen_at is a publish date), see cluster.refresh_theme_index
+    updated_at: Optional[datetime] = Field(default=None, index=True)
+    # bumped for every row each time the table is rebuilt (recluster.py); see db.theme_generation
+    generation: int = Field(default=0, index=True)
+
+
+class ThemeAlias(SQLModel, table=True):
+    old_theme_id: str = Field(primary_key=True)
+    theme_id: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Feed(SQLModel, table=True):
+    url: str = Field(primary_key=True)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    last_fetched_at: Optional[datetime] = None
+    last_status: Optional[int] = None
+    last_entry_ids: Optional[List[str]] = Field(default=None, sa_column=Column(JSON))
+    poll_interval: Optional[int] = None  # seconds, None = not polled yet
+    next_poll_at: Optional[datetime] = Field(default=None, index=True)  # None = due now
+    error_count: int = 0
+
 
-    # add this to store vector embeddings
-    embedding: Optional[List[float]] = Field(default=None, sa_column=Column(JSON))
+class Job(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    feed_urls: List[str] = Field(sa_column=Column(JSON, nullable=False))
+    status: str = Field(default="queued", index=True)
+    feeds_done: int = 0
+    fetched: int = 0
+    skipped: int = 0
+    ingested: int = 0
+    not_modified: bool = False
+    error: Optional[str] = None
+    worker: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None  # heartbeat of the worker running it (jobs.py)
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,126 @@
+'''
+near-duplicate post detection, before any model work
+
+- every cleaned post body gets a minhash signature: for each of 64 hash functions, the smallest
+  hash over the body's 2-word shingles. the share of equal positions in two signatures estimates
+  the jaccard similarity of the two bodies
+- copies of one article (syndicated, amp pages, mirror domains, tracking variants, an added byline)
+  stay well above NEAR_DUPLICATE_SIMILARITY even for short rss summaries; unrelated posts, even on
+  the same topic, stay far below
+- posts at least that similar to a stored or recently seen post are not embedded; the pipeline links their
+  url to the original instead (models.PostAlias), and alias urls count as already ingested from
+  then on
+- lookups use lsh banding: the signature is cut into 16 bands of 4 values, and only posts sharing
+  a whole band are compared (a 0.8-similar copy shares one with >99% probability). stored posts
+  keep their band keys in models.MinhashBand (one indexed lookup per post), and posts of the
+  current run that aren't committed yet are matched in memory (RecentSignatures)
+- bodies shorter than MIN_WORDS words are too short to tell apart reliably and are never matched
+
+'''
+
+from collections import OrderedDict
+from typing import Optional
+from sqlmodel import select
+from models import Thesis, MinhashBand
+import numpy as np
+import hashlib
+import re
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+MIN_WORDS = 20
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+# fixed hash functions h(x) = (a * x + b) mod p, the same in every process
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64)
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    '''
+    uint32 minhash signature of the text, or None if the text is too short.
+    '''
+    words = _WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+
+    shingles = {f"{first} {second}" for first, second in zip(words, words[1:])}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+         for shingle in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    # a < 2^31 and x < 2^32, so a * x + b fits in 64 bits
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+def band_keys(signature: np.ndarray) -> list[int]:
+    '''
+    one signed 64-bit key per band (sqlite integers are signed).
+    '''
+    data = signature.astype("<u4").tobytes()
+    width = ROWS * 4
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + data[band * width:(band + 1) * width], digest_size=8).digest(),
+                       "little", signed=True)
+        for band in range(BANDS)
+    ]
+
+def pack_signature(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+def unpack_signature(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<u4")
+
+def find_stored(session, signature: np.ndarray, min_similarity: float) -> Optional[str]:
+    '''
+    url hash of the most similar stored post at or above min_similarity, if any.
+    '''
+    candidates = session.exec(
+        select(Thesis.url_hash, Thesis.minhash)
+        .join(MinhashBand, MinhashBand.thesis_id == Thesis.id)
+        .where(MinhashBand.key.in_(band_keys(signature)))
+        .distinct()
+    )
+    best, best_score = None, min_similarity
+    for url_hash, stored in candidates:
+        score = similarity(signature, unpack_signature(stored))
+        if url_hash and score >= best_score:
+            best, best_score = url_hash, score
+    return best
+
+class RecentSignatures:
+    '''
+    in-memory lsh index of the last max_entries posts seen (not necessarily committed yet).
+    '''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._signatures = OrderedDict()  # url_hash -> (signature, band keys), oldest first
+        self._bands = {}  # band key -> set of url hashes
+
+    def find(self, signature: np.ndarray, min_similarity: float, keys: list[int] = None) -> Optional[str]:
+        best, best_score = None, min_similarity
+        for key in keys or band_keys(signature):
+            for url_hash in self._bands.get(key, ()):
+                score = similarity(signature, self._signatures[url_hash][0])
+                if score >= best_score:
+                    best, best_score = url_hash, score
+        return best
+
+    def add(self, signature: np.ndarray, url_hash: str, keys: list[int] = None):
+        keys = keys or band_keys(signature)
+        self._signatures[url_hash] = (signature, keys)
+        for key in keys:
+            self._bands.setdefault(key, set()).add(url_hash)
+
+        while len(self._signatures) > self.max_entries:
+            old_hash, (_, old_keys) = self._signatures.popitem(last=False)
+            for key in old_keys:
+                members = self._bands[key]
+                members.discard(old_hash)
+                if not members:
+                    del self._bands[key]
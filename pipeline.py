@@ -0,0 +1,476 @@
+'''
+streaming ingestion pipeline
+
+- ingestion is a chain of generator stages: fetch -> clean -> dedupe -> extract -> embed -> cluster -> persist
+- every stage runs in its own thread and hands each item to the next one as soon as it is ready,
+  through a bounded queue (PIPELINE_BUFFER items), so a fast stage can never run far ahead and
+  memory stays flat no matter how many feeds or entries go through
+- items are Post (one feed entry on its way to the db) and FeedEnd (sent after a feed's last post,
+  carrying the feed's fetch state). a stage that drops a post sets post.skip and passes it on, so
+  persist is the only place that counts
+- dedupe drops near-duplicate copies of stored or recent posts (see neardup.py); persist links
+  their urls to the original if it is stored or in the same chunk. a recent original can still be
+  dropped or lost with its chunk, and then the copy is processed and stored as a normal post
+- embed only submits a post's sentences to the shared batcher; cluster waits for the result. the
+  posts buffered between the two are what lets the batcher fill large batches across posts/feeds
+- persist commits every PIPELINE_COMMIT_SIZE new posts and at the end of every feed, writing each
+  chunk with bulk (multi-row / executemany) inserts; a feed's fetch state is committed with (or
+  after) its last post. after a crash, running the same urls again
+  resumes: committed posts are skipped by url hash before any model work, and finished feeds are
+  skipped by their conditional GET validators / seen entry ids
+- committed theses are appended to the semantic search index (search.py) if it is loaded
+- every stage times its work and counts what it drops into metrics.py (GET /metrics); per-post
+  details are only logged at debug level, so logging costs nothing in the hot loop
+- rss.parse_feed and rss.parse_feeds run this pipeline
+
+'''
+
+from typing import NamedTuple, Optional, Any
+from extractor import split_sentences, rank_sentences
+from batcher import get_batcher
+from fetcher import iter_feeds, FetchedFeed
+from db import get_session, insert_ignore, existing_url_hashes, resolve_theme_aliases
+from urls import url_hash
+from models import Thesis, MinhashBand, PostAlias
+from neardup import minhash, band_keys, pack_signature, find_stored, RecentSignatures
+from cluster import find_matching_theme, add_theme_member, update_theme_index
+from search import add_theses
+from rss import entry_key, load_feed_states, record_fetch
+from cleaner import clean_html
+from sqlalchemy import insert
+from sqlmodel import select
+from datetime import datetime
+import numpy as np
+import config
+import metrics
+import queue
+import threading
+import traceback
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class _Failed(NamedTuple):
+    error: BaseException
+
+class Post(NamedTuple):
+    feed_url: str
+    entry: Any
+    url_hash: str
+    content: str
+    sentences: Optional[list] = None
+    embeddings: Any = None  # a Future from the batcher, then the sentence embeddings
+    thesis: Optional[list] = None
+    embedding: Optional[list] = None
+    theme_id: Optional[str] = None
+    minhash: Any = None  # uint32 signature array
+    skip: Optional[str] = None  # why the post was dropped
+    duplicate_of: Optional[str] = None  # url hash of the stored post this one is a near-duplicate of
+
+class FeedEnd(NamedTuple):
+    url: str
+    status: Optional[int] = None
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+    entry_ids: Optional[list] = None
+    error: Optional[str] = None
+    total: int = 0  # entries in the feed
+    skipped: int = 0  # entries dropped by clean (unchanged, without a link, already stored or empty)
+
+def buffered(items, size: int):
+    '''
+    run a stage (any iterable) in its own thread and yield its output through a bounded queue.
+    an exception in the stage is re-raised here; leaving early stops the thread.
+    '''
+    out = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+
+    threading.Thread(target=produce, name="pipeline-stage", daemon=True).start()
+    try:
+        while True:
+            item = out.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+def fetch(urls: list[str]):
+    '''
+    download and parse the feeds concurrently (see fetcher.py), with their stored validators.
+    yields (FetchedFeed, ids of the entries seen in the previous fetch).
+    '''
+    with get_session() as session:
+        states = load_feed_states(session, urls)
+    validators = {url: (state.etag, state.last_modified) for url, state in states.items()}
+    seen = {url: set(state.last_entry_ids or []) for url, state in states.items()}
+
+    pending = set(urls)
+    for fetched in iter_feeds(urls, validators):
+        pending.discard(fetched.url)
+        yield fetched, seen.get(fetched.url, set())
+
+    # only if the fetcher stopped early
+    for url in pending:
+        yield FetchedFeed(url, None, "Feed was not fetched"), set()
+
+def clean(feeds, lookup_size: int = 500):
+    '''
+    drop unchanged, link-less, already stored and empty entries and strip html from the rest.
+    stored url hashes are looked up lookup_size entries at a time.
+    '''
+    for fetched, seen_ids in feeds:
+        entries = fetched.feed.entries if fetched.feed is not None else []
+        error = fetched.error
+        if not entries and not error and not fetched.not_modified:
+            logger.warning(f"No entries found in feed: {fetched.url}")
+            if fetched.feed.get("bozo"):
+                error = str(fetched.feed.get("bozo_exception"))
+
+        skipped = 0
+        in_feed = set()  # the same post listed twice in one feed
+        for start in range(0, len(entries), lookup_size):
+            candidates = []
+            for entry in entries[start:start + lookup_size]:
+                if entry_key(entry) in seen_ids:
+                    metrics.SKIPPED.inc(reason="unchanged")
+                    skipped += 1
+                elif not entry.get("link"):
+                    # title and link are optional in feeds; without a link there is nothing to store or dedupe by
+                    logger.debug(f"Skipping: No link in post '{entry.get('title', '')}'")
+                    metrics.SKIPPED.inc(reason="no link")
+                    skipped += 1
+                else:
+                    candidates.append((entry, url_hash(entry.link)))
+
+            with get_session() as session:
+                existing = existing_url_hashes(session, [entry_hash for _, entry_hash in candidates])
+
+            for entry, entry_hash in candidates:
+                if entry_hash in existing or entry_hash in in_feed:
+                    logger.debug(f"Skipping duplicate post: {entry.link}")
+                    metrics.SKIPPED.inc(reason="duplicate")
+                    skipped += 1
+                    continue
+                in_feed.add(entry_hash)
+
+                with metrics.STAGE_SECONDS.time(stage="clean"):
+                    content = entry.get("summary", "") or entry.get("content", [{}])[0].get("value", "")
+                    content = clean_html(content)
+                if not content:
+                    logger.debug(f"Skipping: No content in post '{entry.get('title', '')}'")
+                    metrics.SKIPPED.inc(reason="no content")
+                    skipped += 1
+                    continue
+
+                yield Post(fetched.url, entry, entry_hash, content)
+
+        yield FeedEnd(
+            fetched.url, fetched.status, fetched.etag, fetched.modified,
+            [entry_key(entry) for entry in entries] if entries else None,
+            error, len(entries), skipped,
+        )
+
+def dedupe(items):
+    '''
+    drop near-duplicates of stored or recently seen posts (see neardup.py), so they never reach the model.
+    '''
+    recent = RecentSignatures(config.NEAR_DUPLICATE_RECENT)
+
+    for item in items:
+        if isinstance(item, Post) and item.skip is None and config.NEAR_DUPLICATE_SIMILARITY:
+            with metrics.STAGE_SECONDS.time(stage="dedupe"):
+                signature = minhash(item.content)
+                duplicate_of = None
+                if signature is not None:
+                    keys = band_keys(signature)
+                    duplicate_of = recent.find(signature, config.NEAR_DUPLICATE_SIMILARITY, keys)
+                    if duplicate_of is None:
+                        with get_session() as session:
+                            duplicate_of = find_stored(session, signature, config.NEAR_DUPLICATE_SIMILARITY)
+
+            if signature is not None:
+                if duplicate_of is not None and duplicate_of != item.url_hash:
+                    logger.debug(f"Skipping near-duplicate post: {item.entry.link}")
+                    item = item._replace(skip="near duplicate", duplicate_of=duplicate_of)
+                else:
+                    recent.add(signature, item.url_hash, keys)
+                    item = item._replace(minhash=signature)
+        yield item
+
+def extract(items):
+    '''
+    split each post into sentences.
+    '''
+    for item in items:
+        if isinstance(item, Post) and item.skip is None:
+            with metrics.STAGE_SECONDS.time(stage="tokenize"):
+                sentences = split_sentences(item.content)
+            item = item._replace(sentences=sentences) if sentences else item._replace(skip="no sentences")
+        yield item
+
+def embed(items):
+    '''
+    queue each post's sentences with the shared batcher, without waiting for the result.
+    '''
+    batcher = get_batcher()
+    for item in items:
+        if isinstance(item, Post) and item.skip is None:
+            item = item._replace(embeddings=batcher.submit(item.sentences))
+        yield item
+
+def cluster(items):
+    '''
+    pick each post's thesis sentences and match them to a theme.
+    '''
+    for item in items:
+        if not isinstance(item, Post) or item.skip is not None:
+            yield item
+            continue
+
+        # the embeddings used for ranking are reused for clustering, so no extra forward passes
+        embeddings = item.embeddings.result()  # waiting for the batcher is timed as "embed"
+        with metrics.STAGE_SECONDS.time(stage="extract"):
+            thesis_sentences, sentence_embeddings, _ = rank_sentences(item.sentences, embeddings)
+        if not thesis_sentences:
+            logger.debug(f"Skipping: No thesis sentences extracted for post '{item.entry.get('title', '')}'")
+            yield item._replace(embeddings=None, skip="no thesis")
+            continue
+
+        with metrics.STAGE_SECONDS.time(stage="match"):
+            for embedding_vec in sentence_embeddings:
+                theme_id = find_matching_theme(embedding_vec)
+        logger.debug(f"Extracted theses {thesis_sentences} with theme_id: {theme_id}")
+
+        avg_embedding = np.mean(sentence_embeddings, axis=0).tolist()
+        yield item._replace(embeddings=None, thesis=thesis_sentences, embedding=avg_embedding, theme_id=theme_id)
+
+def process_copy(item: Post) -> Post:
+    '''
+    run a near-duplicate copy through extract -> embed -> cluster after all, for when its original never got stored.
+    '''
+    item = item._replace(skip=None, duplicate_of=None, minhash=minhash(item.content))
+    return next(cluster(embed(extract([item]))))
+
+def persist(items, commit_size: int):
+    '''
+    insert posts and record fetch state, committing in chunks.
+    yields (feed url, counts) for each feed once everything of it is committed.
+    '''
+    feeds = {}  # url -> committed counts of feeds still streaming
+    chunk = {}  # url -> [ingested, skipped] in the uncommitted chunk
+    ended = []  # feeds whose FeedEnd is in the uncommitted chunk
+    posts = []  # (post, published) to insert with the chunk
+    aliases = []  # PostAlias rows to insert with the chunk
+    touched_themes = {}
+    searchable = []  # (thesis id, embedding, theme id, date) of the chunk's new theses
+
+    def counts_for(url: str) -> dict:
+        if url not in feeds:
+            feeds[url] = {"ingested": 0, "skipped": 0, "total": 0}
+        return feeds[url]
+
+    with get_session() as session:
+        def is_stored(entry_hash: str) -> bool:
+            '''
+            whether the post with this url hash is in the db or in the uncommitted chunk.
+            '''
+            if any(post.url_hash == entry_hash for post, _ in posts):
+                return True
+            return session.exec(select(Thesis.id).where(Thesis.url_hash == entry_hash)).first() is not None
+
+        def write():
+            '''
+            bulk-insert the chunk (aliases, posts, minhash bands) and add the new posts to their themes.
+            '''
+            if aliases:
+                session.execute(insert_ignore(PostAlias, ["url_hash"]), aliases)
+            if not posts:
+                return
+
+            # a theme matched before a re-clustering took it over (the index reloads within
+            # THEME_INDEX_REFRESH s): save under the new theme instead of bringing the old id back
+            moved = resolve_theme_aliases(session, [item.theme_id for item, _ in posts])
+            if moved:
+                posts[:] = [(item._replace(theme_id=moved.get(item.theme_id, item.theme_id)), published)
+                            for item, published in posts]
+
+            # one multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING for the whole chunk. a post that
+            # another ingest saved since clean checked is not inserted, and so not returned
+            now = datetime.utcnow()
+            inserted = dict(session.execute(
+                insert_ignore(Thesis, ["url_hash"]).returning(Thesis.url_hash, Thesis.id),
+                [{
+                    "thesis_text": "; ".join(item.thesis),
+                    "post_title": item.entry.get("title", ""),
+                    "post_url": item.entry.link,  # clean() drops entries without one
+                    "url_hash": item.url_hash,
+                    "published_at": published,
+                    "ingested_at": now,
+                    "embedding": item.embedding,
+                    "theme_id": item.theme_id,
+                    "minhash": pack_signature(item.minhash) if item.minhash is not None else None,
+                } for item, published in posts],
+            ).all())
+
+            bands = []
+            for item, published in posts:
+                tally = chunk.setdefault(item.feed_url, [0, 0])
+                thesis_id = inserted.pop(item.url_hash, None)  # pop: a post listed twice is only new once
+                if thesis_id is None:
+                    logger.debug(f"Skipping duplicate post: {item.entry.link}")
+                    metrics.SKIPPED.inc(reason="duplicate")
+                    tally[1] += 1
+                    continue
+
+                if item.minhash is not None:
+                    bands.extend({"key": key, "thesis_id": thesis_id} for key in band_keys(item.minhash))
+                theme = add_theme_member(session, item.theme_id, item.embedding, published)
+                touched_themes[theme.id] = theme.centroid_sum
+                searchable.append((thesis_id, item.embedding, item.theme_id, published or now))
+                tally[0] += 1
+            if bands:
+                session.execute(insert(MinhashBand), bands)
+
+        def commit():
+            try:
+                with metrics.STAGE_SECONDS.time(stage="commit"):
+                    write()
+                    session.commit()
+            except Exception as e:
+                # the chunk is lost; its feeds get no fetch state, so they are fetched in full again next time
+                session.rollback()
+                metrics.ERRORS.inc(kind="commit")
+                logger.error(f"Commit of {len(posts)} posts failed: {e}")
+                logger.error(traceback.format_exc())
+                for url in set(chunk) | {item.feed_url for item, _ in posts} | {end.url for end in ended}:
+                    counts_for(url)["error"] = str(e)
+            else:
+                # only index centroids and theses that actually made it into the db
+                update_theme_index(touched_themes)
+                add_theses(searchable)
+                for url, (ingested, skipped) in chunk.items():
+                    counts_for(url)["ingested"] += ingested
+                    counts_for(url)["skipped"] += skipped
+                    metrics.INGESTED.inc(ingested)
+
+            finished = []
+            for end in ended:
+                counts = feeds.pop(end.url, None) or {"ingested": 0, "skipped": 0, "total": 0}
+                if "error" in counts:
+                    metrics.FEEDS.inc(result="error")
+                else:
+                    metrics.FEEDS.inc(result="not_modified" if counts.get("not_modified") else "ok")
+                logger.info(f"Ingested feed {end.url}: {counts['ingested']} new, {counts['skipped']} skipped")
+                finished.append((end.url, counts))
+            chunk.clear()
+            ended.clear()
+            posts.clear()
+            aliases.clear()
+            touched_themes.clear()
+            searchable.clear()
+            return finished
+
+        for item in items:
+            if isinstance(item, FeedEnd):
+                counts = counts_for(item.url)
+                counts["total"] += item.total
+                counts["skipped"] += item.skipped
+                metrics.ENTRIES.inc(item.total)
+                if item.error:
+                    metrics.ERRORS.inc(kind="feed")
+                    counts["error"] = item.error
+                if "error" in counts:
+                    pass  # no fetch state, so the feed is fetched (and its posts retried) in full next time
+                elif item.status == 304:
+                    counts["not_modified"] = True
+                    record_fetch(session, item.url, item.status)
+                else:
+                    record_fetch(session, item.url, item.status, item.etag, item.modified, item.entry_ids)
+                ended.append(item)
+                yield from commit()
+                continue
+
+            if item.skip is not None and item.duplicate_of and not is_stored(item.duplicate_of):
+                # the original (a recent post of this run) was dropped or its chunk rolled back; an
+                # alias to it would mark the copy as ingested forever, so the copy takes its place
+                logger.debug(f"Original of near-duplicate post {item.entry.link} was not stored, ingesting the copy")
+                item = process_copy(item)
+
+            if item.skip is not None:
+                metrics.SKIPPED.inc(reason=item.skip)
+                if item.duplicate_of:
+                    # from now on the copy's url counts as ingested
+                    aliases.append({
+                        "url_hash": item.url_hash,
+                        "canonical_url_hash": item.duplicate_of,
+                        "post_url": item.entry.link,
+                        "seen_at": datetime.utcnow(),
+                    })
+                chunk.setdefault(item.feed_url, [0, 0])[1] += 1
+                continue
+
+            published = None
+            if item.entry.get("published_parsed"):
+                published = datetime(*item.entry.published_parsed[:6])
+            posts.append((item, published))
+            if len(posts) >= commit_size:
+                yield from commit()
+
+def run_stages(source, *stages, buffer: int):
+    '''
+    chain stages (each takes an iterable and yields items), every one in its own buffered thread.
+    '''
+    items = buffered(source, buffer)
+    for stage in stages:
+        items = buffered(stage(items), buffer)
+    return items
+
+def ingest(urls: list[str], on_feed=None) -> dict:
+    '''
+    run the whole pipeline over the given feeds. on_feed(url, counts) is called as each feed is
+    committed. returns per-feed counts plus totals.
+    '''
+    urls = list(dict.fromkeys(urls))
+    posts = run_stages(fetch(urls), clean, dedupe, extract, embed, cluster, buffer=config.PIPELINE_BUFFER)
+
+    feeds = {}
+    for url, counts in persist(posts, config.PIPELINE_COMMIT_SIZE):
+        feeds[url] = counts
+        if on_feed:
+            on_feed(url, counts)
+
+    return {
+        "feeds": feeds,
+        "ingested": sum(c["ingested"] for c in feeds.values()),
+        "skipped": sum(c["skipped"] for c in feeds.values()),
+        "total": sum(c["total"] for c in feeds.values()),
+        "not_modified": sum(1 for c in feeds.values() if c.get("not_modified")),
+        "failed": sum(1 for c in feeds.values() if "error" in c),
+    }
@@ -0,0 +1,168 @@
+'''
+keeps every registered feed fresh
+
+- a feed is registered once it has a row in the feed table (every ingested feed gets one, and
+  run_poller.py can add more)
+- each feed has its own poll interval, learned from how often it actually publishes:
+    - new posts since the last poll: move the interval toward "one new post per poll"
+    - nothing new (or a 304): stretch the interval by 1.5x
+    - always kept between POLL_MIN_INTERVAL and POLL_MAX_INTERVAL
+- failed polls back off exponentially (interval * 2^errors, capped) without forgetting the learned
+  interval, and every next poll time gets +-POLL_JITTER of random spread so feeds don't bunch up
+- due feeds (next_poll_at in the past) go through the normal rss.parse_feed pipeline, at most
+  POLL_CONCURRENCY at a time; their sentences share the embedding batcher
+- a poll that crashes before it could store the next poll time (a bug, the db being down) is
+  logged and the feed is left alone for POLL_MIN_INTERVAL, instead of being polled again at once
+- run a single poller per database
+
+'''
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlmodel import select
+from models import Feed
+from db import get_session
+from rss import parse_feed
+from datetime import datetime, timedelta
+from typing import Optional
+import config
+import functools
+import random
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_IDLE_SLEEP = 30  # seconds; also how quickly newly registered feeds are noticed
+
+def register_feeds(urls: list[str]) -> int:
+    '''
+    add feeds to the poller (due immediately). returns how many were new.
+    '''
+    added = 0
+    with get_session() as session:
+        for url in dict.fromkeys(urls):
+            if session.get(Feed, url) is None:
+                session.add(Feed(url=url))
+                added += 1
+        session.commit()
+    return added
+
+def next_interval(previous: Optional[int], elapsed: Optional[float], new_posts: int) -> int:
+    '''
+    the feed's new poll interval (seconds) after a successful poll.
+    elapsed is the time since the previous poll (None on the first one).
+    '''
+    interval = previous or config.POLL_DEFAULT_INTERVAL
+    if new_posts and elapsed:
+        # observed rate says one post every elapsed / new_posts seconds; smooth toward it
+        interval = (interval + elapsed / new_posts) / 2
+    elif not new_posts:
+        interval *= 1.5
+    return int(min(max(interval, config.POLL_MIN_INTERVAL), config.POLL_MAX_INTERVAL))
+
+def jittered(seconds: float) -> timedelta:
+    return timedelta(seconds=seconds * random.uniform(1 - config.POLL_JITTER, 1 + config.POLL_JITTER))
+
+def schedule(url: str, previous_fetch: Optional[datetime], result: Optional[dict], error: Optional[str] = None):
+    '''
+    store the feed's next poll time after a poll (result is parse_feed's counts).
+    '''
+    now = datetime.utcnow()
+    with get_session() as session:
+        feed_state = session.get(Feed, url) or Feed(url=url)
+
+        if error is not None or result.get("error"):
+            feed_state.error_count += 1
+            interval = feed_state.poll_interval or config.POLL_DEFAULT_INTERVAL
+            delay = min(interval * 2 ** feed_state.error_count, config.POLL_MAX_INTERVAL)
+            logger.warning(f"Poll of {url} failed ({feed_state.error_count} in a row), retrying in {delay / 60:.0f} min")
+        else:
+            elapsed = (now - previous_fetch).total_seconds() if previous_fetch else None
+            feed_state.error_count = 0
+            feed_state.poll_interval = next_interval(feed_state.poll_interval, elapsed, result["ingested"])
+            delay = feed_state.poll_interval
+
+        feed_state.next_poll_at = now + jittered(delay)
+        session.add(feed_state)
+        session.commit()
+
+def poll_feed(url: str, previous_fetch: Optional[datetime]):
+    try:
+        result = parse_feed(url)
+    except Exception as e:
+        schedule(url, previous_fetch, None, str(e))
+        return
+    schedule(url, previous_fetch, result)
+
+def log_failed_poll(url: str, future):
+    # poll_feed reschedules the feed even when the ingest fails, so this only sees bugs and db errors
+    if future.exception() is not None:
+        logger.error(f"Polling {url} crashed: {future.exception()!r}")
+
+def due_feeds(exclude: set, limit: int) -> list:
+    '''
+    (url, last_fetched_at) of feeds whose poll time has come, most overdue first.
+    '''
+    query = select(Feed.url, Feed.last_fetched_at).where(
+        (Feed.next_poll_at == None) | (Feed.next_poll_at <= datetime.utcnow())
+    )
+    if exclude:
+        query = query.where(Feed.url.not_in(exclude))
+    with get_session() as session:
+        return session.exec(query.order_by(Feed.next_poll_at).limit(limit)).all()
+
+def seconds_until_next_poll(exclude: set) -> float:
+    '''
+    how long until the next feed (not already being polled) is due, capped at MAX_IDLE_SLEEP.
+    '''
+    query = select(Feed.next_poll_at)
+    if exclude:
+        query = query.where(Feed.url.not_in(exclude))
+    with get_session() as session:
+        next_poll_at = session.exec(query.order_by(Feed.next_poll_at).limit(1)).first()
+    if next_poll_at is None:
+        return MAX_IDLE_SLEEP
+    return min(max((next_poll_at - datetime.utcnow()).total_seconds(), 1), MAX_IDLE_SLEEP)
+
+def run(stop: threading.Event = None):
+    '''
+    poll due feeds forever (or until stop is set), keeping up to POLL_CONCURRENCY in flight.
+    '''
+    stop = stop or threading.Event()
+    in_flight = {}  # future -> url
+    crashed = {}  # url -> time.monotonic() until which it isn't polled again
+
+    with ThreadPoolExecutor(config.POLL_CONCURRENCY, thread_name_prefix="poller") as pool:
+        while not stop.is_set():
+            now = time.monotonic()
+            crashed = {url: until for url, until in crashed.items() if until > now}
+            busy = set(in_flight.values()) | set(crashed)
+
+            free = config.POLL_CONCURRENCY - len(in_flight)
+            if free:
+                for url, last_fetched_at in due_feeds(busy, free):
+                    logger.info(f"Polling {url}")
+                    future = pool.submit(poll_feed, url, last_fetched_at)
+                    future.add_done_callback(functools.partial(log_failed_poll, url))
+                    in_flight[future] = url
+                    busy.add(url)
+
+            # sleep until a poll finishes or (with a free slot) the next feed is due
+            if len(in_flight) == config.POLL_CONCURRENCY:
+                timeout = None
+            else:
+                timeout = seconds_until_next_poll(busy)
+                if crashed:
+                    timeout = min(timeout, max(min(crashed.values()) - time.monotonic(), 1))
+            if in_flight:
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    if future.exception() is not None:
+                        crashed[url] = time.monotonic() + config.POLL_MIN_INTERVAL
+            else:
+                stop.wait(timeout)
+
+        wait(in_flight)
@@ -0,0 +1,409 @@
+'''
+offline re-clustering of every thesis into themes
+
+online matching (cluster.find_matching_theme) is greedy: each post joins the closest theme as it
+arrives, so early posts pin themes down for good and near-identical (often single-post) themes
+pile up. this job redoes the grouping over the whole corpus, with the same cosine threshold:
+
+- merge: theme centroids are taken biggest first, and each one within the threshold of an earlier
+  (bigger) one joins it, so near-identical themes collapse into one
+- assign: every thesis goes to the closest merged centroid if it is within the threshold; theses
+  close to none split off into new themes. centroids are then recomputed from their members (a
+  spherical k-means step) and merged again, RECLUSTER_ITERATIONS times in all
+- memory stays bounded: theses are streamed from the db RECLUSTER_BLOCK_ROWS at a time (keyset on
+  id) and scored against the centroids block by block, one matrix product each; only the
+  centroids and a few integers per thesis are kept
+- ids: a new theme keeps the id of the old theme most of its members came from (unless a bigger
+  new theme claimed it first), so most theme links stay valid. old ids that disappear get a
+  ThemeAlias to the theme that took most of their members (GET /themes/{id} redirects there)
+- write: one transaction rewrites theme_id for the theses that moved (executemany), rebuilds the
+  theme table (centroid sums, counts, first / last seen) and updates the aliases. theses ingested
+  while the job ran follow their old theme
+- fewer, denser themes also make online matching cheaper (one centroid per theme)
+- every rebuilt theme row gets a new updated_at and the next generation (db.theme_generation), so
+  processes that already loaded the centroid or search index notice the rebuild within
+  THEME_INDEX_REFRESH seconds and reload them; posts they matched to an old id in the meantime
+  are saved under the theme that took it over (pipeline.persist). run_recluster.py is the command
+  line entry point
+
+'''
+
+from sqlmodel import select, func
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Thesis, Theme, ThemeAlias
+from db import get_session, theme_generation
+from index import normalize
+from typing import NamedTuple
+from datetime import datetime
+import numpy as np
+import config
+import time
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CENTROID_BLOCK_ROWS = 8192  # centroids scored per matrix product
+WRITE_CHUNK_ROWS = 10000  # rows per executemany
+
+class Themes(NamedTuple):
+    sums: np.ndarray  # (themes, dim) float64 sums of member embeddings
+    counts: np.ndarray  # members per theme
+    first_seen: np.ndarray  # datetime64[s] as int64
+    last_seen: np.ndarray
+
+class Assignment(NamedTuple):
+    thesis_ids: np.ndarray  # every thesis id, in id order
+    labels: np.ndarray  # new theme (row of themes) per thesis
+    old_codes: np.ndarray  # old theme (index into old_theme_ids) per thesis, -1 = none
+    old_theme_ids: list[str]
+    themes: Themes
+
+class _Rows:
+    '''
+    append-only matrix with amortized growth.
+    '''
+    def __init__(self, dim: int):
+        self._data = np.empty((1024, dim), dtype=np.float32)
+        self.size = 0
+
+    def extend(self, rows: np.ndarray):
+        if self.size + len(rows) > len(self._data):
+            grown = np.empty((max(2 * len(self._data), self.size + len(rows)), self._data.shape[1]), dtype=np.float32)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self._data[:self.size]
+
+def best_match(unit_rows: np.ndarray, centroids: np.ndarray):
+    '''
+    (index, cosine) of the closest centroid for every row, scored CENTROID_BLOCK_ROWS centroids at a time.
+    rows without any centroid get -1 / -inf.
+    '''
+    best = np.full(len(unit_rows), -1, dtype=np.int64)
+    score = np.full(len(unit_rows), -np.inf, dtype=np.float32)
+    for start in range(0, len(centroids), CENTROID_BLOCK_ROWS):
+        sims = unit_rows @ centroids[start:start + CENTROID_BLOCK_ROWS].T
+        block_best = sims.argmax(axis=1)
+        block_score = sims[np.arange(len(unit_rows)), block_best]
+        better = block_score > score
+        best[better] = block_best[better] + start
+        score[better] = block_score[better]
+    return best, score
+
+def _lead(unit_rows: np.ndarray, threshold: float):
+    '''
+    greedy leader clustering within one block: each row joins the closest earlier leader within the
+    threshold, or leads a new group. returns (group per row, row index of every leader).
+    '''
+    groups = np.empty(len(unit_rows), dtype=np.int64)
+    leaders = []
+    for i, row in enumerate(unit_rows):
+        if leaders:
+            sims = unit_rows[leaders] @ row
+            best = int(sims.argmax())
+            if sims[best] >= threshold:
+                groups[i] = best
+                continue
+        groups[i] = len(leaders)
+        leaders.append(i)
+    return groups, leaders
+
+def leader_labels(unit_blocks, seeds: np.ndarray, threshold: float):
+    '''
+    for every block of unit vectors, yield each row's label: the closest seed or earlier leader
+    within the threshold, else a new leader. labels past len(seeds) are the leaders, in order.
+    '''
+    leaders = None
+    for unit in unit_blocks:
+        if leaders is None:
+            leaders = _Rows(unit.shape[1])
+        best, score = best_match(unit, seeds)
+        leader_best, leader_score = best_match(unit, leaders.rows)
+        closer = leader_score > score
+        best[closer] = leader_best[closer] + len(seeds)
+        score[closer] = leader_score[closer]
+
+        outliers = np.flatnonzero(score < threshold)
+        if len(outliers):
+            groups, first_rows = _lead(unit[outliers], threshold)
+            best[outliers] = len(seeds) + leaders.size + groups
+            leaders.extend(unit[outliers][first_rows])
+        yield best
+
+def group_themes(labels: np.ndarray, sums: np.ndarray, counts: np.ndarray,
+                 first_seen: np.ndarray, last_seen: np.ndarray) -> Themes:
+    '''
+    add up rows (embedding sums, counts, seen ranges) by label; labels must be 0..n-1 with none unused.
+    '''
+    order = np.argsort(labels, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(labels[order]) != 0])
+    return Themes(
+        np.add.reduceat(sums[order], starts, axis=0),
+        np.add.reduceat(counts[order], starts),
+        np.minimum.reduceat(first_seen[order], starts),
+        np.maximum.reduceat(last_seen[order], starts),
+    )
+
+def merge(themes: Themes, threshold: float, block_rows: int) -> Themes:
+    '''
+    fold every theme into the biggest earlier theme within the threshold of its centroid.
+    '''
+    if not len(themes.counts):
+        return themes
+    order = np.argsort(-themes.counts, kind="stable")
+    themes = Themes(*(values[order] for values in themes))
+    unit = normalize(themes.sums)
+    blocks = (unit[start:start + block_rows] for start in range(0, len(unit), block_rows))
+    labels = np.concatenate(list(leader_labels(blocks, unit[:0], threshold)))
+    return group_themes(labels, *themes)
+
+def iter_theses(session, max_id: int, block_rows: int, after_id: int = 0):
+    '''
+    (ids, embeddings, theme ids, seen at) of the theses with an embedding, block_rows at a time.
+    '''
+    while True:
+        query = select(Thesis.id, Thesis.embedding, Thesis.theme_id, Thesis.published_at, Thesis.ingested_at)
+        query = query.where(Thesis.id > after_id, Thesis.embedding != None)
+        if max_id is not None:
+            query = query.where(Thesis.id <= max_id)
+        rows = session.exec(query.order_by(Thesis.id).limit(block_rows)).all()
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        yield (
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.stack([np.asarray(row[1], dtype=np.float32) for row in rows]),
+            [row[2] for row in rows],
+            np.array([row[3] or row[4] or datetime.utcnow() for row in rows], dtype="datetime64[s]").astype(np.int64),
+        )
+
+def assign(session, max_id: int, seeds: np.ndarray, old_codes: dict, threshold: float, block_rows: int) -> Assignment:
+    '''
+    one pass over every thesis: join the closest seed centroid within the threshold or start a new theme.
+    '''
+    ids, labels, codes = [], [], []
+    current = {}  # the block being labelled
+
+    def blocks():
+        for block_ids, embeddings, theme_ids, seen_at in iter_theses(session, max_id, block_rows):
+            ids.append(block_ids)
+            codes.append(np.array([old_codes.get(theme_id, -1) for theme_id in theme_ids], dtype=np.int32))
+            current.update(embeddings=embeddings, seen_at=seen_at)
+            yield normalize(embeddings)
+
+    sums = counts = first_seen = last_seen = None
+    for block_labels in leader_labels(blocks(), seeds, threshold):
+        labels.append(block_labels)
+        # fold the block into the running per-theme totals right away, so embeddings aren't kept
+        size = int(block_labels.max()) + 1
+        if sums is None:
+            sums = np.zeros((size, current["embeddings"].shape[1]))
+            counts = np.zeros(size, dtype=np.int64)
+            first_seen = np.full(size, np.iinfo(np.int64).max)
+            last_seen = np.full(size, np.iinfo(np.int64).min)
+        elif size > len(sums):
+            grow = size - len(sums)
+            sums = np.vstack([sums, np.zeros((grow, sums.shape[1]))])
+            counts = np.r_[counts, np.zeros(grow, dtype=np.int64)]
+            first_seen = np.r_[first_seen, np.full(grow, np.iinfo(np.int64).max)]
+            last_seen = np.r_[last_seen, np.full(grow, np.iinfo(np.int64).min)]
+        np.add.at(sums, block_labels, current["embeddings"])
+        np.add.at(counts, block_labels, 1)
+        np.minimum.at(first_seen, block_labels, current["seen_at"])
+        np.maximum.at(last_seen, block_labels, current["seen_at"])
+
+    if sums is None:
+        empty = np.empty(0, dtype=np.int64)
+        return Assignment(empty, empty, empty.astype(np.int32), [], Themes(np.empty((0, 0)), empty, empty, empty))
+
+    # seeds that attracted no thesis are dropped, and labels renumbered to stay contiguous
+    used = counts > 0
+    renumber = np.cumsum(used) - 1
+    old_theme_ids = sorted(old_codes, key=old_codes.get)
+    return Assignment(
+        np.concatenate(ids),
+        renumber[np.concatenate(labels)],
+        np.concatenate(codes),
+        old_theme_ids,
+        Themes(sums[used], counts[used], first_seen[used], last_seen[used]),
+    )
+
+def name_themes(assignment: Assignment):
+    '''
+    an id for every new theme (the old id most of its members had, if still free, else a new uuid)
+    and, for every old id that is not kept, the new theme that took most of its members.
+    '''
+    old_count = max(len(assignment.old_theme_ids), 1)
+    known = assignment.old_codes >= 0
+    pairs, members = np.unique(
+        assignment.labels[known] * old_count + assignment.old_codes[known], return_counts=True
+    )
+
+    new_ids = [None] * len(assignment.themes.counts)
+    successor = {}  # old code -> new label
+    for pair in pairs[np.argsort(-members, kind="stable")]:
+        label, code = divmod(int(pair), old_count)
+        if code not in successor:
+            # the biggest share of this old theme decides both its successor and who keeps its id
+            successor[code] = label
+            if new_ids[label] is None:
+                new_ids[label] = assignment.old_theme_ids[code]
+    new_ids = [theme_id or str(uuid.uuid4()) for theme_id in new_ids]
+
+    kept = set(new_ids)
+    aliases = {
+        assignment.old_theme_ids[code]: new_ids[label]
+        for code, label in successor.items()
+        if assignment.old_theme_ids[code] not in kept
+    }
+    return new_ids, aliases
+
+def _to_datetime(seconds) -> datetime:
+    return np.datetime64(int(seconds), "s").astype(datetime)
+
+def recluster(threshold: float = None, iterations: int = None, block_rows: int = None, dry_run: bool = False) -> dict:
+    '''
+    re-cluster every thesis and (unless dry_run) write the new themes. returns before / after stats.
+    '''
+    threshold = config.RECLUSTER_THRESHOLD if threshold is None else threshold
+    iterations = max(1, iterations or config.RECLUSTER_ITERATIONS)
+    block_rows = block_rows or config.RECLUSTER_BLOCK_ROWS
+    started = time.monotonic()
+
+    with get_session() as session:
+        max_id = session.exec(select(func.max(Thesis.id))).one()
+        rows = session.exec(
+            select(Theme.id, Theme.centroid_sum, Theme.member_count, Theme.first_seen_at, Theme.last_seen_at)
+            .where(Theme.member_count > 0)
+        ).all()
+        if not max_id or not rows:
+            return {"theses": 0, "themes_before": len(rows), "themes_after": len(rows), "moved": 0}
+
+        old_codes = {row[0]: code for code, row in enumerate(rows)}
+        themes = Themes(
+            np.stack([np.asarray(row[1], dtype=np.float64) for row in rows]),
+            np.array([row[2] for row in rows], dtype=np.int64),
+            np.array([row[3] or datetime.utcnow() for row in rows], dtype="datetime64[s]").astype(np.int64),
+            np.array([row[4] or datetime.utcnow() for row in rows], dtype="datetime64[s]").astype(np.int64),
+        )
+        singletons_before = int(np.sum(themes.counts == 1))
+
+        for iteration in range(iterations):
+            merged = merge(themes, threshold, block_rows)
+            logger.info(f"Pass {iteration + 1}/{iterations}: {len(themes.counts)} themes merged into {len(merged.counts)}")
+            assignment = assign(session, max_id, normalize(merged.sums), old_codes, threshold, block_rows)
+            themes = assignment.themes
+            logger.info(f"Pass {iteration + 1}/{iterations}: {len(assignment.labels)} theses in {len(themes.counts)} themes")
+
+        new_ids, aliases = name_themes(assignment)
+        old_ids = assignment.old_theme_ids
+        moved = [
+            {"b_id": int(thesis_id), "b_theme_id": new_ids[label]}
+            for thesis_id, label, code in zip(assignment.thesis_ids.tolist(), assignment.labels.tolist(),
+                                              assignment.old_codes.tolist())
+            if code < 0 or old_ids[code] != new_ids[label]
+        ]
+        stats = {
+            "theses": len(assignment.thesis_ids),
+            "themes_before": len(rows),
+            "themes_after": len(new_ids),
+            "singletons_before": singletons_before,
+            "singletons_after": int(np.sum(themes.counts == 1)),
+            "largest_theme": int(themes.counts.max()),
+            "moved": len(moved),
+            "aliased": len(aliases),
+        }
+        if dry_run:
+            stats["seconds"] = round(time.monotonic() - started, 1)
+            return stats
+
+        write(session, max_id, assignment, new_ids, aliases, moved)
+
+    # this process' centroid and search indexes are stale now
+    from cluster import reset_theme_index
+    from search import reset_thesis_index
+    reset_theme_index()
+    reset_thesis_index()
+
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    logger.info(f"Re-clustered {stats['theses']} theses: {stats['themes_before']} -> {stats['themes_after']} themes, "
+                f"{stats['moved']} moved, in {stats['seconds']}s")
+    return stats
+
+def write(session, max_id: int, assignment: Assignment, new_ids: list[str], aliases: dict, moved: list[dict]):
+    '''
+    apply a re-clustering in one transaction: thesis theme ids, the theme table and theme aliases.
+    '''
+    themes = assignment.themes
+    sums = themes.sums.copy()
+    counts = themes.counts.copy()
+    first_seen, last_seen = themes.first_seen.copy(), themes.last_seen.copy()
+    row_of = {theme_id: row for row, theme_id in enumerate(new_ids)}
+    extra = {}  # themes created by ingests that ran during the job -> [sum, count, first, last]
+
+    # theses ingested while the job ran follow their old theme (or keep a theme that is new since)
+    for block_ids, embeddings, theme_ids, seen_at in iter_theses(session, None, WRITE_CHUNK_ROWS, after_id=max_id):
+        for thesis_id, embedding, theme_id, seen in zip(block_ids.tolist(), embeddings, theme_ids, seen_at.tolist()):
+            if theme_id is None:
+                continue
+            target = aliases.get(theme_id, theme_id)
+            if target != theme_id:
+                moved.append({"b_id": thesis_id, "b_theme_id": target})
+            if target in row_of:
+                row = row_of[target]
+                sums[row] += embedding
+                counts[row] += 1
+                first_seen[row] = min(first_seen[row], seen)
+                last_seen[row] = max(last_seen[row], seen)
+            else:
+                total = extra.setdefault(target, [np.zeros(len(embedding)), 0, seen, seen])
+                total[0] += embedding
+                total[1] += 1
+                total[2], total[3] = min(total[2], seen), max(total[3], seen)
+
+    thesis = Thesis.__table__
+    set_theme = update(thesis).where(thesis.c.id == bindparam("b_id")).values(theme_id=bindparam("b_theme_id"))
+    for start in range(0, len(moved), WRITE_CHUNK_ROWS):
+        session.connection().execute(set_theme, moved[start:start + WRITE_CHUNK_ROWS])
+
+    # a new generation tells processes that loaded the old table to reload it
+    written = {"updated_at": datetime.utcnow(), "generation": theme_generation(session) + 1}
+    theme_rows = [
+        {"id": theme_id, "centroid_sum": sums[row].astype(np.float32), "member_count": int(counts[row]),
+         "first_seen_at": _to_datetime(first_seen[row]), "last_seen_at": _to_datetime(last_seen[row]), **written}
+        for theme_id, row in row_of.items()
+    ] + [
+        {"id": theme_id, "centroid_sum": total.astype(np.float32), "member_count": count,
+         "first_seen_at": _to_datetime(first), "last_seen_at": _to_datetime(last), **written}
+        for theme_id, (total, count, first, last) in extra.items()
+    ]
+    session.execute(delete(Theme))
+    for start in range(0, len(theme_rows), WRITE_CHUNK_ROWS):
+        session.execute(insert(Theme), theme_rows[start:start + WRITE_CHUNK_ROWS])
+
+    # older aliases follow their target; ids that are themes again stop being aliases
+    alias = ThemeAlias.__table__
+    if aliases:
+        repoint = update(alias).where(alias.c.theme_id == bindparam("b_old")).values(theme_id=bindparam("b_new"))
+        session.connection().execute(repoint, [{"b_old": old, "b_new": new} for old, new in aliases.items()])
+        upsert = sqlite_insert(ThemeAlias)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["old_theme_id"],
+            set_={"theme_id": upsert.excluded.theme_id, "created_at": upsert.excluded.created_at},
+        )
+        now = datetime.utcnow()
+        items = [{"old_theme_id": old, "theme_id": new, "created_at": now} for old, new in aliases.items()]
+        for start in range(0, len(items), WRITE_CHUNK_ROWS):
+            session.execute(upsert, items[start:start + WRITE_CHUNK_ROWS])
+    live = list(row_of) + list(extra)
+    for start in range(0, len(live), 500):
+        session.execute(delete(ThemeAlias).where(ThemeAlias.old_theme_id.in_(live[start:start + 500])))
+
+    session.commit()
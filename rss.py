@@ -165,109 +165,75 @@
 # #     return {"ingested": ingested_count, "skipped": skipped_count, "total": total_entries}
 
 
-import feedparser
-from extractor import extract_thesis
-from db import get_session
-from models import Thesis
-from cluster import embed, find_matching_theme
-import re
-from html import unescape
+from models import Feed
 from datetime import datetime
 import logging
-import numpy as np
-import uuid
 import traceback
+from sqlmodel import select
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def clean_html(raw_html: str) -> str:
-    clean_text = re.sub(r'<.*?>', '', raw_html)
-    return unescape(clean_text.strip())
+def entry_key(entry) -> str:
+    '''
+    stable id of a feed entry (its guid, falling back to the link).
+    '''
+    return entry.get("id") or entry.get("link")
+
+def load_feed_states(session, urls: list[str]) -> dict:
+    '''
+    fetch state (models.Feed) for the given feed urls, keyed by url. unknown feeds are left out.
+    '''
+    states = {}
+    for start in range(0, len(urls), 500):  # stay under sqlite's bound-parameter limit
+        chunk = urls[start:start + 500]
+        for feed_state in session.exec(select(Feed).where(Feed.url.in_(chunk))):
+            states[feed_state.url] = feed_state
+    return states
+
+def record_fetch(session, url: str, status: int = None, etag: str = None, modified: str = None,
+                 entry_ids: list[str] = None):
+    '''
+    save a feed's fetch state. a 304 keeps the stored validators, and entry ids are only replaced when given.
+    the caller commits (together with the entries, so a failed ingest is retried on the next poll).
+    '''
+    feed_state = session.get(Feed, url) or Feed(url=url)
+    feed_state.last_fetched_at = datetime.utcnow()
+    feed_state.last_status = status
+    if status != 304:
+        feed_state.etag = etag
+        feed_state.last_modified = modified
+    if entry_ids is not None:
+        feed_state.last_entry_ids = entry_ids
+    session.add(feed_state)
 
 def parse_feed(url: str):
+    '''
+    ingest one feed through the streaming pipeline (see pipeline.py).
+    '''
+    # pipeline.py builds on the helpers above
+    from pipeline import ingest
+
     try:
         logger.info(f"📥 Ingesting feed: {url}")
-        feed = feedparser.parse(url)
-
-        if not feed.entries:
-            logger.warning(f"No entries found in feed: {url}")
-            return {"ingested": 0, "skipped": 0, "total": 0}
-
-        total_entries = len(feed.entries)
-        ingested_count = 0
-        skipped_count = 0
-
-        with get_session() as session:
-            for entry in feed.entries:
-                # Skip duplicate posts by URL
-                exists = session.query(Thesis).filter(Thesis.post_url == entry.link).first()
-                if exists:
-                    logger.info(f"Skipping duplicate post: {entry.link}")
-                    skipped_count += 1
-                    continue
-
-                content = entry.get("summary", "") or entry.get("content", [{}])[0].get("value", "")
-                content = clean_html(content)
-
-                if not content:
-                    logger.warning(f"Skipping: No content in post '{entry.title}'")
-                    skipped_count += 1
-                    continue
-
-                thesis_sentences = extract_thesis(content)
-
-                if not thesis_sentences:
-                    logger.warning(f"Skipping: No thesis sentences extracted for post '{entry.title}'")
-                    skipped_count += 1
-                    continue
-
-                theme_id_counts = {}
-                sentence_embeddings = []
-
-                for sentence in thesis_sentences:
-                    embedding_vec = embed(sentence)
-                    if embedding_vec is None:
-                        logger.warning(f"Skipping sentence with None embedding: '{sentence}'")
-                        continue  # skip this sentence
-                    sentence_embeddings.append(embedding_vec)
-                    theme_id = find_matching_theme(embedding_vec)
-                    theme_id_counts[theme_id] = theme_id_counts.get(theme_id, 0) + 1
-                    logger.info(f"Extracted thesis: '{sentence}' with theme_id: {theme_id}")
-
-
-                if not sentence_embeddings:
-                    logger.warning(f"No valid embeddings found for post '{entry.title}', embedding whole content instead.")
-                    avg_embedding = embed(content)
-                else:
-                    avg_embedding = np.mean(sentence_embeddings, axis=0).tolist()
-
-                # Debug logs for embedding shape and sample values
-                logger.info(f"Embedding type: {type(avg_embedding)}")
-                logger.info(f"Embedding length: {len(avg_embedding)}")
-                logger.info(f"Embedding sample (first 5 floats): {avg_embedding[:5]}")
-
-                # Parse published date
-                published = None
-                if entry.get("published_parsed"):
-                    published = datetime(*entry.published_parsed[:6])
-
-                thesis_record = Thesis(
-                    thesis_text="; ".join(thesis_sentences),
-                    post_title=entry.title,
-                    post_url=entry.link,
-                    published_at=published,
-                    embedding=avg_embedding,
-                    theme_id=theme_id,
-                )
-                session.add(thesis_record)
-                ingested_count += 1
-
-            session.commit()
-            logger.info(f"Ingested feed '{feed.feed.title}' successfully.")
-
-        return {"ingested": ingested_count, "skipped": skipped_count, "total": total_entries}
+        counts = ingest([url])["feeds"][url]
+
+        if counts.get("not_modified"):
+            logger.info(f"Feed not modified since last fetch: {url}")
+            return {"ingested": 0, "skipped": 0, "total": 0, "not_modified": True}
+        return counts
     except Exception as e:
         logger.error(f"Exception in parse_feed: {e}")
         logger.error(traceback.format_exc())
-        raise
\ No newline at end of file
+        raise
+
+def parse_feeds(urls: list[str], on_feed=None) -> dict:
+    '''
+    bulk ingest: fetch many feeds concurrently (see fetcher.py) and stream all of their entries through
+    one shared embedding/clustering pipeline (see pipeline.py), so model batches span feeds.
+    on_feed(url, counts) is called as each feed finishes (used for job progress, see jobs.py).
+    returns per-feed counts plus totals.
+    '''
+    from pipeline import ingest
+
+    return ingest(urls, on_feed)
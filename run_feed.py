@@ -2,4 +2,5 @@ from rss import parse_feed
 
 url = "https://blog.google/rss/"
 
-parse_feed(url)
+if __name__ == "__main__":
+    parse_feed(url)
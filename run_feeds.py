@@ -0,0 +1,35 @@
+'''
+bulk ingest many feeds at once (also for large backfills)
+
+usage:
+    python run_feeds.py feeds.txt          (one feed url per line, # for comments)
+    python run_feeds.py subscriptions.opml (every outline with an xmlUrl)
+    python run_feeds.py URL [URL ...]
+
+entries stream through the pipeline (see pipeline.py) and are committed in chunks, so memory stays
+flat; if a run is interrupted, run the same command again to pick up where it stopped.
+'''
+import os
+import sys
+import xml.etree.ElementTree as ET
+from rss import parse_feeds
+
+def read_opml(path: str) -> list[str]:
+    return [outline.get("xmlUrl") for outline in ET.parse(path).iter("outline") if outline.get("xmlUrl")]
+
+if __name__ == "__main__":
+    urls = []
+    for arg in sys.argv[1:]:
+        if os.path.isfile(arg) and arg.lower().endswith(".opml"):
+            urls.extend(read_opml(arg))
+        elif os.path.isfile(arg):
+            with open(arg) as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        else:
+            urls.append(arg)
+
+    if not urls:
+        sys.exit(__doc__)
+
+    result = parse_feeds(urls)
+    print(f"Ingested {result['ingested']} posts, skipped {result['skipped']} from {len(result['feeds'])} feeds ({result['failed']} failed)")
@@ -1,4 +1,5 @@
 from mock_ingest import parse_mock_posts
 
-result = parse_mock_posts()
-print(f"Ingested {result['ingested']} posts, skipped {result['skipped']}")
+if __name__ == "__main__":
+    result = parse_mock_posts()
+    print(f"Ingested {result['ingested']} posts, skipped {result['skipped']}")
@@ -0,0 +1,30 @@
+'''
+keeps all registered feeds fresh, polling each on its own adaptive schedule (see poller.py)
+
+usage:
+    python run_poller.py                    (poll every feed already in the database)
+    python run_poller.py feeds.txt URL ...  (register these feeds first; one url per line, # for comments)
+'''
+import os
+import sys
+from db import init_db
+from poller import register_feeds, run
+
+if __name__ == "__main__":
+    urls = []
+    for arg in sys.argv[1:]:
+        if os.path.isfile(arg):
+            with open(arg) as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        else:
+            urls.append(arg)
+
+    init_db()
+    if urls:
+        print(f"Registered {register_feeds(urls)} new feeds.")
+
+    print("Polling feeds, Ctrl+C to stop.")
+    try:
+        run()
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -0,0 +1,24 @@
+'''
+re-clusters every thesis into themes offline (see recluster.py)
+
+usage:
+    python run_recluster.py            (re-cluster and write the new themes)
+    python run_recluster.py --dry-run  (only report what would change)
+
+stop ingestion (api, run_worker.py, run_poller.py) while it runs, or restart it afterwards:
+running processes keep matching against the theme centroids they loaded before.
+'''
+import sys
+from db import init_db
+from recluster import recluster
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv[1:]
+
+    init_db()
+    stats = recluster(dry_run=dry_run)
+    print(f"{stats['theses']} theses: {stats['themes_before']} themes -> {stats['themes_after']}, "
+          f"{stats['moved']} theses moved" + (" (dry run, nothing written)" if dry_run else ""))
+    if "singletons_before" in stats:
+        print(f"single-post themes: {stats['singletons_before']} -> {stats['singletons_after']}, "
+              f"largest theme: {stats['largest_theme']} posts, {stats['aliased']} old ids redirected")
@@ -0,0 +1,27 @@
+'''
+runs ingest workers outside the web app, so they can be scaled separately from it
+
+usage:
+    python run_worker.py           (INGEST_WORKERS threads, at least 1)
+    python run_worker.py 4         (4 worker threads)
+
+set INGEST_WORKERS=0 on the web app to leave all jobs to these processes.
+'''
+import sys
+import time
+import config
+from db import init_db
+from jobs import start_workers, stop_workers
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(config.INGEST_WORKERS, 1)
+
+    init_db()
+    start_workers(workers)
+    print(f"Running {workers} ingest workers, Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Stopping after the running jobs finish...")
+        stop_workers()
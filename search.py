@@ -0,0 +1,238 @@
+'''
+semantic search over theses (GET /search)
+
+- every thesis embedding sits in one in-memory VectorIndex (index.py), labelled with the thesis id,
+  so a query is one embedding plus a matrix product; the embedding column is never read per request
+- the index is loaded from the db once, LOAD_BLOCK_ROWS theses at a time (keyset on id), on the
+  first search or at startup with SEARCH_PRELOAD=1. pipeline.persist appends theses as their chunk
+  commits, so new posts are searchable right away without a reload
+- SEARCH_INDEX_MODE=ivf (default) only scores the SEARCH_INDEX_NPROBE closest k-means lists, which
+  keeps queries in the low milliseconds at a million theses (approximate; "exact" scans every row)
+- filters: an array parallel to the rows holds each thesis' date (published, else ingested), so a
+  date range is one numpy mask; the rows of each theme are listed, so a theme filter scores only
+  those rows, exactly
+- an offline re-clustering rewrites theme ids (recluster.py). searches notice the new theme
+  generation within THEME_INDEX_REFRESH seconds and load a fresh index in the background; the old
+  one keeps answering until the new one is ready
+
+'''
+
+from datetime import datetime, timezone
+from sqlmodel import select, func
+from index import VectorIndex
+from db import get_session, theme_generation
+from models import Thesis
+from encoder import encode
+import numpy as np
+import config
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOAD_BLOCK_ROWS = 10000
+_EPOCH = datetime(1970, 1, 1)
+
+_index = None
+_pending = None  # replacement being loaded after a re-clustering
+_index_lock = threading.Lock()
+_next_generation_check = 0.0  # time.monotonic()
+
+def timestamp(moment: datetime) -> int:
+    '''
+    seconds since the epoch; naive datetimes are utc, like the stored ones.
+    '''
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((moment - _EPOCH).total_seconds())
+
+class ThesisIndex:
+    def __init__(self):
+        self.vectors = VectorIndex(config.SEARCH_INDEX_MODE, config.SEARCH_INDEX_NLIST, config.SEARCH_INDEX_NPROBE)
+        self.ready = threading.Event()
+        self.failed = False
+        self.generation = 0  # db.theme_generation() of the theme ids it holds
+
+        self._lock = threading.Lock()
+        self._dates = np.zeros(0, dtype=np.int64)  # row -> timestamp()
+        self._theme_rows = {}  # theme id -> its rows
+        self._loaded_until = 0  # highest thesis id read by load()
+        self._added = set()  # ids above _loaded_until that are already in the index
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def add(self, theses: list[tuple], loading: bool = False):
+        '''
+        append (thesis id, embedding, theme id, date) tuples, skipping ones already in the index
+        (a chunk committed while load() runs can reach both).
+        '''
+        with self._lock:
+            fresh = [thesis for thesis in theses if thesis[0] > self._loaded_until and thesis[0] not in self._added]
+            if fresh:
+                ids, embeddings, theme_ids, dates = zip(*fresh)
+                start = self.vectors.add(np.asarray(embeddings, dtype=np.float32), ids)
+                end = start + len(fresh)
+                if end > len(self._dates):
+                    self._dates = np.resize(self._dates, max(end, 2 * len(self._dates), 1024))
+                self._dates[start:end] = [timestamp(date) for date in dates]
+
+                for offset, theme_id in enumerate(theme_ids):
+                    if theme_id is not None:
+                        self._theme_rows.setdefault(theme_id, []).append(start + offset)
+
+            if loading:
+                self._loaded_until = theses[-1][0]
+                self._added = {thesis_id for thesis_id in self._added if thesis_id > self._loaded_until}
+            else:
+                self._added.update(thesis[0] for thesis in fresh)
+
+    def load(self):
+        started = time.monotonic()
+        with get_session() as session:
+            self.generation = theme_generation(session)
+        after = 0
+        while True:
+            with get_session() as session:
+                rows = session.exec(
+                    select(Thesis.id, Thesis.embedding, Thesis.theme_id,
+                           func.coalesce(Thesis.published_at, Thesis.ingested_at))
+                    .where(Thesis.id > after, Thesis.embedding != None)
+                    .order_by(Thesis.id)
+                    .limit(LOAD_BLOCK_ROWS)
+                ).all()
+            if not rows:
+                break
+            self.add(rows, loading=True)
+            after = rows[-1][0]
+        logger.info(f"Loaded search index with {len(self)} theses ({self.vectors.mode} mode) "
+                    f"in {time.monotonic() - started:.1f}s")
+
+    def search(self, vector, k: int, theme_id: str = None, since: datetime = None, until: datetime = None) -> list[tuple]:
+        '''
+        up to k (thesis id, cosine similarity) pairs, best first, within the theme / date range if given.
+        '''
+        with self._lock:
+            size = len(self.vectors)
+            rows = None
+            if theme_id is not None:
+                if theme_id not in self._theme_rows:
+                    return []
+                rows = list(self._theme_rows[theme_id])
+
+            mask = None
+            if since is not None or until is not None:
+                dates = self._dates[:size]
+                mask = np.ones(size, dtype=bool)
+                if since is not None:
+                    mask &= dates >= timestamp(since)
+                if until is not None:
+                    mask &= dates <= timestamp(until)
+
+        return self.vectors.search(vector, k, rows=rows, mask=mask)
+
+def get_thesis_index() -> ThesisIndex:
+    '''
+    return the shared thesis index, loading it on first use (other callers wait for the load).
+    '''
+    global _index
+    with _index_lock:
+        index, load = _index, _index is None
+        if load:
+            # published before loading, so chunks committed during the load are added too
+            index = _index = ThesisIndex()
+
+    if load:
+        try:
+            index.load()
+        except BaseException:
+            with _index_lock:
+                if _index is index:
+                    _index = None
+            index.failed = True
+            raise
+        finally:
+            index.ready.set()
+    else:
+        index.ready.wait()
+        if index.failed:
+            raise RuntimeError("Loading the search index failed, see the logs")
+    return index
+
+def preload():
+    '''
+    load the index in a background thread (SEARCH_PRELOAD), so the first search doesn't wait for it.
+    '''
+    threading.Thread(target=get_thesis_index, name="search-index-load", daemon=True).start()
+
+def _reload():
+    global _index, _pending
+    index = _pending
+    try:
+        index.load()
+    except Exception as e:
+        logger.error(f"Reloading the search index failed, keeping the old one: {e}")
+        with _index_lock:
+            if _pending is index:
+                _pending = None
+        return
+    index.ready.set()
+    with _index_lock:
+        if _pending is index:
+            _index, _pending = index, None
+
+def _check_generation(index: ThesisIndex):
+    '''
+    start loading a replacement index in the background if the theme table was rebuilt since
+    index was loaded. checks the db at most every THEME_INDEX_REFRESH seconds.
+    '''
+    global _pending, _next_generation_check
+    if not config.THEME_INDEX_REFRESH:
+        return
+    with _index_lock:
+        if _pending is not None or time.monotonic() < _next_generation_check:
+            return
+        _next_generation_check = time.monotonic() + config.THEME_INDEX_REFRESH
+    with get_session() as session:
+        generation = theme_generation(session)
+    if generation == index.generation:
+        return
+
+    with _index_lock:
+        if _index is not index or _pending is not None:
+            return
+        _pending = ThesisIndex()
+    logger.info("Theme table was rebuilt (re-clustering), reloading the search index in the background")
+    threading.Thread(target=_reload, name="search-index-reload", daemon=True).start()
+
+def add_theses(theses: list[tuple]):
+    '''
+    make newly committed (thesis id, embedding, theme id, date) tuples searchable. does nothing
+    before the first search; the load reads them from the db then.
+    '''
+    if not theses:
+        return
+    for index in (_index, _pending):  # a replacement that is loading gets them too
+        if index is not None:
+            index.add(theses)
+
+def reset_thesis_index():
+    '''
+    drop the loaded index (after theme ids were rewritten, see recluster.py); the next search loads it again.
+    '''
+    global _index, _pending
+    with _index_lock:
+        _index = _pending = None
+
+def find_theses(query: str, k: int = 10, theme_id: str = None, since: datetime = None,
+                until: datetime = None) -> list[tuple]:
+    '''
+    embed the query once and return up to k (thesis id, score) pairs, best first.
+    '''
+    index = get_thesis_index()
+    _check_generation(index)
+    if not len(index):
+        return []
+    return index.search(encode(query), k, theme_id, since, until)
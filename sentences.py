@@ -0,0 +1,96 @@
+'''
+sentence splitting for thesis extraction
+
+- SENTENCE_SPLITTER picks the splitter per deployment:
+  - "punkt" (default): nltk's punkt model, the most accurate
+  - "regex": a rule-based splitter with no data files, several times faster, good enough for
+    clean prose (it knows the common abbreviations, not much more)
+- nothing happens at import time: the punkt model is looked up on first use, once per process,
+  from NLTK_DATA (if set) and nltk's usual data directories
+- it is never downloaded unless NLTK_AUTO_DOWNLOAD=1, so air-gapped hosts don't stall on a network
+  check; the Dockerfile bakes punkt into the image, elsewhere run
+  `python -m nltk.downloader punkt_tab punkt` once
+
+'''
+
+import re
+import threading
+import logging
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_punkt = None
+_punkt_lock = threading.Lock()
+
+# candidate boundary: end punctuation (plus closing quotes/brackets), whitespace, then something that
+# can start a sentence
+_BOUNDARY = re.compile(r"""[.!?]+["'’”)\]]*\s+(?=["'‘“(\[]?[A-Z0-9])""")
+_ABBREVIATION = re.compile(
+    r"(?:\b(?:Mr|Mrs|Ms|Dr|Prof|Sr|Jr|St|Mt|vs|etc|Inc|Ltd|Co|Corp|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec|"
+    r"No|Fig|approx|al)|\b[A-Z]|\b(?:[a-zA-Z]\.)+[a-zA-Z])\.$"
+)
+
+def _load_punkt():
+    '''
+    the punkt tokenizer: punkt_tab on current nltk, the pickled model on older versions.
+    '''
+    import nltk
+
+    if config.NLTK_DATA and config.NLTK_DATA not in nltk.data.path:
+        nltk.data.path.insert(0, config.NLTK_DATA)
+
+    try:
+        from nltk.tokenize import PunktTokenizer  # nltk >= 3.8.2
+        resource, load = "punkt_tab", lambda: PunktTokenizer("english")
+    except ImportError:
+        resource, load = "punkt", lambda: nltk.data.load("tokenizers/punkt/english.pickle")
+
+    try:
+        nltk.data.find(f"tokenizers/{resource}")
+    except LookupError:
+        if not config.NLTK_AUTO_DOWNLOAD:
+            raise LookupError(
+                f"nltk resource '{resource}' not found (searched {nltk.data.path}). Run "
+                f"`python -m nltk.downloader {resource}`, point NLTK_DATA at a directory that has it, "
+                f"set NLTK_AUTO_DOWNLOAD=1 or use SENTENCE_SPLITTER=regex."
+            ) from None
+        logger.info(f"Downloading nltk resource '{resource}'")
+        nltk.download(resource, download_dir=config.NLTK_DATA or None, quiet=True)
+
+    return load()
+
+def punkt_split(text: str) -> list[str]:
+    global _punkt
+    if _punkt is None:
+        with _punkt_lock:
+            if _punkt is None:
+                _punkt = _load_punkt()
+    return _punkt.tokenize(text)
+
+def regex_split(text: str) -> list[str]:
+    sentences = []
+    start = 0
+    for boundary in _BOUNDARY.finditer(text):
+        candidate = text[start:boundary.end()].rstrip()
+        if _ABBREVIATION.search(candidate):
+            continue
+        sentences.append(candidate)
+        start = boundary.end()
+
+    rest = text[start:].strip()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+SPLITTERS = {"punkt": punkt_split, "regex": regex_split}
+
+def split(text: str) -> list[str]:
+    '''
+    split text into sentences with the configured SENTENCE_SPLITTER.
+    '''
+    splitter = SPLITTERS.get(config.SENTENCE_SPLITTER)
+    if splitter is None:
+        raise ValueError(f"Unknown SENTENCE_SPLITTER '{config.SENTENCE_SPLITTER}', expected one of {sorted(SPLITTERS)}")
+    return splitter(text)
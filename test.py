@@ -6,8 +6,9 @@ However, concerns about ethics and bias remain. Responsible development is cruci
 Open source communities are leading the way in transparent AI development.
 """
 
-thesis = extract_thesis(sample_post)
+if __name__ == "__main__":
+    thesis = extract_thesis(sample_post)
 
-print("Thesis Sentences:")
-for sentence in thesis:
-    print("-", sentence)
+    print("Thesis Sentences:")
+    for sentence in thesis:
+        print("-", sentence)
@@ -0,0 +1,46 @@
+'''
+url helpers used for post idempotency
+
+- normalize_url turns the many spellings of one post url into a single canonical form
+  (lowercase scheme/host, no default port, no fragment, no tracking parameters, sorted query,
+  no trailing slash). user info and ipv6 brackets are kept, and a url it can't parse (a bad port)
+  is kept as written, so a malformed link never stops an ingest
+- url_hash is the fixed-size key stored in Thesis.url_hash, which has a unique index
+
+'''
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_hsenc", "_hsmi", "igshid"}
+
+def normalize_url(url: str) -> str:
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        # e.g. an unclosed ipv6 bracket: the link is only ever compared, so keep it as it is
+        return url.strip()
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        # a malformed port (http://host:abc/): keep the netloc as given rather than guess
+        netloc = parts.netloc
+    else:
+        host = (parts.hostname or "").lower()
+        if ":" in host:
+            host = f"[{host}]"  # ipv6 literal
+        if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+            host = f"{host}:{port}"
+        userinfo = parts.netloc.rpartition("@")[0] if "@" in parts.netloc else ""
+        netloc = f"{userinfo}@{host}" if userinfo else host
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+def url_hash(url: str) -> str:
+    return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
@@ -0,0 +1,86 @@
+'''
+compact binary storage for embedding vectors
+
+- vectors are stored as little-endian blobs instead of json text (a 384-dim float32 vector is
+  ~1.5 KB instead of ~8 KB of decimal text)
+- every blob starts with a 4-byte header: b"V", format version, dtype code, reserved
+    - "f": float32, data follows the header
+    - "e": float16, data follows the header (half the size, ~3 significant digits)
+    - "b": int8, a float32 scale follows the header, then the quantized data (a quarter of the size)
+- float32/float16 blobs decode zero-copy with np.frombuffer; int8 is dequantized on read
+- EmbeddingBlob is the sqlalchemy column type; it still reads json text written by older versions
+  (db.migrate() converts those rows in place)
+
+'''
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+import numpy as np
+import json
+
+MAGIC = b"V"
+VERSION = 1
+HEADER_SIZE = 4
+DTYPES = {"float32": (b"f", "<f4"), "float16": (b"e", "<f2"), "int8": (b"b", "i1")}
+CODES = {code: name for name, (code, _) in DTYPES.items()}
+
+def pack(vector, dtype: str = "float32") -> bytes:
+    '''
+    encode a vector (list or array) as a header + little-endian blob.
+    '''
+    code, numpy_dtype = DTYPES[dtype]
+    values = np.asarray(vector, dtype=np.float32)
+    header = MAGIC + bytes([VERSION]) + code + b"\0"
+
+    if dtype == "int8":
+        scale = float(np.abs(values).max()) / 127 if values.size else 0.0
+        quantized = np.round(values / scale) if scale else np.zeros_like(values)
+        return header + np.float32(scale).astype("<f4").tobytes() + quantized.astype(numpy_dtype).tobytes()
+
+    return header + values.astype(numpy_dtype).tobytes()
+
+def unpack(blob: bytes) -> np.ndarray:
+    '''
+    decode a blob written by pack(). float32 comes back as a read-only view on the blob (no copy).
+    '''
+    if blob[:1] != MAGIC:
+        raise ValueError("Not a packed embedding")
+    dtype = CODES[blob[2:3]]
+    numpy_dtype = DTYPES[dtype][1]
+
+    if dtype == "int8":
+        scale = np.frombuffer(blob, dtype="<f4", count=1, offset=HEADER_SIZE)[0]
+        return np.frombuffer(blob, dtype=numpy_dtype, offset=HEADER_SIZE + 4).astype(np.float32) * scale
+
+    vector = np.frombuffer(blob, dtype=numpy_dtype, offset=HEADER_SIZE)
+    return vector if dtype == "float32" else vector.astype(np.float32)
+
+class EmbeddingBlob(TypeDecorator):
+    '''
+    column type storing an embedding as a packed blob. binds lists or arrays, returns float32 arrays.
+    '''
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype: str = "float32"):
+        super().__init__()
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown embedding storage dtype: {dtype}")
+        self.dtype = dtype
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return pack(value, self.dtype)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # json text from before the binary format (not migrated yet)
+            decoded = json.loads(value)
+            return None if decoded is None else np.asarray(decoded, dtype=np.float32)
+        return unpack(bytes(value))
+
+    def compare_values(self, x, y):
+        # arrays don't compare with ==, and a reassigned embedding always counts as changed
+        return x is y